@@ -19,75 +19,122 @@
 import asyncio
 import logging
 import math
+import time
 from datetime import timedelta
+from typing import Any
 
 import ideenergy
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers.aiohttp_client import async_get_clientsession
 from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.helpers.event import (
+    async_call_later,
+    async_track_time_change,
+    async_track_time_interval,
+)
 
-from .barrier import TimeDeltaBarrier, TimeWindowBarrier  # NoopBarrier,
+from .barrier import (  # NoopBarrier, TimeWindowBarrier
+    AdaptiveTimeWindowBarrier,
+    BackoffBarrier,
+    Barrier,
+    CircuitBreaker,
+    PublishTimeBarrier,
+)
 from .const import (
     API_USER_SESSION_TIMEOUT,
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_OPEN_PERIOD,
     CONF_CONTRACT,
+    CONF_TIMEZONE,
+    DATA_API_HANDOFF,
+    DATA_CIRCUIT_BREAKERS,
+    DATA_RELOAD_HANDOFF,
+    DATA_SCHEDULER,
+    DATA_STARTUP_QUEUE,
     DOMAIN,
+    GAP_SCAN_INTERVAL,
+    GAP_SCAN_STARTUP_DELAY,
+    HISTORICAL_INITIAL_BACKOFF,
+    HISTORICAL_MAX_BACKOFF,
+    HISTORICAL_PUBLISH_LATE_RETRY,
+    HISTORICAL_PUBLISH_MAX_EMPTY,
+    HISTORICAL_PUBLISH_RETRY,
+    HISTORICAL_PUBLISH_SPREAD,
     MAX_RETRIES,
     MEASURE_MAX_AGE,
+    MEASURE_STAGGER,
     MIN_SCAN_INTERVAL,
+    RELOAD_HANDOFF_MAX_AGE,
+    SESSION_WARMUP_LEAD,
+    STARTUP_MAX_CONCURRENT,
     UPDATE_WINDOW_END_MINUTE,
     UPDATE_WINDOW_START_MINUTE,
 )
 from .datacoordinator import DataSetType, IDeCoordinator
+from .gaps import GapFiller, async_remove_gaps_store
+from .scheduler import Scheduler
+from .services import async_setup_services
+from .startup import StartupQueue
+from .tzconv import zoneinfo_for_contract
 from .updates import update_integration
 
 PLATFORMS: list[str] = ["sensor"]
 
 _LOGGER = logging.getLogger(__name__)
 
+CONFIG_SCHEMA = cv.config_entry_only_config_schema(DOMAIN)
 
-async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    api = IDeEnergyAPI(hass, entry)
 
-    try:
-        contract_details = await api.get_contract_details()
-    except ideenergy.client.ClientError as e:
-        _LOGGER.debug(f"Unable to initialize integration: {e}")
-        return False
+async def async_setup(hass: HomeAssistant, config: dict) -> bool:
+    await async_setup_services(hass)
+    return True
+
+
+async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    # A reload with the same credentials and contract takes over the previous
+    # coordinator state and client, without a single API call
+    handoff = _pop_reload_handoff(hass, entry)
+    if handoff is not None:
+        previous, contract_details = handoff
+        api = previous.api
+        _LOGGER.debug(f"{api}: reusing client and coordinator state from reload")
+
+    else:
+        previous = None
+        api = IDeEnergyAPI(hass, entry)
+
+        # Serialized with the setup of other entries of the same account
+        startup_queue = _get_startup_queue(hass)
+        try:
+            contract_details = await startup_queue.async_get_contract_details(api)
+        except ideenergy.client.ClientError as e:
+            _LOGGER.debug(f"Unable to initialize integration: {e}")
+            return False
 
     device_info = IDeEnergyDeviceInfo(contract_details)
 
     coordinator = IDeCoordinator(
         hass=hass,
         api=api,
-        barriers={
-            DataSetType.MEASURE: TimeWindowBarrier(
-                allowed_window_minutes=(
-                    UPDATE_WINDOW_START_MINUTE,
-                    UPDATE_WINDOW_END_MINUTE,
-                ),
-                max_retries=MAX_RETRIES,
-                max_age=timedelta(seconds=MEASURE_MAX_AGE),
-            ),
-            DataSetType.HISTORICAL_CONSUMPTION: TimeDeltaBarrier(
-                delta=timedelta(hours=6)
-            ),
-            DataSetType.HISTORICAL_GENERATION: TimeDeltaBarrier(
-                delta=timedelta(hours=6)
-            ),
-            DataSetType.HISTORICAL_POWER_DEMAND: TimeDeltaBarrier(
-                delta=timedelta(hours=36)
-            ),
-        },
+        barriers=_build_barriers(),
         # Use default update_interval and relay on barriers for now
         # MEASURE barrier should deny if last attempt (success or not) is too recent to
         # prevent api smashing or subsequent baning
         update_interval=_calculate_datacoordinator_update_interval(),
         # update_interval=timedelta(seconds=30),
+        breaker=_get_account_circuit_breaker(hass, entry.data[CONF_USERNAME]),
+        zoneinfo=zoneinfo_for_contract(
+            contract_details, entry.options.get(CONF_TIMEZONE)
+        ),
     )
 
+    if previous is not None:
+        coordinator.adopt(previous)
+
     # Don't refresh coordinator yet since there isn't any sensor registered
     # await coordinator.async_refresh()
 
@@ -104,8 +151,57 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
                 hass.config_entries.async_forward_entry_setup(entry, platform)
             )
 
+    # Give MEASURE barrier a chance to attempt at each minute of the update window,
+    # user session is renewed just before the attempt
+    entry.async_on_unload(
+        async_track_time_change(
+            hass,
+            coordinator.async_prepare_measure_attempt,
+            minute=[
+                (x - 1) % 60
+                for x in range(UPDATE_WINDOW_START_MINUTE, UPDATE_WINDOW_END_MINUTE + 1)
+            ],
+            second=60 - SESSION_WARMUP_LEAD,
+        )
+    )
+    # Spread entries over their update windows
+    scheduler = hass.data[DOMAIN].setdefault(DATA_SCHEDULER, Scheduler())
+    entry.async_on_unload(
+        scheduler.register(entry.entry_id, coordinator.set_schedule_phase)
+    )
+
+    # Look for missing hours in historical statistics once a day
+    gap_filler = GapFiller(hass, coordinator, entry.entry_id)
+
+    @callback
+    def _async_schedule_gap_filling(now) -> None:
+        hass.async_create_background_task(
+            gap_filler.async_fill(), name=f"{DOMAIN} gap filling {entry.entry_id}"
+        )
+
+    entry.async_on_unload(
+        async_call_later(hass, GAP_SCAN_STARTUP_DELAY, _async_schedule_gap_filling)
+    )
+    entry.async_on_unload(
+        async_track_time_interval(
+            hass,
+            _async_schedule_gap_filling,
+            timedelta(seconds=GAP_SCAN_INTERVAL),
+        )
+    )
+
     entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
+    # Handed over to the next setup once the entry is successfully unloaded. Unload
+    # callbacks can't be used for this: HA runs them after async_unload_entry
+    # returns, whatever the result
+    hass.data[DOMAIN].setdefault(DATA_RELOAD_HANDOFF, {})[entry.entry_id] = (
+        _reload_handoff_key(entry),
+        coordinator,
+        contract_details,
+        None,
+    )
+
     return True
 
 
@@ -123,12 +219,129 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     if unloaded:
         hass.data[DOMAIN].pop(entry.entry_id)
 
+        handoffs = hass.data[DOMAIN].get(DATA_RELOAD_HANDOFF, {})
+        if entry.entry_id in handoffs:
+            key, coordinator, contract_details, _ = handoffs[entry.entry_id]
+            handoffs[entry.entry_id] = handoff = (
+                key,
+                coordinator,
+                contract_details,
+                time.monotonic(),
+            )
+
+            @callback
+            def _expire_handoff(_now) -> None:
+                # Entry wasn't set up again (i.e. disabled), don't hold the
+                # coordinator forever
+                if handoffs.get(entry.entry_id) is handoff:
+                    del handoffs[entry.entry_id]
+
+            async_call_later(hass, RELOAD_HANDOFF_MAX_AGE, _expire_handoff)
+
     return unloaded
 
 
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
-    await async_unload_entry(hass, entry)
-    await async_setup_entry(hass, entry)
+    # Through config entries so unload callbacks run
+    await hass.config_entries.async_reload(entry.entry_id)
+
+
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    hass.data.get(DOMAIN, {}).get(DATA_RELOAD_HANDOFF, {}).pop(entry.entry_id, None)
+
+    # Circuit breakers are shared by the entries of an account, drop it with the
+    # last one
+    username = entry.data[CONF_USERNAME]
+    if not any(
+        x.data[CONF_USERNAME] == username
+        for x in hass.config_entries.async_entries(DOMAIN)
+        if x.entry_id != entry.entry_id
+    ):
+        hass.data.get(DOMAIN, {}).get(DATA_CIRCUIT_BREAKERS, {}).pop(username, None)
+
+    await async_remove_gaps_store(hass, entry.entry_id)
+
+
+def _reload_handoff_key(entry: ConfigEntry) -> tuple[Any, ...]:
+    return (
+        entry.data[CONF_USERNAME],
+        entry.data[CONF_PASSWORD],
+        entry.data[CONF_CONTRACT],
+    )
+
+
+def _pop_reload_handoff(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> tuple[IDeCoordinator, dict[str, Any]] | None:
+    handoffs = hass.data.get(DOMAIN, {}).get(DATA_RELOAD_HANDOFF, {})
+    handoff = handoffs.pop(entry.entry_id, None)
+    if handoff is None:
+        return None
+
+    key, coordinator, contract_details, unloaded_at = handoff
+    if key != _reload_handoff_key(entry):
+        _LOGGER.debug(f"{entry.entry_id}: credentials changed, not reusing client")
+        return None
+
+    # Still loaded (unload failed) or unloaded long ago
+    if unloaded_at is None or time.monotonic() - unloaded_at > RELOAD_HANDOFF_MAX_AGE:
+        return None
+
+    return coordinator, contract_details
+
+
+def _build_barriers() -> dict[DataSetType, Barrier]:
+    return {
+        DataSetType.MEASURE: AdaptiveTimeWindowBarrier(
+            allowed_window_minutes=(
+                UPDATE_WINDOW_START_MINUTE,
+                UPDATE_WINDOW_END_MINUTE,
+            ),
+            max_retries=MAX_RETRIES,
+            max_age=timedelta(seconds=MEASURE_MAX_AGE),
+            stagger=timedelta(seconds=MEASURE_STAGGER),
+        ),
+        DataSetType.HISTORICAL_CONSUMPTION: PublishTimeBarrier(
+            delta=timedelta(seconds=HISTORICAL_PUBLISH_RETRY),
+            initial_backoff=timedelta(seconds=HISTORICAL_INITIAL_BACKOFF),
+            max_backoff=timedelta(seconds=HISTORICAL_MAX_BACKOFF),
+            spread=timedelta(seconds=HISTORICAL_PUBLISH_SPREAD),
+            late_delta=timedelta(seconds=HISTORICAL_PUBLISH_LATE_RETRY),
+            max_empty_attempts=HISTORICAL_PUBLISH_MAX_EMPTY,
+        ),
+        DataSetType.HISTORICAL_GENERATION: PublishTimeBarrier(
+            delta=timedelta(seconds=HISTORICAL_PUBLISH_RETRY),
+            initial_backoff=timedelta(seconds=HISTORICAL_INITIAL_BACKOFF),
+            max_backoff=timedelta(seconds=HISTORICAL_MAX_BACKOFF),
+            spread=timedelta(seconds=HISTORICAL_PUBLISH_SPREAD),
+            late_delta=timedelta(seconds=HISTORICAL_PUBLISH_LATE_RETRY),
+            max_empty_attempts=HISTORICAL_PUBLISH_MAX_EMPTY,
+        ),
+        DataSetType.HISTORICAL_POWER_DEMAND: BackoffBarrier(
+            delta=timedelta(hours=36),
+            initial_backoff=timedelta(seconds=HISTORICAL_INITIAL_BACKOFF),
+            max_backoff=timedelta(seconds=HISTORICAL_MAX_BACKOFF),
+        ),
+    }
+
+
+def _get_account_circuit_breaker(hass: HomeAssistant, username: str) -> CircuitBreaker:
+    breakers = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_CIRCUIT_BREAKERS, {})
+    if username not in breakers:
+        breakers[username] = CircuitBreaker(
+            failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+            open_period=timedelta(seconds=CIRCUIT_BREAKER_OPEN_PERIOD),
+        )
+
+    return breakers[username]
+
+
+def _get_startup_queue(hass: HomeAssistant) -> StartupQueue:
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_STARTUP_QUEUE not in domain_data:
+        domain_data[DATA_STARTUP_QUEUE] = StartupQueue(STARTUP_MAX_CONCURRENT)
+
+    return domain_data[DATA_STARTUP_QUEUE]
 
 
 def _calculate_datacoordinator_update_interval() -> timedelta:
@@ -147,8 +360,9 @@ def _calculate_datacoordinator_update_interval() -> timedelta:
 async def async_migrate_entry(hass: HomeAssistant, entry: ConfigEntry):
     api = IDeEnergyAPI(hass, entry)
 
+    startup_queue = _get_startup_queue(hass)
     try:
-        contract_details = await api.get_contract_details()
+        contract_details = await startup_queue.async_get_contract_details(api)
     except ideenergy.client.ClientError as e:
         _LOGGER.debug(f"Unable to initialize integration: {e}")
         return False
@@ -168,6 +382,13 @@ def IDeEnergyDeviceInfo(contract_details):
 
 
 def IDeEnergyAPI(hass: HomeAssistant, entry: ConfigEntry):
+    # Reuse the client authenticated by the config flow if any
+    handoff = hass.data.get(DOMAIN, {}).get(DATA_API_HANDOFF, {})
+    api = handoff.pop((entry.data[CONF_USERNAME], entry.data[CONF_CONTRACT]), None)
+    if api is not None:
+        _LOGGER.debug(f"{api}: reusing client from config flow")
+        return api
+
     return ideenergy.Client(
         session=async_get_clientsession(hass),
         username=entry.data[CONF_USERNAME],
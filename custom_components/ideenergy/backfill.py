@@ -0,0 +1,309 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+from collections.abc import Iterator
+from datetime import date, datetime, time, timedelta
+from typing import Any
+
+import ideenergy
+from homeassistant.components import recorder
+from homeassistant.components.recorder.models import StatisticMetaData
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import Store
+from homeassistant_historical_sensor import HistoricalState
+
+from .barrier import (
+    BackoffBarrier,
+    BackoffBarrierDenyError,
+    Barrier,
+    BarrierDeniedError,
+)
+from .const import (
+    BACKFILL_MAX_FAILURES,
+    BACKFILL_WINDOW_DELAY,
+    DOMAIN,
+    HISTORICAL_MAX_BACKOFF,
+)
+from .datacoordinator import DataSetType, IDeCoordinator
+from .importer import StatisticsImporter, get_statistic_lock
+from .offload import async_convert
+from .sensor import historical_states_from_historical_api_data
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = f"{DOMAIN}.backfill"
+
+# Seconds between checks while waiting for the pacing barrier
+_BARRIER_POLL_INTERVAL = 10
+
+# Names used in stored checkpoint keys, only historical datasets can be backfilled
+_CHECKPOINT_NAMES: dict[DataSetType, str] = {
+    DataSetType.HISTORICAL_CONSUMPTION: "historical_consumption",
+    DataSetType.HISTORICAL_GENERATION: "historical_generation",
+}
+
+
+def month_windows(start: date, end: date) -> Iterator[tuple[date, date]]:
+    """Split [start, end) into windows not crossing month boundaries"""
+    curr = start
+    while curr < end:
+        next_month = (curr.replace(day=1) + timedelta(days=32)).replace(day=1)
+        window_end = min(next_month, end)
+        yield curr, window_end
+        curr = window_end
+
+
+class BackfillCheckpoints:
+    """Persistent progress of backfills, one per config entry and dataset"""
+
+    def __init__(self, hass: HomeAssistant):
+        self._store: Store[dict[str, Any]] = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._data: dict[str, Any] | None = None
+
+    async def _async_get_data(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = await self._store.async_load() or {}
+
+        return self._data
+
+    @staticmethod
+    def _key(entry_id: str, dataset: DataSetType) -> str:
+        return f"{entry_id}-{_CHECKPOINT_NAMES[dataset]}"
+
+    async def async_get(
+        self, entry_id: str, dataset: DataSetType, start: date, end: date
+    ) -> date | None:
+        """Returns where a previous backfill of the same range stopped"""
+        data = await self._async_get_data()
+
+        checkpoint = data.get(self._key(entry_id, dataset))
+        if not checkpoint:
+            return None
+
+        if checkpoint["start"] != start.isoformat() or checkpoint["end"] != (
+            end.isoformat()
+        ):
+            return None
+
+        return date.fromisoformat(checkpoint["next"])
+
+    async def async_set(
+        self, entry_id: str, dataset: DataSetType, start: date, end: date, next: date
+    ) -> None:
+        data = await self._async_get_data()
+        data[self._key(entry_id, dataset)] = {
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "next": next.isoformat(),
+        }
+        await self._store.async_save(data)
+
+    async def async_remove(self, entry_id: str, dataset: DataSetType) -> None:
+        data = await self._async_get_data()
+        if data.pop(self._key(entry_id, dataset), None) is not None:
+            await self._store.async_save(data)
+
+
+def find_statistics_sensor(coordinator: IDeCoordinator, dataset: DataSetType):
+    """Returns the registered sensor writing statistics for dataset, if any"""
+    return next(
+        (
+            x
+            for x in coordinator.sensors
+            if dataset in x.I_DE_DATA_SETS and hasattr(x, "get_statistic_metadata")
+        ),
+        None,
+    )
+
+
+class BackfillStopped(Exception):
+    pass
+
+
+def make_pacing_barrier() -> BackoffBarrier:
+    """Barrier to pace calls made outside the regular updates and back off on failures"""
+    return BackoffBarrier(
+        delta=timedelta(seconds=BACKFILL_WINDOW_DELAY),
+        initial_backoff=timedelta(seconds=BACKFILL_WINDOW_DELAY),
+        max_backoff=timedelta(seconds=HISTORICAL_MAX_BACKOFF),
+    )
+
+
+async def async_fetch_window_states(
+    coordinator: IDeCoordinator,
+    dataset: DataSetType,
+    barrier: BackoffBarrier,
+    window_start: date,
+    window_end: date,
+    dataset_barrier: Barrier | None = None,
+) -> list[HistoricalState]:
+    """Fetch historical states for days in [window_start, window_end)
+
+    Waits for the pacing barrier and retries failed calls. Raises BackfillStopped if
+    the account circuit breaker denies the call or after too many failures.
+
+    If dataset_barrier (the one of regular updates) is given failures are reported
+    to it too, and BackfillStopped is raised while it's backing off.
+    """
+    failures = 0
+
+    while True:
+        if dataset_barrier is not None:
+            # Other denials are about recent data being up to date, not about
+            # i-DE failing
+            try:
+                dataset_barrier.check()
+            except BarrierDeniedError as deny:
+                if deny.code is BackoffBarrierDenyError.BACKOFF:
+                    raise BackfillStopped(deny.reason) from deny
+
+        try:
+            barrier.check()
+        except BarrierDeniedError:
+            await asyncio.sleep(_BARRIER_POLL_INTERVAL)
+            continue
+
+        try:
+            data = await coordinator.async_fetch_historical_range(
+                dataset,
+                start=datetime.combine(window_start, time()),
+                end=datetime.combine(window_end, time()),
+            )
+
+        except BarrierDeniedError as deny:
+            raise BackfillStopped(deny.reason) from deny
+
+        except (TimeoutError, ideenergy.ClientError) as e:
+            failures = failures + 1
+            barrier.fail()
+            if dataset_barrier is not None:
+                dataset_barrier.fail()
+            _LOGGER.debug(
+                f"{dataset.name}: error fetching {window_start} → {window_end} "
+                f"({failures}/{BACKFILL_MAX_FAILURES}): {e!r}"
+            )
+            if failures >= BACKFILL_MAX_FAILURES:
+                raise BackfillStopped("too many failures") from e
+
+            continue
+
+        barrier.success()
+        break
+
+    series = data["historical"].between(
+        window_start, window_end, zone=coordinator.zoneinfo
+    )
+    return await async_convert(
+        coordinator.hass,
+        len(series),
+        _valid_historical_states,
+        series,
+        coordinator.zoneinfo,
+    )
+
+
+def _valid_historical_states(series, zone) -> list[HistoricalState]:
+    return [
+        x
+        for x in historical_states_from_historical_api_data(series, zone=zone)
+        if x.state not in (0, None)
+    ]
+
+
+async def async_backfill(
+    hass: HomeAssistant,
+    coordinator: IDeCoordinator,
+    checkpoints: BackfillCheckpoints,
+    entry_id: str,
+    dataset: DataSetType,
+    metadata: StatisticMetaData,
+    start: date,
+    end: date,
+) -> int:
+    """Import historical data in [start, end) into statistics, month by month
+
+    Progress is saved after each month so an interrupted backfill of the same range
+    resumes where it stopped. Returns the number of statistics imported.
+    """
+    statistic_id = metadata["statistic_id"]
+
+    lock = get_statistic_lock(hass, statistic_id)
+    if lock.locked():
+        _LOGGER.debug(f"{statistic_id}: waiting for another import to finish")
+
+    async with lock:
+        return await _async_backfill(
+            hass, coordinator, checkpoints, entry_id, dataset, metadata, start, end
+        )
+
+
+async def _async_backfill(
+    hass: HomeAssistant,
+    coordinator: IDeCoordinator,
+    checkpoints: BackfillCheckpoints,
+    entry_id: str,
+    dataset: DataSetType,
+    metadata: StatisticMetaData,
+    start: date,
+    end: date,
+) -> int:
+    statistic_id = metadata["statistic_id"]
+
+    resume = await checkpoints.async_get(entry_id, dataset, start, end)
+    if resume:
+        _LOGGER.debug(f"{statistic_id}: resuming backfill from {resume}")
+
+    importer = StatisticsImporter(hass, metadata)
+    await importer.async_start(
+        datetime.combine(resume or start, time(), tzinfo=coordinator.zoneinfo)
+    )
+
+    barrier = make_pacing_barrier()
+
+    for window_start, window_end in month_windows(resume or start, end):
+        try:
+            hist_states = await async_fetch_window_states(
+                coordinator, dataset, barrier, window_start, window_end
+            )
+        except BackfillStopped as e:
+            _LOGGER.warning(
+                f"{statistic_id}: backfill stopped at {window_start}, {e}. "
+                "Call the service again to resume"
+            )
+            return await importer.async_finish()
+
+        await importer.async_add(hist_states)
+        await importer.async_flush(close=True)
+
+        # Don't save progress until the recorder has written the month
+        await recorder.get_instance(hass).async_block_till_done()
+        await checkpoints.async_set(entry_id, dataset, start, end, window_end)
+
+        _LOGGER.debug(
+            f"{statistic_id}: backfilled {window_start} → {window_end} "
+            f"({len(hist_states)} states)"
+        )
+
+    n = await importer.async_finish()
+    await checkpoints.async_remove(entry_id, dataset)
+    _LOGGER.info(f"{statistic_id}: backfill completed, {n} statistics imported")
+
+    return n
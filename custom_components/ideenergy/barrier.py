@@ -16,11 +16,15 @@
 # USA.
 
 
+import copy
 import enum
 import functools
 import logging
+import random
+import statistics
 from abc import abstractmethod
-from datetime import datetime, timedelta, timezone
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
 from typing import Any
 
 from homeassistant.core import dt_util
@@ -38,6 +42,20 @@ ATTR_LAST_SUCCESS = "last_success"
 ATTR_STATE = "state"
 ATTR_RETRY = "retry"
 ATTR_ALLOWED_WINDOW_MINUTES = "allowed_window_minutes"
+ATTR_INITIAL_BACKOFF = "initial_backoff"
+ATTR_MAX_BACKOFF = "max_backoff"
+ATTR_NEXT_ATTEMPT = "next_attempt"
+ATTR_FAILURE_THRESHOLD = "failure_threshold"
+ATTR_OPEN_PERIOD = "open_period"
+ATTR_OPENED_AT = "opened_at"
+ATTR_PROBING_SINCE = "probing_since"
+ATTR_MINUTE_SCORES = "minute_scores"
+ATTR_HOUR_SCORES = "hour_scores"
+ATTR_PHASE = "phase"
+ATTR_LATEST_DATA = "latest_data"
+ATTR_EXPECTED_PUBLISH_TIME = "expected_publish_time"
+ATTR_PUBLISH_OBSERVATIONS = "publish_observations"
+ATTR_EMPTY_ATTEMPTS = "empty_attempts"
 
 DEFAULT_MAX_RETRIES = 3
 
@@ -101,6 +119,34 @@ class Barrier:
     def dump(self) -> dict[str, Any]:
         return {}
 
+    def deadline(self, now: datetime | None = None) -> datetime | None:
+        """Time limit for an operation allowed by this barrier, if any"""
+        return None
+
+    def would_allow(self, now: datetime | None = None) -> bool:
+        """Whether check() would allow an attempt at now
+
+        Checks run against a copy: check() may update the barrier state (e.g. reset
+        failures after a cooldown) and this is meant for callers only peeking.
+        """
+        try:
+            copy.deepcopy(self).check(now=now)
+        except BarrierDeniedError:
+            return False
+
+        return True
+
+    def set_phase(self, phase: float) -> None:
+        """Offset, as a fraction in [0, 1), within the barrier's allowed periods"""
+        pass
+
+    def data_received(self, latest: date | None, now: datetime | None = None) -> None:
+        """Notify the most recent day present in the data fetched after a success
+
+        latest is None if the fetched data has no readings at all
+        """
+        pass
+
 
 class BarrierException(Exception):
     pass
@@ -268,9 +314,36 @@ class TimeWindowBarrier(Barrier):
                 code=TimeWindowBarrierDenyError.NO_DELTA, reason=reason
             )
 
+    @check_tzinfo("now", optional=True)
+    def deadline(self, now: datetime | None = None) -> datetime | None:
+        """
+        Split the time left in the update window between the remaining attempts so
+        a slow operation leaves room for a retry.
+        """
+        now = now or self.utcnow()
+
+        local_now = dt_util.as_local(now)
+        if not (
+            self._allowed_window_minutes[0]
+            <= local_now.minute
+            <= self._allowed_window_minutes[1]
+        ):
+            return None
+
+        window_end = local_now.replace(
+            minute=self._allowed_window_minutes[1], second=0, microsecond=0
+        ) + timedelta(minutes=1)
+        attempts_left = max(1, self._max_retries - self._failures)
+
+        return now + (window_end - local_now) / attempts_left
+
     def force_next(self) -> None:
         self._force_next = True
 
+    @property
+    def retrying(self) -> bool:
+        return self._failures > 0 and self._failures < self._max_retries
+
     @check_tzinfo("now", optional=True)
     def success(self, now: datetime | None = None) -> None:
         now = now or self.utcnow()
@@ -304,15 +377,638 @@ class TimeWindowBarrierDenyError(enum.Enum):
     NO_DELTA = enum.auto()
 
 
+class DecayingHistogram:
+    """
+    Success/failure counters per bin. Old observations of a bin lose weight with each
+    new one in that bin, so the histogram follows changes in the API behaviour.
+
+    Decay is per bin: decaying every bin on each observation would keep bins that
+    get a small share of them (e.g. each hour of the day) at a handful of samples.
+    """
+
+    def __init__(self, nbins: int, decay: float):
+        self._decay = decay
+        self._successes = [0.0] * nbins
+        self._failures = [0.0] * nbins
+
+    def record(self, bin: int, success: bool) -> None:
+        self._successes[bin] *= self._decay
+        self._failures[bin] *= self._decay
+
+        if success:
+            self._successes[bin] += 1
+        else:
+            self._failures[bin] += 1
+
+    def samples(self, bin: int) -> float:
+        return self._successes[bin] + self._failures[bin]
+
+    def score(self, bin: int) -> float:
+        # Laplace smoothing: unknown bins score 0.5, which makes them worth a try
+        return (self._successes[bin] + 1) / (self.samples(bin) + 2)
+
+    def dump(self) -> list[float]:
+        return [round(self.score(x), 3) for x in range(len(self._successes))]
+
+
+class AdaptiveTimeWindowBarrier(TimeWindowBarrier):
+    """
+    TimeWindowBarrier that learns which minutes of the update window (and which
+    hours of the day) are more likely to succeed.
+
+    Within the update window the first attempt is denied until the minute with the
+    best success score among the remaining ones. Retries are denied in hours with a
+    poor success history.
+    """
+
+    def __init__(
+        self,
+        *args,
+        decay: float = 0.99,
+        min_hour_score: float = 0.2,
+        min_hour_samples: float = 5,
+        stagger: timedelta = timedelta(seconds=0),
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+
+        self._stagger = stagger
+        self._phase = 0.0
+        self._min_hour_score = min_hour_score
+        self._min_hour_samples = min_hour_samples
+        self._minute_stats = DecayingHistogram(60, decay=decay)
+        self._hour_stats = DecayingHistogram(24, decay=decay)
+
+    def dump(self) -> dict[str, Any]:
+        return super().dump() | {
+            ATTR_MINUTE_SCORES: {
+                m: self._minute_stats.dump()[m]
+                for m in range(
+                    self._allowed_window_minutes[0],
+                    self._allowed_window_minutes[1] + 1,
+                )
+            },
+            ATTR_HOUR_SCORES: self._hour_stats.dump(),
+            ATTR_PHASE: self._phase,
+        }
+
+    def set_phase(self, phase: float) -> None:
+        self._phase = phase
+
+    @property
+    def stagger_offset(self) -> timedelta:
+        """Offset within the preferred minute assigned by the phase"""
+        return self._stagger * self._phase
+
+    @check_tzinfo("now", optional=True)
+    def preferred_minute(self, now: datetime | None = None) -> int:
+        """Minute with the best score between now and the end of the window"""
+        now = now or self.utcnow()
+
+        first = max(dt_util.as_local(now).minute, self._allowed_window_minutes[0])
+        candidates = range(first, self._allowed_window_minutes[1] + 1)
+        if not candidates:
+            return self._allowed_window_minutes[1]
+
+        # max() returns the first maximum: ties are resolved with the earliest minute
+        return max(candidates, key=self._minute_stats.score)
+
+    @check_tzinfo("now", optional=True)
+    def check(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        super().check(now=now)
+
+        if self._force_next:
+            return
+
+        local_now = dt_util.as_local(now)
+
+        if self.retrying:
+            hour = local_now.hour
+            if (
+                self._hour_stats.samples(hour) >= self._min_hour_samples
+                and self._hour_stats.score(hour) < self._min_hour_score
+            ):
+                raise BarrierDeniedError(
+                    code=AdaptiveTimeWindowBarrierDenyError.LOW_SUCCESS_HOUR,
+                    reason=f"retries are not worth it at {hour}h "
+                    f"(score: {self._hour_stats.score(hour):.3f})",
+                )
+
+            return
+
+        preferred = self.preferred_minute(now=now)
+        if local_now.minute < preferred:
+            raise BarrierDeniedError(
+                code=AdaptiveTimeWindowBarrierDenyError.SLOT_NOT_PREFERRED,
+                reason=f"waiting for preferred minute {preferred}",
+            )
+
+        # Stagger only the slot of the window, an entry that missed it (e.g. the
+        # refresh came late) must not wait for the offset in every following minute
+        offset = self.stagger_offset
+        if (
+            local_now.minute == self._slot_minute(now)
+            and timedelta(seconds=local_now.second) < offset
+        ):
+            raise BarrierDeniedError(
+                code=AdaptiveTimeWindowBarrierDenyError.STAGGERED,
+                reason=f"waiting for offset {offset} within minute {preferred}",
+            )
+
+    def _slot_minute(self, now: datetime) -> int:
+        # Preferred minute as seen from the start of the current window
+        window_start = now.replace(second=0, microsecond=0) - timedelta(
+            minutes=dt_util.as_local(now).minute - self._allowed_window_minutes[0]
+        )
+        return self.preferred_minute(now=window_start)
+
+    @check_tzinfo("now", optional=True)
+    def success(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        self._record(now, True)
+        super().success(now=now)
+
+    @check_tzinfo("now", optional=True)
+    def fail(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        self._record(now, False)
+        super().fail(now=now)
+
+    def _record(self, now: datetime, success: bool) -> None:
+        local_now = dt_util.as_local(now)
+        self._minute_stats.record(local_now.minute, success)
+        self._hour_stats.record(local_now.hour, success)
+
+
+class AdaptiveTimeWindowBarrierDenyError(enum.Enum):
+    SLOT_NOT_PREFERRED = enum.auto()
+    LOW_SUCCESS_HOUR = enum.auto()
+    STAGGERED = enum.auto()
+
+
+class BackoffBarrier(Barrier):
+    """
+    Like TimeDeltaBarrier but failures are retried with capped exponential backoff
+    and full jitter: after the n-th consecutive failure next attempt is delayed a
+    random time between 0 and min(max_backoff, initial_backoff * 2^(n-1)).
+    success() resets the backoff.
+
+    After a success next attempt is aligned to a slot: slots are `delta` apart and
+    shifted by `phase * delta`, so barriers with different phases spread their
+    attempts over the period. Next attempt is never less than `delta` after the
+    last success.
+    """
+
+    @check_tzinfo("last_success", optional=True)
+    def __init__(
+        self,
+        delta: timedelta,
+        initial_backoff: timedelta,
+        max_backoff: timedelta,
+        last_success: datetime | None = None,
+    ):
+        zero_dt = dt_util.utc_from_timestamp(0)
+
+        self._delta = delta
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+
+        # state
+        self._phase = 0.0
+        self._failures = 0
+        self._last_success = last_success or zero_dt
+        self._next_attempt = zero_dt
+
+    def utcnow(self) -> datetime:
+        return dt_util.utcnow()
+
+    @property
+    def delta(self) -> timedelta:
+        return self._delta
+
+    @property
+    def last_success(self) -> datetime:
+        return self._last_success
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            # Configuration
+            ATTR_MAX_AGE: self._delta,
+            ATTR_INITIAL_BACKOFF: self._initial_backoff,
+            ATTR_MAX_BACKOFF: self._max_backoff,
+            ATTR_PHASE: self._phase,
+            # Internal state
+            ATTR_LAST_SUCCESS: self._last_success,
+            ATTR_NEXT_ATTEMPT: self._next_attempt,
+            ATTR_RETRY: self._failures,
+        }
+
+    @check_tzinfo("now", optional=True)
+    def check(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        if now < self._next_attempt:
+            next_attempt = dt_util.as_local(self._next_attempt)
+            raise BarrierDeniedError(
+                code=BackoffBarrierDenyError.BACKOFF,
+                reason=f"backing off after {self._failures} failures "
+                f"until {next_attempt}",
+            )
+
+        next_slot = self.next_slot()
+        if self._failures == 0 and now < next_slot:
+            raise BarrierDeniedError(
+                code=BackoffBarrierDenyError.NO_MAX_AGE,
+                reason=f"no max_age reached (next slot at {dt_util.as_local(next_slot)})",
+            )
+
+    def set_phase(self, phase: float) -> None:
+        self._phase = phase
+
+    def next_slot(self) -> datetime:
+        """First slot after last success, never less than delta after it
+
+        Slots are searched from 3/4 delta after the last success: a success comes a
+        bit after its own slot and searching from delta would skip the next one.
+        The attempt is then delayed to honour delta, which shifts it by that bit.
+        A success further than delta/4 from its slot (e.g. after a phase change)
+        moves to the next slot, otherwise it would never reach its phase.
+        """
+        zero_dt = dt_util.utc_from_timestamp(0)
+        offset = self._delta * self._phase
+        after = self._last_success + self._delta * 3 / 4
+
+        n_slots = (after - zero_dt - offset) // self._delta + 1
+        return max(
+            zero_dt + offset + self._delta * n_slots, self._last_success + self._delta
+        )
+
+    @check_tzinfo("now", optional=True)
+    def success(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        self._failures = 0
+        self._last_success = now
+        self._next_attempt = dt_util.utc_from_timestamp(0)
+
+    @check_tzinfo("now", optional=True)
+    def fail(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        self._failures = self._failures + 1
+
+        # Limit exponent to avoid overflows, max_backoff is reached way before
+        exp = min(self._failures - 1, 32)
+        cap = min(self._max_backoff, self._initial_backoff * (2**exp))
+        delay = timedelta(seconds=random.uniform(0, cap.total_seconds()))
+        self._next_attempt = now + delay
+
+        next_attempt = dt_util.as_local(self._next_attempt)
+        _LOGGER.debug(
+            f"fail registered ({self._failures}), backing off until {next_attempt}"
+        )
+
+
+class BackoffBarrierDenyError(enum.Enum):
+    NO_MAX_AGE = enum.auto()
+    BACKOFF = enum.auto()
+
+
+class PublishTimeBarrier(BackoffBarrier):
+    """
+    Barrier for data published once a day with (about) one day of delay.
+
+    - Once yesterday's data is present nothing is allowed until tomorrow.
+    - The time of the day when a new day of data first shows up is learned, and
+      attempts are denied until that time (plus margin and phase * spread).
+    - Attempts that don't bring a new day are retried after `delta`, or after
+      `late_delta` once `max_empty_attempts` in a row came back empty (i.e.
+      i-DE is publishing days late).
+    - Failures back off as in BackoffBarrier.
+
+    When new data is found at the first attempt of the day its publication time is
+    unknown, so the learned time is moved `explore_step` earlier. Sooner or later an
+    attempt comes back empty and the publication time gets bracketed between the
+    empty attempt and the successful one.
+    """
+
+    def __init__(
+        self,
+        *args,
+        margin: timedelta = timedelta(minutes=10),
+        spread: timedelta = timedelta(minutes=30),
+        explore_step: timedelta = timedelta(minutes=15),
+        max_observations: int = 14,
+        late_delta: timedelta = timedelta(hours=6),
+        max_empty_attempts: int = 6,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+
+        self._margin = margin
+        self._spread = spread
+        self._explore_step = explore_step
+        self._late_delta = late_delta
+        self._max_empty_attempts = max_empty_attempts
+
+        # state
+        self._latest_data: date | None = None
+        self._last_empty_attempt: datetime | None = None
+        self._empty_attempts = 0
+        # Minutes since local midnight
+        self._publish_observations: deque[float] = deque(maxlen=max_observations)
+
+    def dump(self) -> dict[str, Any]:
+        return super().dump() | {
+            ATTR_LATEST_DATA: self._latest_data,
+            ATTR_EXPECTED_PUBLISH_TIME: self.expected_publish_time(),
+            ATTR_PUBLISH_OBSERVATIONS: list(self._publish_observations),
+            ATTR_EMPTY_ATTEMPTS: self._empty_attempts,
+        }
+
+    @property
+    def retry_delta(self) -> timedelta:
+        """Delay between attempts that bring no new data"""
+        if self._empty_attempts >= self._max_empty_attempts:
+            return self._late_delta
+
+        return self._delta
+
+    @check_tzinfo("now", optional=True)
+    def expected_publish_time(self, now: datetime | None = None) -> datetime | None:
+        """Today's (local) expected time for new data, None if not learned yet"""
+        now = now or self.utcnow()
+
+        if not self._publish_observations:
+            return None
+
+        minutes = statistics.median(self._publish_observations)
+        midnight = dt_util.start_of_local_day(dt_util.as_local(now))
+        expected = (
+            midnight
+            + timedelta(minutes=minutes)
+            + self._margin
+            + self._spread * self._phase
+        )
+
+        return dt_util.as_utc(expected)
+
+    @check_tzinfo("now", optional=True)
+    def check(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        if now < self._next_attempt:
+            next_attempt = dt_util.as_local(self._next_attempt)
+            raise BarrierDeniedError(
+                code=BackoffBarrierDenyError.BACKOFF,
+                reason=f"backing off after {self._failures} failures "
+                f"until {next_attempt}",
+            )
+
+        yesterday = dt_util.as_local(now).date() - timedelta(days=1)
+        if self._latest_data is not None and self._latest_data >= yesterday:
+            raise BarrierDeniedError(
+                code=PublishTimeBarrierDenyError.UP_TO_DATE,
+                reason=f"data is up to date ({self._latest_data})",
+            )
+
+        expected = self.expected_publish_time(now=now)
+        if expected is not None and now < expected:
+            raise BarrierDeniedError(
+                code=PublishTimeBarrierDenyError.NOT_PUBLISHED_YET,
+                reason=f"new data expected at {dt_util.as_local(expected)}",
+            )
+
+        retry_delta = self.retry_delta
+        if self._failures == 0 and now < self._last_success + retry_delta:
+            retry_at = dt_util.as_local(self._last_success + retry_delta)
+            raise BarrierDeniedError(
+                code=BackoffBarrierDenyError.NO_MAX_AGE,
+                reason=f"no new data in last attempt, retry at {retry_at}",
+            )
+
+    @check_tzinfo("now", optional=True)
+    def data_received(self, latest: date | None, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+        local_now = dt_util.as_local(now)
+
+        if latest is None or (
+            self._latest_data is not None and latest <= self._latest_data
+        ):
+            self._last_empty_attempt = now
+            self._empty_attempts = self._empty_attempts + 1
+            return
+
+        # First fetch since startup doesn't tell anything about publish time
+        if self._latest_data is not None:
+            if (
+                self._last_empty_attempt is not None
+                and dt_util.as_local(self._last_empty_attempt).date()
+                == local_now.date()
+            ):
+                # New data was published between last empty attempt and now
+                published = local_now - (now - self._last_empty_attempt) / 2
+
+            else:
+                # Published at some point before this attempt, try earlier next time
+                published = (
+                    local_now
+                    - self._margin
+                    - self._spread * self._phase
+                    - self._explore_step
+                )
+
+            midnight = dt_util.start_of_local_day(local_now)
+            minutes = (published - midnight).total_seconds() / 60
+            self._publish_observations.append(minutes)
+            _LOGGER.debug(f"new data for {latest} published around {published}")
+
+        self._latest_data = latest
+        self._last_empty_attempt = None
+        self._empty_attempts = 0
+
+
+class PublishTimeBarrierDenyError(enum.Enum):
+    UP_TO_DATE = enum.auto()
+    NOT_PUBLISHED_YET = enum.auto()
+
+
+class CircuitBreakerState(enum.Enum):
+    CLOSED = enum.auto()
+    OPEN = enum.auto()
+    HALF_OPEN = enum.auto()
+
+
+class CircuitBreaker(Barrier):
+    """
+    Account level barrier shared by all datasets (and config entries) of an account.
+
+    - closed: everything is allowed. Trips to open after `failure_threshold`
+      consecutive failures.
+    - open: everything is denied for `open_period`, then goes half-open.
+    - half-open: everything is denied except one probe (see acquire_probe) whose
+      result closes or reopens the breaker.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        open_period: timedelta,
+        probe_timeout: timedelta = timedelta(minutes=5),
+    ):
+        self._failure_threshold = failure_threshold
+        self._open_period = open_period
+        self._probe_timeout = probe_timeout
+
+        # state
+        self._state = CircuitBreakerState.CLOSED
+        self._failures = 0
+        self._opened_at: datetime | None = None
+        self._probing_since: datetime | None = None
+
+    def utcnow(self) -> datetime:
+        return dt_util.utcnow()
+
+    @property
+    def state(self) -> CircuitBreakerState:
+        return self._state
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            # Configuration
+            ATTR_FAILURE_THRESHOLD: self._failure_threshold,
+            ATTR_OPEN_PERIOD: self._open_period,
+            # Internal state
+            ATTR_STATE: self._state.name,
+            ATTR_RETRY: self._failures,
+            ATTR_OPENED_AT: self._opened_at,
+            ATTR_PROBING_SINCE: self._probing_since,
+        }
+
+    @check_tzinfo("now", optional=True)
+    def check(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        if self._state is CircuitBreakerState.OPEN:
+            # Set by fail() when opening
+            assert self._opened_at is not None
+
+            reopen_at = self._opened_at + self._open_period
+            if now < reopen_at:
+                raise BarrierDeniedError(
+                    code=CircuitBreakerDenyError.OPEN,
+                    reason="circuit breaker is open until "
+                    f"{dt_util.as_local(reopen_at)}",
+                )
+
+            _LOGGER.debug("circuit breaker is half-open, waiting for probe")
+            self._state = CircuitBreakerState.HALF_OPEN
+            self._probing_since = None
+
+        if self._state is CircuitBreakerState.HALF_OPEN:
+            raise BarrierDeniedError(
+                code=CircuitBreakerDenyError.HALF_OPEN,
+                reason="circuit breaker is half-open, waiting for probe",
+            )
+
+    @check_tzinfo("now", optional=True)
+    def acquire_probe(self, now: datetime | None = None) -> bool:
+        """Returns True if the caller must run the probe request"""
+        now = now or self.utcnow()
+
+        if self._state is not CircuitBreakerState.HALF_OPEN:
+            return False
+
+        # A probe is already running (unless it got lost)
+        if (
+            self._probing_since is not None
+            and now < self._probing_since + self._probe_timeout
+        ):
+            return False
+
+        self._probing_since = now
+        return True
+
+    @check_tzinfo("now", optional=True)
+    def success(self, now: datetime | None = None) -> None:
+        if self._state is not CircuitBreakerState.CLOSED:
+            _LOGGER.debug("circuit breaker closed")
+
+        self._state = CircuitBreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing_since = None
+
+    @check_tzinfo("now", optional=True)
+    def fail(self, now: datetime | None = None) -> None:
+        now = now or self.utcnow()
+
+        self._failures = self._failures + 1
+        if (
+            self._state is CircuitBreakerState.HALF_OPEN
+            or self._failures >= self._failure_threshold
+        ):
+            self._state = CircuitBreakerState.OPEN
+            self._opened_at = now
+            self._probing_since = None
+
+            reopen_at = dt_util.as_local(now + self._open_period)
+            _LOGGER.debug(
+                f"circuit breaker open after {self._failures} failures "
+                f"until {reopen_at}"
+            )
+
+
+class CircuitBreakerDenyError(enum.Enum):
+    OPEN = enum.auto()
+    HALF_OPEN = enum.auto()
+
+
 class NoopBarrier(Barrier):
     def check(self, **kwargs) -> None:
         pass
 
-    def success(self):
+    def success(self, **kwargs) -> None:
         pass
 
-    def fail(self):
+    def fail(self, **kwargs) -> None:
         pass
 
     def dump(self) -> dict[str, Any]:
         return {}
+
+
+@check_tzinfo("now", optional=True)
+def estimate_next_allowed(
+    barrier: Barrier,
+    now: datetime | None = None,
+    horizon: timedelta = timedelta(days=2),
+    step: timedelta = timedelta(minutes=1),
+) -> datetime | None:
+    """First time, with `step` resolution, an attempt would be allowed by a barrier
+
+    Checks are run against a copy, the barrier itself isn't modified. Returns None
+    if no attempt is allowed within `horizon`.
+    """
+    now = now or dt_util.utcnow()
+    barrier = copy.deepcopy(barrier)
+
+    t = now
+    while t <= now + horizon:
+        try:
+            barrier.check(now=t)
+        except BarrierDeniedError:
+            t = t + step
+            continue
+
+        return t
+
+    return None
@@ -0,0 +1,169 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+import math
+from collections.abc import Iterable
+from datetime import datetime, timedelta
+from typing import Any
+
+import sqlalchemy as sa
+from homeassistant.components.recorder import db_schema
+from homeassistant.core import HomeAssistant, dt_util
+from homeassistant.helpers.storage import Store
+
+from .const import DATA_SUM_CHECKPOINTS, DOMAIN, SUM_CHECKPOINTS_SAVE_DELAY
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+STORAGE_KEY = f"{DOMAIN}.sum_checkpoints"
+
+# (month start, sum of the last statistic of the month, statistics in the month)
+Checkpoint = tuple[datetime, float, int]
+
+
+def month_start(dt: datetime) -> datetime:
+    """Start of the local month dt belongs to"""
+    return dt_util.as_local(dt).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def next_month_start(dt: datetime) -> datetime:
+    return month_start(month_start(dt) + timedelta(days=32))
+
+
+class SumCheckpoints:
+    """
+    Cumulative sum and number of statistics at the end of each closed month, for each
+    statistic_id with sums.
+
+    Checking a checkpoint against the database takes two indexed queries. Once
+    verified, recomputation or verification can start at the following month with
+    the checkpoint sum instead of at the beginning of history.
+
+    Checkpoints are a cache: they are written by StatisticsImporter as it closes
+    months and by async_fix_statistics as it verifies them, and must be verified
+    before use (see find_verified_checkpoint). Code rewriting statistics drops the
+    checkpoints from the rewritten month on.
+    """
+
+    def __init__(self, hass: HomeAssistant):
+        self._store: Store[dict[str, Any]] = Store(hass, STORAGE_VERSION, STORAGE_KEY)
+        self._data: dict[str, Any] | None = None
+
+    async def _async_get_data(self) -> dict[str, Any]:
+        if self._data is None:
+            self._data = await self._store.async_load() or {}
+
+        return self._data
+
+    def _schedule_save(self) -> None:
+        # Regular updates close a month once a month, imports many at a time
+        self._store.async_delay_save(lambda: self._data, SUM_CHECKPOINTS_SAVE_DELAY)
+
+    async def async_get(self, statistic_id: str) -> list[Checkpoint]:
+        """Checkpoints of statistic_id, oldest first"""
+        data = await self._async_get_data()
+
+        return sorted(
+            (datetime.fromisoformat(k), v[0], v[1])
+            for k, v in data.get(statistic_id, {}).items()
+        )
+
+    async def async_update(
+        self, statistic_id: str, checkpoints: Iterable[Checkpoint]
+    ) -> None:
+        data = await self._async_get_data()
+        stored = data.setdefault(statistic_id, {})
+        for month, sum_, count in checkpoints:
+            stored[month.isoformat()] = [sum_, count]
+
+        self._schedule_save()
+
+    async def async_drop_from(self, statistic_id: str, dt: datetime) -> None:
+        """Drop checkpoints of the month of dt and later ones"""
+        data = await self._async_get_data()
+        stored = data.get(statistic_id)
+        if not stored:
+            return
+
+        cutoff = month_start(dt)
+        dropped = [k for k in stored if datetime.fromisoformat(k) >= cutoff]
+        if not dropped:
+            return
+
+        for k in dropped:
+            del stored[k]
+
+        _LOGGER.debug(
+            f"{statistic_id}: {len(dropped)} sum checkpoints from {cutoff} dropped"
+        )
+        self._schedule_save()
+
+
+def get_sum_checkpoints(hass: HomeAssistant) -> SumCheckpoints:
+    domain_data = hass.data.setdefault(DOMAIN, {})
+    if DATA_SUM_CHECKPOINTS not in domain_data:
+        domain_data[DATA_SUM_CHECKPOINTS] = SumCheckpoints(hass)
+
+    return domain_data[DATA_SUM_CHECKPOINTS]
+
+
+def verify_checkpoint(session, metadata_id: int, checkpoint: Checkpoint) -> bool:
+    """Check a checkpoint matches the month statistics in the database"""
+    month, sum_, count = checkpoint
+    month_stmt = (
+        sa.select(db_schema.Statistics)
+        .where(db_schema.Statistics.metadata_id == metadata_id)
+        .where(db_schema.Statistics.start_ts >= month.timestamp())
+        .where(db_schema.Statistics.start_ts < next_month_start(month).timestamp())
+    )
+
+    n = session.execute(
+        sa.select(sa.func.count()).select_from(month_stmt.subquery())
+    ).scalar()
+    if n != count:
+        return False
+
+    last = session.execute(
+        month_stmt.order_by(db_schema.Statistics.start_ts.desc()).limit(1)
+    ).scalar()
+
+    return (
+        last is not None
+        and last.sum is not None
+        and math.isclose(last.sum, sum_, rel_tol=1e-9, abs_tol=1e-6)
+    )
+
+
+def find_verified_checkpoint(
+    session, metadata_id: int, checkpoints: list[Checkpoint], max_checks: int = 3
+) -> Checkpoint | None:
+    """Newest checkpoint still matching the database
+
+    checkpoints must be sorted oldest first. Usually the newest one is valid, older
+    ones only matter if statistics were rewritten without dropping checkpoints, and
+    at most max_checks are tried before giving up.
+    """
+    for checkpoint in reversed(checkpoints[-max_checks:]):
+        if verify_checkpoint(session, metadata_id, checkpoint):
+            return checkpoint
+
+    return None
@@ -20,16 +20,28 @@
 import os
 from typing import Any
 
+import aiohttp
 import ideenergy
 import voluptuous as vol
 from homeassistant import config_entries
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
-from homeassistant.core import callback  # noqa: F401
+from homeassistant.core import callback
 from homeassistant.data_entry_flow import FlowResult
-from homeassistant.helpers.aiohttp_client import async_create_clientsession
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+from homeassistant.helpers.event import async_call_later
 
 from . import _LOGGER
-from .const import CONF_CONTRACT, CONFIG_ENTRY_VERSION, DOMAIN
+from .const import (
+    API_HANDOFF_MAX_AGE,
+    API_USER_SESSION_TIMEOUT,
+    CONF_CONTRACT,
+    CONF_STATISTICS_ONLY,
+    CONF_TIMEZONE,
+    CONFIG_ENTRY_VERSION,
+    DATA_API_HANDOFF,
+    DOMAIN,
+    TIMEZONE_AUTO,
+)
 
 AUTH_SCHEMA = vol.Schema(
     {
@@ -46,11 +58,12 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
         super().__init__(*args, **kwargs)
         self.info = {}
         self.api = None
+        self.contracts = None
 
-    # @staticmethod
-    # @callback
-    # def async_get_options_flow(config_entry):
-    #     return OptionsFlowHandler(config_entry)
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return OptionsFlowHandler(config_entry)
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
@@ -96,9 +109,14 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
     async def async_step_contract(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
-        contracts = await self.api.get_contracts()
-        contracts = {f"{x['cups']} ({x['direccion']})": x for x in contracts}
+        # Contracts are fetched only once, the form can be shown several times
+        if self.contracts is None:
+            self.contracts = {
+                f"{x['cups']} ({x['direccion']})": x
+                for x in await self.api.get_contracts()
+            }
 
+        contracts = self.contracts
         schema = vol.Schema({vol.Required(CONF_CONTRACT): vol.In(contracts.keys())})
 
         if not user_input:
@@ -111,27 +129,66 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):  # type: ignore[call
             }
         )
 
+        await self._async_handoff_api(contract["codContrato"])
+
         title = "CUPS " + contract["cups"]
         return self.async_create_entry(title=title, data=self.info)
 
+    async def _async_handoff_api(self, contract: str) -> None:
+        """Hand off the authenticated client to async_setup_entry to save a login
 
-# class OptionsFlowHandler(config_entries.OptionsFlow):
-#     def __init__(self, config_entry):
-#         """Initialize options flow."""
-#         self.config_entry = config_entry
-#
-#     async def async_step_init(self, user_input=None):
-#         if user_input is not None:
-#             return self.async_create_entry(title="", data=user_input)
-#
-#         OPTIONS_SCHEMA = vol.Schema({})
-#
-#         return self.async_show_form(step_id="init", data_schema=OPTIONS_SCHEMA)
+        Optional: if the contract can't be selected setup logs in by itself.
+        """
+        try:
+            await self.api.select_contract(contract)
+
+        except (TimeoutError, aiohttp.ClientError, ideenergy.ClientError) as e:
+            _LOGGER.debug(f"unable to select contract, setup will login again: {e!r}")
+            return
+
+        handoff = self.hass.data.setdefault(DOMAIN, {}).setdefault(DATA_API_HANDOFF, {})
+        key = (self.info[CONF_USERNAME], contract)
+        handoff[key] = api = self.api
+
+        @callback
+        def _expire_handoff(_now) -> None:
+            # Setup didn't run for this entry (yet), its session is expired anyway
+            if handoff.get(key) is api:
+                del handoff[key]
+
+        async_call_later(self.hass, API_HANDOFF_MAX_AGE, _expire_handoff)
+
+
+class OptionsFlowHandler(config_entries.OptionsFlow):
+    def __init__(self, config_entry):
+        """Initialize options flow."""
+        self.config_entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        if user_input is not None:
+            return self.async_create_entry(title="", data=user_input)
+
+        OPTIONS_SCHEMA = vol.Schema(
+            {
+                vol.Required(
+                    CONF_STATISTICS_ONLY,
+                    default=self.config_entry.options.get(CONF_STATISTICS_ONLY, False),
+                ): bool,
+                vol.Required(
+                    CONF_TIMEZONE,
+                    default=self.config_entry.options.get(CONF_TIMEZONE, TIMEZONE_AUTO),
+                ): vol.In([TIMEZONE_AUTO, "Europe/Madrid", "Atlantic/Canary"]),
+            }
+        )
+
+        return self.async_show_form(step_id="init", data_schema=OPTIONS_SCHEMA)
 
 
 async def create_api(hass, username, password):
-    sess = async_create_clientsession(hass)
-    client = ideenergy.Client(sess, username, password)
+    sess = async_get_clientsession(hass)
+    client = ideenergy.Client(
+        sess, username, password, user_session_timeout=API_USER_SESSION_TIMEOUT
+    )
 
     await client.login()
     return client
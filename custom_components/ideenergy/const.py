@@ -21,13 +21,48 @@ from datetime import timedelta
 DOMAIN = "ideenergy"
 
 CONF_CONTRACT = "contract"
+CONF_STATISTICS_ONLY = "statistics_only"
+CONF_TIMEZONE = "timezone"
+
+TIMEZONE_AUTO = "auto"  # Guess from contract province
+
+# Keys for hass.data[DOMAIN] besides config entry IDs
+DATA_API_HANDOFF = "api_handoff"
+DATA_CIRCUIT_BREAKERS = "circuit_breakers"
+DATA_RELOAD_HANDOFF = "reload_handoff"
+DATA_SCHEDULER = "scheduler"
+DATA_STARTUP_QUEUE = "startup_queue"
+DATA_STATISTIC_LOCKS = "statistic_locks"
+DATA_SUM_CHECKPOINTS = "sum_checkpoints"
+
+SERVICE_BACKFILL = "backfill"
+SERVICE_IMPORT_FILE = "import_file"
+SERVICE_PROFILE = "profile"
 
 MEASURE_MAX_AGE = 60 * 50  # Fifty minutes
 MAX_RETRIES = 3
 MIN_SCAN_INTERVAL = 60
 UPDATE_WINDOW_START_MINUTE = 50
 UPDATE_WINDOW_END_MINUTE = 59
+MEASURE_STAGGER = 30  # Seconds to spread entries within a measure attempt minute
 API_USER_SESSION_TIMEOUT = 60
+API_HANDOFF_MAX_AGE = API_USER_SESSION_TIMEOUT  # Config flow client unclaimed by setup
+HISTORICAL_INITIAL_BACKOFF = 60 * 5  # Five minutes
+HISTORICAL_MAX_BACKOFF = 60 * 60 * 6  # Six hours
+HISTORICAL_PUBLISH_RETRY = 60 * 60  # Retry if no new day has been published
+HISTORICAL_PUBLISH_SPREAD = 60 * 30  # Spread entries after learned publish time
+HISTORICAL_PUBLISH_LATE_RETRY = 60 * 60 * 6  # Retry if publication is running late
+HISTORICAL_PUBLISH_MAX_EMPTY = 6  # Empty attempts before assuming it's running late
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_OPEN_PERIOD = 60 * 30  # Thirty minutes
+SESSION_WARMUP_LEAD = 15  # Seconds before the update window opens
+FETCH_TIMEOUT = 120  # Max seconds for any dataset fetch
+MIN_FETCH_TIMEOUT = 15
+REFRESH_HISTORY_SIZE = 100  # Refresh cycles kept for diagnostics
+RELOAD_HANDOFF_MAX_AGE = 60  # Seconds an unloaded entry state waits for its setup
+STARTUP_MAX_CONCURRENT = 4  # Accounts making setup API calls at the same time
+EXECUTOR_CONVERSION_THRESHOLD = 24 * 4 * 31  # A month of quarter-hourly readings
+LOOP_YIELD_CHUNK = 24 * 4 * 7  # Items processed between event loop yields
 
 
 DATA_ATTR_MEASURE_ACCUMULATED = "measure_accumulated"
@@ -37,4 +72,14 @@ DATA_ATTR_HISTORICAL_GENERATION = "historical_generation"
 DATA_ATTR_HISTORICAL_POWER_DEMAND = "historical_power_demand"
 
 HISTORICAL_PERIOD_LENGHT = timedelta(days=7)
+STATISTICS_IMPORT_BATCH_SIZE = 1000
+
+BACKFILL_WINDOW_DELAY = 60  # Seconds between backfill windows
+BACKFILL_MAX_FAILURES = 5
+FILE_IMPORT_BATCH_SIZE = 24 * 31  # About a month of hourly statistics
+FILE_IMPORT_READ_CHUNK = 24 * 31
+SUM_CHECKPOINTS_SAVE_DELAY = 30  # Seconds
+GAP_SCAN_LOOKBACK = 365  # Days
+GAP_SCAN_INTERVAL = 60 * 60 * 24  # Once a day
+GAP_SCAN_STARTUP_DELAY = 60 * 15
 CONFIG_ENTRY_VERSION = 3
@@ -16,25 +16,41 @@
 # USA.
 
 
+import asyncio
 import enum
 import logging
-from datetime import datetime, timedelta, timezone
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
 from typing import Any
+from zoneinfo import ZoneInfo
 
 import ideenergy
 from homeassistant.core import dt_util
+from homeassistant.helpers.event import async_call_later
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
 
-from .barrier import Barrier, BarrierDeniedError
+from .barrier import Barrier, BarrierDeniedError, CircuitBreaker, CircuitBreakerState
 from .const import (
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_OPEN_PERIOD,
     DATA_ATTR_HISTORICAL_CONSUMPTION,
     DATA_ATTR_HISTORICAL_GENERATION,
     DATA_ATTR_HISTORICAL_POWER_DEMAND,
     DATA_ATTR_MEASURE_ACCUMULATED,
     DATA_ATTR_MEASURE_INSTANT,
+    FETCH_TIMEOUT,
     HISTORICAL_PERIOD_LENGHT,
+    MIN_FETCH_TIMEOUT,
+    REFRESH_HISTORY_SIZE,
+    SESSION_WARMUP_LEAD,
 )
 from .entity import IDeEntity
+from .metrics import FetchMetrics
+from .profiling import PROFILE_CYCLE_PATH, profiled
+from .series import HistoricalSeries, series_from_api_data
+from .session import UserSessionManager
+from .tzconv import MAINLAND_SPAIN_ZONEINFO
 
 
 class DataSetType(enum.IntFlag):
@@ -49,30 +65,45 @@ class DataSetType(enum.IntFlag):
 
 _LOGGER = logging.getLogger(__name__)
 
+# DataSetType members that aren't actual datasets
+_NOT_DATASETS = {DataSetType.NONE, DataSetType.ALL}
+
+# Datasets published once a day, their barriers are notified of the latest day
+_DAILY_DATASETS = {
+    DataSetType.HISTORICAL_CONSUMPTION,
+    DataSetType.HISTORICAL_GENERATION,
+}
+
 _DEFAULT_COORDINATOR_DATA: dict[str, Any] = {
     DATA_ATTR_MEASURE_ACCUMULATED: None,
     DATA_ATTR_MEASURE_INSTANT: None,
     DATA_ATTR_HISTORICAL_CONSUMPTION: {
         "accumulated": None,
         "accumulated-co2": None,
-        "historical": [],
+        "historical": None,
     },
     DATA_ATTR_HISTORICAL_GENERATION: {
         "accumulated": None,
         "accumulated-co2": None,
-        "historical": [],
+        "historical": None,
     },
     DATA_ATTR_HISTORICAL_POWER_DEMAND: [],
 }
 
 
 class IDeCoordinator(DataUpdateCoordinator):
+    # Set by DataUpdateCoordinator, declared to copy them in adopt()
+    data: dict[str, Any] | None
+    last_update_success: bool
+
     def __init__(
         self,
         hass,
         api,
         barriers: dict[DataSetType, Barrier],
         update_interval: timedelta = timedelta(seconds=30),
+        breaker: CircuitBreaker | None = None,
+        zoneinfo: ZoneInfo = MAINLAND_SPAIN_ZONEINFO,
     ):
         name = (
             f"{api.username}/{api._contract} coordinator" if api else "i-de coordinator"
@@ -81,12 +112,50 @@ class IDeCoordinator(DataUpdateCoordinator):
 
         self.api = api
         self.barriers = barriers
+        # Circuit breaker is shared between all coordinators of the same account
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+            open_period=timedelta(seconds=CIRCUIT_BREAKER_OPEN_PERIOD),
+        )
+        self.session = UserSessionManager(
+            api, renew_margin=timedelta(seconds=SESSION_WARMUP_LEAD)
+        )
+        # Zone of naive timestamps returned by i-DE
+        self.zoneinfo = zoneinfo
+
+        # Timeouts are accounted apart from API errors
+        self.fetch_errors: Counter[DataSetType] = Counter()
+        self.fetch_timeouts: Counter[DataSetType] = Counter()
+        self.metrics = FetchMetrics(
+            [x for x in DataSetType if x not in _NOT_DATASETS],
+            history_size=REFRESH_HISTORY_SIZE,
+        )
+        # Finest resolution seen for each historical dataset
+        self.historical_steps: dict[DataSetType, timedelta] = {}
+
+        self.schedule_phase = 0.0
 
         # FIXME: platforms from HomeAssistant should have types
         self.platforms: list[str] = []
 
         self.sensors: list[IDeEntity] = []
 
+    def adopt(self, previous: "IDeCoordinator") -> None:
+        """Take over the state of the coordinator of a reloaded config entry
+
+        Barriers (with their schedules, backoffs and learned publish times), cached
+        data and metrics carry over, so the updates following a reload don't request
+        anything the previous instance already had. The client, and with it the user
+        session, must be passed to the constructor.
+        """
+        self.barriers = previous.barriers
+        self.data = previous.data
+        self.last_update_success = previous.last_update_success
+        self.metrics = previous.metrics
+        self.historical_steps = previous.historical_steps
+        self.fetch_errors = previous.fetch_errors
+        self.fetch_timeouts = previous.fetch_timeouts
+
     def register_sensor(self, sensor: IDeEntity) -> None:
         self.sensors.append(sensor)
         _LOGGER.debug(f"Registered sensor '{sensor.__class__.__name__}'")
@@ -95,8 +164,62 @@ class IDeCoordinator(DataUpdateCoordinator):
         _LOGGER.debug(f"Unregistered sensor '{sensor.__class__.__name__}'")
         self.sensors.remove(sensor)
 
+    @property
+    def requested_datasets(self) -> DataSetType:
+        ds = DataSetType.NONE
+        for sensor in self.sensors:
+            for s_ds in sensor.I_DE_DATA_SETS:
+                ds = ds | s_ds
+
+        return ds
+
+    async def async_prepare_measure_attempt(self, now: datetime) -> None:
+        """Renew the user session just before a MEASURE attempt
+
+        Called some seconds before each minute of the update window. If the MEASURE
+        barrier will allow an attempt at the start of the next minute the user
+        session is renewed in advance and a refresh is scheduled for that moment, so
+        the measure request goes out on a warm session.
+
+        Retries are left to the regular update interval.
+        """
+        if not self.requested_datasets & DataSetType.MEASURE:
+            return
+
+        if self.breaker.state is not CircuitBreakerState.CLOSED:
+            return
+
+        barrier = self.barriers[DataSetType.MEASURE]
+        if getattr(barrier, "retrying", False):
+            return
+
+        delay = timedelta(seconds=SESSION_WARMUP_LEAD) + getattr(
+            barrier, "stagger_offset", timedelta(0)
+        )
+        # Don't pay for a login if the attempt will be denied anyway
+        if not barrier.would_allow(now=dt_util.utcnow() + delay):
+            return
+
+        try:
+            await self.session.async_warmup()
+
+        except ideenergy.ClientError as e:
+            _LOGGER.debug(f"session warmup failed: {e!r}")
+            return
+
+        async def _async_handle_attempt(_now: datetime) -> None:
+            await self.async_request_refresh()
+
+        async_call_later(self.hass, delay, _async_handle_attempt)
+
+    def set_schedule_phase(self, phase: float) -> None:
+        """Offset assigned by the scheduler to spread config entries over time"""
+        self.schedule_phase = phase
+        for barrier in self.barriers.values():
+            barrier.set_phase(phase)
+
     def update_internal_data(self, data: dict[str, Any]):
-        if self.data is None:  # type: ignore[has-type]
+        if self.data is None:
             self.data = _DEFAULT_COORDINATOR_DATA
 
         self.data.update(data)
@@ -118,11 +241,7 @@ class IDeCoordinator(DataUpdateCoordinator):
 
         # Raise UpdateFailed is something were wrong
 
-        ds = DataSetType.NONE
-        for sensor in self.sensors:
-            for s_ds in sensor.I_DE_DATA_SETS:
-                ds = ds | s_ds
-
+        ds = self.requested_datasets
         dsstr = ds.name.replace("|", ", ")
         _LOGGER.debug(f"Request update for datasets: {dsstr}")
 
@@ -131,6 +250,7 @@ class IDeCoordinator(DataUpdateCoordinator):
         data = (self.data or _DEFAULT_COORDINATOR_DATA) | updated_data
         return data
 
+    @profiled(PROFILE_CYCLE_PATH)
     async def _async_update_data_raw(
         self, datasets: DataSetType = DataSetType.ALL, now: datetime | None = None
     ) -> dict[str, Any]:
@@ -139,16 +259,42 @@ class IDeCoordinator(DataUpdateCoordinator):
             raise ValueError("now is missing tzinfo field")
 
         requested = (x for x in DataSetType)
-        requested = (x for x in requested if x is not DataSetType.ALL)
+        requested = (x for x in requested if x not in _NOT_DATASETS)
         requested = (x for x in requested if x & datasets)
         requested = list(requested)  # type: ignore[assignment]
 
-        data = {}
+        data: dict[str, Any] = {}
+        self.metrics.start_cycle(now)
+
+        # Account level circuit breaker holds back every dataset
+        try:
+            self.breaker.check(now=now)
+
+        except BarrierDeniedError as deny:
+            if not self.breaker.acquire_probe(now=now):
+                _LOGGER.debug(f"update denied for all datasets: {deny.reason}")
+                for dataset in requested:
+                    self.metrics.denied(dataset, deny.code)
+                self.metrics.end_cycle()
+                return data
+
+            if not await self.async_probe_account(now=now):
+                self.metrics.end_cycle()
+                return data
 
         for dataset in requested:
+            # Failures can open the circuit breaker mid-cycle, datasets left are
+            # denied (and counted) too
+            try:
+                self.breaker.check(now=now)
+            except BarrierDeniedError as deny:
+                _LOGGER.debug(f"update denied for {dataset.name}: {deny.reason}")
+                self.metrics.denied(dataset, deny.code)
+                continue
+
             # Barrier checks and handle exceptions
             try:
-                self.barriers[dataset].check()
+                self.barriers[dataset].check(now=now)
 
             except KeyError:
                 _LOGGER.debug(f"update ignored for {dataset.name}: no barrier defined")
@@ -156,34 +302,42 @@ class IDeCoordinator(DataUpdateCoordinator):
 
             except BarrierDeniedError as deny:
                 _LOGGER.debug(f"update denied for {dataset.name}: {deny.reason}")
+                self.metrics.denied(dataset, deny.code)
                 continue
 
-            _LOGGER.debug(f"update allowed for {dataset.name}")
+            timeout = self.get_fetch_timeout(dataset, now=now)
+            _LOGGER.debug(
+                f"update allowed for {dataset.name} (timeout: {timeout} seconds)"
+            )
 
             # API calls and handle exceptions
+            self.metrics.attempted(dataset)
+            t0 = time.monotonic()
             try:
-                if dataset is DataSetType.MEASURE:
-                    data.update(await self.get_direct_reading_data())
-
-                elif dataset is DataSetType.HISTORICAL_CONSUMPTION:
-                    data.update(await self.get_historical_consumption_data())
+                async with asyncio.timeout(timeout):
+                    data.update(await self._async_fetch_dataset(dataset, now=now))
 
-                elif dataset is DataSetType.HISTORICAL_GENERATION:
-                    data.update(await self.get_historical_generation_data())
-
-                elif dataset is DataSetType.HISTORICAL_POWER_DEMAND:
-                    data.update(await self.get_historical_power_demand_data())
+            except NotImplementedError:
+                _LOGGER.debug(f"update ignored for {dataset.name}: not implemented yet")
+                continue
 
-                else:
-                    _LOGGER.debug(
-                        f"update ignored for {dataset.name}: not implemented yet"
-                    )
-                    continue
+            except TimeoutError as e:
+                _LOGGER.debug(
+                    f"update error for {dataset.name}: "
+                    f"no response in {timeout} seconds, call cancelled"
+                )
+                self.metrics.failed(dataset, e, time.monotonic() - t0)
+                self.fetch_timeouts[dataset] += 1
+                self.barriers[dataset].fail(now=now)
+                continue
 
-            except UnicodeDecodeError:
+            except UnicodeDecodeError as e:
                 _LOGGER.debug(
                     f"update error for {dataset.name}: invalid encoding. File a bug"
                 )
+                self.metrics.failed(dataset, e, time.monotonic() - t0)
+                self.fetch_errors[dataset] += 1
+                self.barriers[dataset].fail(now=now)
                 continue
 
             except ideenergy.RequestFailedError as e:
@@ -191,12 +345,20 @@ class IDeCoordinator(DataUpdateCoordinator):
                     f"update error for {dataset.name}: "
                     + f"{e.response.reason} ({e.response.status})"
                 )
+                self.metrics.failed(dataset, e, time.monotonic() - t0)
+                self.fetch_errors[dataset] += 1
+                self.barriers[dataset].fail(now=now)
+                self.breaker.fail(now=now)
                 continue
 
             except ideenergy.CommandError as e:
                 _LOGGER.debug(
                     f"update error for {dataset.name}: command error from API ({e!r})"
                 )
+                self.metrics.failed(dataset, e, time.monotonic() - t0)
+                self.fetch_errors[dataset] += 1
+                self.barriers[dataset].fail(now=now)
+                self.breaker.fail(now=now)
                 continue
 
             except Exception as e:
@@ -204,18 +366,121 @@ class IDeCoordinator(DataUpdateCoordinator):
                     f"update error for {dataset.name}: "
                     f"**FIXME** handle {dataset.name} raised exception: {e!r}"
                 )
+                self.metrics.failed(dataset, e, time.monotonic() - t0)
+                self.fetch_errors[dataset] += 1
+                self.barriers[dataset].fail(now=now)
                 continue
 
-            self.barriers[dataset].success()
+            self.metrics.succeeded(dataset, time.monotonic() - t0, now=now)
+            self.barriers[dataset].success(now=now)
+            self.breaker.success(now=now)
+
+            # Empty results are notified too, they are attempts without new data
+            if dataset in _DAILY_DATASETS:
+                self.barriers[dataset].data_received(
+                    self._get_latest_historical_day(dataset, data), now=now
+                )
 
             _LOGGER.debug(f"update successful for {dataset.name}")
 
+        self.metrics.end_cycle()
+
         # delay = random.randint(DELAY_MIN_SECONDS * 10, DELAY_MAX_SECONDS * 10) / 10
         # _LOGGER.debug(f"  → Random delay: {delay} seconds")
         # await asyncio.sleep(delay)
 
         return data
 
+    async def async_fetch_historical_range(
+        self, dataset: DataSetType, start: datetime, end: datetime
+    ) -> dict[str, Any]:
+        """Fetch historical data for an arbitrary range
+
+        Used by jobs outside the regular update cycle (i.e. backfills). Calls go
+        through the account circuit breaker, pacing is left to the caller.
+        """
+        self.breaker.check()
+
+        try:
+            async with asyncio.timeout(FETCH_TIMEOUT):
+                data = await self._async_fetch_historical(dataset, start, end)
+
+        except (ideenergy.RequestFailedError, ideenergy.CommandError):
+            self.breaker.fail()
+            raise
+
+        self.breaker.success()
+        return data
+
+    def _get_latest_historical_day(
+        self, dataset: DataSetType, data: dict[str, Any]
+    ) -> date | None:
+        if dataset is DataSetType.HISTORICAL_CONSUMPTION:
+            series = data[DATA_ATTR_HISTORICAL_CONSUMPTION]["historical"]
+        elif dataset is DataSetType.HISTORICAL_GENERATION:
+            series = data[DATA_ATTR_HISTORICAL_GENERATION]["historical"]
+        else:
+            return None
+
+        return series.latest_day(self.zoneinfo) if series is not None else None
+
+    async def async_probe_account(self, now: datetime) -> bool:
+        """Cheap request to decide if a half-open circuit breaker can be closed
+
+        On a warm user session the probe is a single contract selection. Otherwise
+        the probe is the login itself (which selects the contract too), instead of a
+        request paying for an implicit login first.
+        """
+        warm = self.session.is_warm(now=now)
+        _LOGGER.debug(f"probing account (warm session: {warm})")
+
+        try:
+            async with asyncio.timeout(FETCH_TIMEOUT):
+                if warm:
+                    await self.api.select_contract(self.api._contract)
+                else:
+                    await self.api.login()
+
+        except Exception as e:
+            _LOGGER.debug(f"account probe failed: {e!r}")
+            self.breaker.fail(now=now)
+            return False
+
+        _LOGGER.debug("account probe successful")
+        self.breaker.success(now=now)
+        return True
+
+    def get_fetch_timeout(self, dataset: DataSetType, now: datetime) -> float:
+        """Time budget (in seconds) for a dataset fetch
+
+        Derived from the dataset barrier deadline so a hanging call is cancelled
+        leaving room for a retry. Bounded by MIN_FETCH_TIMEOUT and FETCH_TIMEOUT.
+        """
+        deadline = self.barriers[dataset].deadline(now=now)
+        if deadline is None:
+            return FETCH_TIMEOUT
+
+        budget = (deadline - now).total_seconds()
+        return min(max(budget, MIN_FETCH_TIMEOUT), FETCH_TIMEOUT)
+
+    async def _async_fetch_dataset(
+        self, dataset: DataSetType, now: datetime | None = None
+    ) -> dict[str, Any]:
+        if dataset is DataSetType.MEASURE:
+            return await self.get_direct_reading_data()
+
+        elif dataset is DataSetType.HISTORICAL_CONSUMPTION:
+            return await self.get_historical_consumption_data(now=now)
+
+        elif dataset is DataSetType.HISTORICAL_GENERATION:
+            return await self.get_historical_generation_data(now=now)
+
+        elif dataset is DataSetType.HISTORICAL_POWER_DEMAND:
+            return await self.get_historical_power_demand_data()
+
+        else:
+            raise NotImplementedError()
+
     async def get_direct_reading_data(self) -> dict[str, int | float]:
         data = await self.api.get_measure()
 
@@ -224,20 +489,53 @@ class IDeCoordinator(DataUpdateCoordinator):
             DATA_ATTR_MEASURE_INSTANT: data.instant,
         }
 
-    async def get_historical_consumption_data(self) -> Any:
-        end = datetime.today()
+    async def get_historical_consumption_data(self, now: datetime | None = None) -> Any:
+        end = self._local_now(now)
         start = end - HISTORICAL_PERIOD_LENGHT
-        data = await self.api.get_historical_consumption(start=start, end=end)
+        data = await self._async_fetch_historical(
+            DataSetType.HISTORICAL_CONSUMPTION, start, end
+        )
 
         return {DATA_ATTR_HISTORICAL_CONSUMPTION: data}
 
-    async def get_historical_generation_data(self) -> Any:
-        end = datetime.today()
+    async def get_historical_generation_data(self, now: datetime | None = None) -> Any:
+        end = self._local_now(now)
         start = end - HISTORICAL_PERIOD_LENGHT
-        data = await self.api.get_historical_generation(start=start, end=end)
+        data = await self._async_fetch_historical(
+            DataSetType.HISTORICAL_GENERATION, start, end
+        )
 
         return {DATA_ATTR_HISTORICAL_GENERATION: data}
 
+    def _local_now(self, now: datetime | None = None) -> datetime:
+        # Naive local time in the contract zone, as i-DE expects it
+        now = now or dt_util.utcnow()
+        return now.astimezone(self.zoneinfo).replace(tzinfo=None)
+
+    async def _async_fetch_historical(
+        self, dataset: DataSetType, start: datetime, end: datetime
+    ) -> dict[str, Any]:
+        """Fetch historical data and convert readings into a HistoricalSeries"""
+        if dataset is DataSetType.HISTORICAL_CONSUMPTION:
+            data = await self.api.get_historical_consumption(start=start, end=end)
+        elif dataset is DataSetType.HISTORICAL_GENERATION:
+            data = await self.api.get_historical_generation(start=start, end=end)
+        else:
+            raise ValueError(f"{dataset.name} is not a historical dataset")
+
+        series = series_from_api_data(data["historical"], base=start, end=end)
+
+        # Resolution can't be detected if only a few readings are published, keep
+        # the finest one seen
+        step = self.historical_steps.get(dataset)
+        if step is not None and step < series.step:
+            series = HistoricalSeries(series.start, step, series.values)
+        elif step is None or series.step < step:
+            _LOGGER.debug(f"{dataset.name}: series resolution is {series.step}")
+            self.historical_steps[dataset] = series.step
+
+        return data | {"historical": series}
+
     async def get_historical_power_demand_data(self) -> Any:
         data = await self.api.get_historical_power_demand()
 
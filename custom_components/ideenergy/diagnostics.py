@@ -0,0 +1,151 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import enum
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+from homeassistant.core import HomeAssistant, dt_util
+
+from .barrier import (
+    ATTR_OPEN_PERIOD,
+    ATTR_OPENED_AT,
+    CircuitBreaker,
+    CircuitBreakerState,
+    estimate_next_allowed,
+)
+from .const import (
+    CONF_CONTRACT,
+    DATA_ATTR_HISTORICAL_CONSUMPTION,
+    DATA_ATTR_HISTORICAL_GENERATION,
+    DATA_ATTR_HISTORICAL_POWER_DEMAND,
+    DATA_ATTR_MEASURE_INSTANT,
+    DOMAIN,
+)
+from .datacoordinator import DataSetType, IDeCoordinator
+from .series import HistoricalSeries
+
+TO_REDACT = {CONF_USERNAME, CONF_PASSWORD, CONF_CONTRACT, "title"}
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    coordinator: IDeCoordinator
+    coordinator, _ = hass.data[DOMAIN][entry.entry_id]
+    now = dt_util.utcnow()
+
+    return _serialize(
+        {
+            "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+            "coordinator": {
+                "update_interval": coordinator.update_interval,
+                "last_update_success": coordinator.last_update_success,
+                "zoneinfo": str(coordinator.zoneinfo),
+                "schedule_phase": coordinator.schedule_phase,
+                "requested_datasets": [
+                    x.name
+                    for x in coordinator.barriers
+                    if x & coordinator.requested_datasets
+                ],
+                "historical_steps": {
+                    k.name: v for k, v in coordinator.historical_steps.items()
+                },
+            },
+            "circuit_breaker": _dump_circuit_breaker(coordinator.breaker, now),
+            "barriers": {
+                dataset.name: {
+                    "dump": barrier.dump(),
+                    "next_allowed": estimate_next_allowed(barrier, now=now),
+                }
+                for dataset, barrier in coordinator.barriers.items()
+            },
+            "data": _dump_data(coordinator, now),
+            "metrics": coordinator.metrics.dump(),
+        }
+    )
+
+
+def _dump_circuit_breaker(breaker: CircuitBreaker, now: datetime) -> dict[str, Any]:
+    dump = breaker.dump()
+
+    # Checks are always denied until a probe succeeds, don't estimate
+    if breaker.state is CircuitBreakerState.OPEN:
+        next_allowed = dump[ATTR_OPENED_AT] + dump[ATTR_OPEN_PERIOD]
+    else:
+        next_allowed = now
+
+    return {"dump": dump, "next_allowed": next_allowed}
+
+
+def _dump_data(coordinator: IDeCoordinator, now: datetime) -> dict[str, Any]:
+    """Cache age and size of each dataset, not the data itself"""
+    data = coordinator.data or {}
+
+    def _age(dataset: DataSetType) -> timedelta | None:
+        last_success = coordinator.metrics[dataset].last_success
+        return now - last_success if last_success is not None else None
+
+    def _series(attr: str) -> dict[str, Any]:
+        series: HistoricalSeries | None = (data.get(attr) or {}).get("historical")
+        if series is None:
+            return {"size": None}
+
+        return {
+            "size": len(series),
+            "step": series.step,
+            "start": series.start,
+            "latest_day": series.latest_day(coordinator.zoneinfo),
+        }
+
+    return {
+        DataSetType.MEASURE.name: {
+            "age": _age(DataSetType.MEASURE),
+            "present": data.get(DATA_ATTR_MEASURE_INSTANT) is not None,
+        },
+        DataSetType.HISTORICAL_CONSUMPTION.name: {
+            "age": _age(DataSetType.HISTORICAL_CONSUMPTION),
+            **_series(DATA_ATTR_HISTORICAL_CONSUMPTION),
+        },
+        DataSetType.HISTORICAL_GENERATION.name: {
+            "age": _age(DataSetType.HISTORICAL_GENERATION),
+            **_series(DATA_ATTR_HISTORICAL_GENERATION),
+        },
+        DataSetType.HISTORICAL_POWER_DEMAND.name: {
+            "age": _age(DataSetType.HISTORICAL_POWER_DEMAND),
+            "size": len(data.get(DATA_ATTR_HISTORICAL_POWER_DEMAND) or []),
+        },
+    }
+
+
+def _serialize(obj: Any) -> Any:
+    # Make barrier dumps JSON friendly
+    if isinstance(obj, dict):
+        return {k: _serialize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, deque)):
+        return [_serialize(x) for x in obj]
+    if isinstance(obj, timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, enum.Enum):
+        return obj.name
+
+    return obj
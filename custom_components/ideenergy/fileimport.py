@@ -0,0 +1,212 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import csv
+import itertools
+import logging
+from collections.abc import Iterable, Iterator
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+from typing import TextIO
+from zoneinfo import ZoneInfo
+
+from homeassistant.components.recorder.models import StatisticMetaData
+from homeassistant.core import HomeAssistant
+from homeassistant_historical_sensor import HistoricalState
+
+from .const import FILE_IMPORT_BATCH_SIZE, FILE_IMPORT_READ_CHUNK
+from .importer import StatisticsImporter, get_statistic_lock
+from .tzconv import MAINLAND_SPAIN_ZONEINFO
+
+_LOGGER = logging.getLogger(__name__)
+
+
+CSV_DELIMITER = ";"
+CSV_DATE_COLUMN = "fecha"
+CSV_HOUR_COLUMN = "hora"
+CSV_DATE_FORMAT = "%d/%m/%Y"
+
+
+class FileImportError(Exception):
+    pass
+
+
+def parse_decimal(value: str) -> float:
+    # i-DE exports use comma as decimal separator, allow thousands separators too
+    value = value.strip()
+    if "," in value:
+        value = value.replace(".", "").replace(",", ".")
+
+    return float(value)
+
+
+def local_midnight_as_utc(
+    day: datetime, zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO
+) -> datetime:
+    midnight = datetime.combine(day, time(), tzinfo=zone)
+    return midnight.astimezone(timezone.utc)
+
+
+def hourly_item_end(
+    day: datetime, hour: int, zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO
+) -> datetime:
+    """End of the nth hour (1-based) of a day as an UTC datetime
+
+    i-DE numbers hours sequentially from midnight, DST days have 23 or 25 hours, so
+    they are counted from the local midnight instead of mapped to wall clock times.
+    """
+    return local_midnight_as_utc(day, zone) + timedelta(hours=hour)
+
+
+def historical_states_from_csv(
+    rows: Iterable[list[str]],
+    value_column: str | None = None,
+    zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO,
+) -> Iterator[HistoricalState]:
+    """Convert rows of an i-DE CSV export into historical states
+
+    First row must be the header. Values are in kWh, the column is guessed (the first
+    one ending with '_kwh') unless value_column is given.
+    """
+    rows = iter(rows)
+    try:
+        header = [x.strip().lower() for x in next(rows)]
+    except StopIteration as e:
+        raise FileImportError("file is empty") from e
+
+    if value_column is None:
+        value_column = next((x for x in header if x.endswith("_kwh")), None)
+    else:
+        value_column = value_column.lower()
+
+    try:
+        date_idx = header.index(CSV_DATE_COLUMN)
+        hour_idx = header.index(CSV_HOUR_COLUMN)
+        value_idx = header.index(value_column)  # type: ignore[arg-type]
+    except ValueError as e:
+        raise FileImportError(f"unknown file format (header: {header})") from e
+
+    last_dt: datetime | None = None
+
+    # Rows come grouped by day, parse each day only once
+    day_str: str | None = None
+    midnight: datetime | None = None
+
+    for lineno, row in enumerate(rows, start=2):
+        if not row or not any(row):
+            continue
+
+        try:
+            if row[date_idx] != day_str:
+                midnight = local_midnight_as_utc(
+                    datetime.strptime(row[date_idx].strip(), CSV_DATE_FORMAT), zone
+                )
+                day_str = row[date_idx]
+
+            # Set along with day_str, the first row always parses its day
+            assert midnight is not None
+            dt = midnight + timedelta(hours=int(row[hour_idx]))
+            value = parse_decimal(row[value_idx])
+        except (IndexError, ValueError) as e:
+            _LOGGER.debug(f"line {lineno}: skipping invalid row {row!r} ({e})")
+            continue
+
+        if last_dt is not None and dt <= last_dt:
+            _LOGGER.debug(f"line {lineno}: skipping out of order row {row!r}")
+            continue
+
+        last_dt = dt
+        yield HistoricalState(
+            state=value, dt=dt, attributes={"last_reset": dt - timedelta(hours=1)}
+        )
+
+
+def resolve_import_path(hass: HomeAssistant, filename: str) -> Path:
+    config_dir = Path(hass.config.config_dir).resolve()
+    path = Path(hass.config.path(filename)).resolve()
+
+    if not path.is_relative_to(config_dir) or not hass.config.is_allowed_path(
+        str(path)
+    ):
+        raise FileImportError(f"{filename} is outside the configuration directory")
+
+    return path
+
+
+async def async_import_file(
+    hass: HomeAssistant,
+    path: Path,
+    metadata: StatisticMetaData,
+    value_column: str | None = None,
+    zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO,
+) -> int:
+    """Stream an i-DE CSV export into statistics
+
+    The file is read and parsed in the executor in chunks, statistics are imported
+    in batches of FILE_IMPORT_BATCH_SIZE. Returns the number of statistics imported.
+    """
+    statistic_id = metadata["statistic_id"]
+
+    lock = get_statistic_lock(hass, statistic_id)
+    if lock.locked():
+        _LOGGER.debug(f"{statistic_id}: waiting for another import to finish")
+
+    async with lock:
+        return await _async_import_file(hass, path, metadata, value_column, zone)
+
+
+async def _async_import_file(
+    hass: HomeAssistant,
+    path: Path,
+    metadata: StatisticMetaData,
+    value_column: str | None,
+    zone: ZoneInfo,
+) -> int:
+    statistic_id = metadata["statistic_id"]
+    importer = StatisticsImporter(hass, metadata, batch_size=FILE_IMPORT_BATCH_SIZE)
+
+    fh: TextIO = await hass.async_add_executor_job(
+        lambda: path.open(encoding="utf-8-sig", newline="")
+    )
+    try:
+        states = historical_states_from_csv(
+            csv.reader(fh, delimiter=CSV_DELIMITER),
+            value_column=value_column,
+            zone=zone,
+        )
+
+        def _read_chunk() -> list[HistoricalState]:
+            return list(itertools.islice(states, FILE_IMPORT_READ_CHUNK))
+
+        chunk = await hass.async_add_executor_job(_read_chunk)
+        if not chunk:
+            _LOGGER.warning(f"{statistic_id}: nothing to import from {path}")
+            return 0
+
+        await importer.async_start(chunk[0].dt - timedelta(hours=1))
+        while chunk:
+            await importer.async_add(chunk)
+            chunk = await hass.async_add_executor_job(_read_chunk)
+
+    finally:
+        await hass.async_add_executor_job(fh.close)
+
+    n = await importer.async_finish()
+    _LOGGER.info(f"{statistic_id}: {n} statistics imported from {path}")
+
+    return n
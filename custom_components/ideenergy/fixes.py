@@ -17,6 +17,7 @@
 
 
 import logging
+from datetime import datetime
 
 import sqlalchemy as sa
 from homeassistant.components import recorder
@@ -24,16 +25,36 @@ from homeassistant.components.recorder import db_schema, statistics
 from homeassistant.core import HomeAssistant, dt_util
 from homeassistant_historical_sensor import recorderutil
 
+from .checkpoints import (
+    Checkpoint,
+    find_verified_checkpoint,
+    get_sum_checkpoints,
+    month_start,
+    next_month_start,
+)
+from .profiling import profiled
+
 _LOGGER = logging.getLogger(__name__)
 
 
+@profiled("fixes.fix_statistics")
 async def async_fix_statistics(
     hass: HomeAssistant, statistic_metadata: statistics.StatisticMetaData
 ) -> None:
     def timestamp_as_local(timestamp):
         return dt_util.as_local(dt_util.utc_from_timestamp(timestamp))
 
+    sum_checkpoints = get_sum_checkpoints(hass)
+    checkpoints = await sum_checkpoints.async_get(statistic_metadata["statistic_id"])
+
+    # Filled by fn: checkpoints of the months verified, and the broken point
+    # checkpoints must be dropped from
+    verified_checkpoints: list[Checkpoint] = []
+    drop_from: datetime | None = None
+
     def fn():
+        nonlocal drop_from
+
         fixes_applied = False
 
         statistic_id = statistic_metadata["statistic_id"]
@@ -75,9 +96,15 @@ async def async_fix_statistics(
                 session.commit()
                 fixes_applied = True
 
+                # Sums weren't checked before, verify everything
+                checkpoints.clear()
+
             #
             # Check for broken points and decreasings
             #
+            # Statistics up to a verified sum checkpoint were checked already, start
+            # with the month after it
+            #
             broken_point = None
 
             prev_sum = 0
@@ -85,10 +112,39 @@ async def async_fix_statistics(
                 db_schema.Statistics.start_ts.asc()
             )
 
+            checkpoint = (
+                find_verified_checkpoint(session, current_metadata.id, checkpoints)
+                if statistic_metadata_has_sum
+                else None
+            )
+            if checkpoint is not None:
+                month, prev_sum, _ = checkpoint
+                statistics_iter_stmt = statistics_iter_stmt.where(
+                    db_schema.Statistics.start_ts >= next_month_start(month).timestamp()
+                )
+                _LOGGER.debug(
+                    f"{statistic_id}: sum checkpoint of {month:%Y-%m} verified, "
+                    f"checking statistics after it"
+                )
+
+            # Month being checked, statistics in it and the sum of the latest one
+            month = None
+            month_count = 0
+            month_sum = prev_sum
+
             for statistic in session.execute(statistics_iter_stmt).scalars():
                 is_broken = False
                 local_start_dt = timestamp_as_local(statistic.start_ts)
 
+                if statistic_metadata_has_sum and month != month_start(local_start_dt):
+                    if month is not None:
+                        verified_checkpoints.append((month, month_sum, month_count))
+
+                    month = month_start(local_start_dt)
+                    month_count = 0
+
+                month_count = month_count + 1
+
                 # Check for NULL mean
                 if statistic_metadata_has_mean and statistic.mean is None:
                     is_broken = True
@@ -120,6 +176,8 @@ async def async_fix_statistics(
                     broken_point = statistic.start_ts
                     break
 
+                month_sum = statistic.sum
+
             #
             # Check for broken points (search only for NULLs)
             #
@@ -154,6 +212,7 @@ async def async_fix_statistics(
 
                 session.commit()
                 fixes_applied = True
+                drop_from = timestamp_as_local(broken_point)
 
                 _LOGGER.debug(
                     f"{statistic_id}: "
@@ -187,6 +246,13 @@ async def async_fix_statistics(
                 session.commit()
                 fixes_applied = True
 
+                first_deleted = timestamp_as_local(
+                    min(x.start_ts for x in invalid_statistics)
+                )
+                drop_from = (
+                    min(drop_from, first_deleted) if drop_from else first_deleted
+                )
+
                 _LOGGER.debug(
                     f"{statistic_id}: "
                     f"deleted {len(invalid_statistics)} statistics with invalid attributes"
@@ -236,4 +302,14 @@ async def async_fix_statistics(
             #     )
             # session.commit()
 
-    return await recorder.get_instance(hass).async_add_executor_job(fn)
+    await recorder.get_instance(hass).async_add_executor_job(fn)
+
+    statistic_id = statistic_metadata["statistic_id"]
+    if drop_from is not None:
+        await sum_checkpoints.async_drop_from(statistic_id, drop_from)
+        verified_checkpoints = [
+            x for x in verified_checkpoints if x[0] < month_start(drop_from)
+        ]
+
+    if verified_checkpoints:
+        await sum_checkpoints.async_update(statistic_id, verified_checkpoints)
@@ -0,0 +1,247 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime, time, timedelta
+from typing import Any
+from zoneinfo import ZoneInfo
+
+import sqlalchemy as sa
+from homeassistant.components import recorder
+from homeassistant.components.recorder import db_schema
+from homeassistant.core import HomeAssistant, dt_util
+from homeassistant.helpers.storage import Store
+from homeassistant_historical_sensor import recorderutil
+
+from .backfill import (
+    BackfillStopped,
+    async_fetch_window_states,
+    find_statistics_sensor,
+    make_pacing_barrier,
+    month_windows,
+)
+from .const import DOMAIN, GAP_SCAN_LOOKBACK, HISTORICAL_PERIOD_LENGHT
+from .datacoordinator import DataSetType, IDeCoordinator
+from .importer import StatisticsImporter, get_statistic_lock, get_statistic_metadata_id
+
+_LOGGER = logging.getLogger(__name__)
+
+STORAGE_VERSION = 1
+
+GAP_DATASETS = [
+    DataSetType.HISTORICAL_CONSUMPTION,
+    DataSetType.HISTORICAL_GENERATION,
+]
+
+_HOUR = 60 * 60
+
+
+def find_statistics_gaps(
+    session, statistic_id: str, since: datetime, until: datetime
+) -> list[tuple[datetime, datetime]]:
+    """Find missing hours between existing statistics in [since, until)
+
+    Returns a list of [start, end) ranges. Uses a single query, each statistic is
+    compared with the next one using the LEAD window function.
+    """
+    metadata_id = get_statistic_metadata_id(session, statistic_id)
+    if metadata_id is None:
+        return []
+
+    Statistics = db_schema.Statistics
+
+    subq = (
+        sa.select(
+            Statistics.start_ts.label("start_ts"),
+            sa.func.lead(Statistics.start_ts)
+            .over(order_by=Statistics.start_ts)
+            .label("next_ts"),
+        )
+        .where(Statistics.metadata_id == metadata_id)
+        .where(Statistics.start_ts >= dt_util.as_timestamp(since))
+        .where(Statistics.start_ts < dt_util.as_timestamp(until))
+        .subquery()
+    )
+
+    rows = session.execute(
+        sa.select(subq.c.start_ts, subq.c.next_ts).where(
+            subq.c.next_ts - subq.c.start_ts > _HOUR
+        )
+    ).all()
+
+    return [
+        (
+            dt_util.utc_from_timestamp(start_ts + _HOUR),
+            dt_util.utc_from_timestamp(next_ts),
+        )
+        for start_ts, next_ts in rows
+    ]
+
+
+def days_in_gaps(
+    gaps: Iterable[tuple[datetime, datetime]], zone: ZoneInfo
+) -> set[date]:
+    """Local days (as i-DE reports them) with at least one missing hour"""
+    ret = set()
+    for start, end in gaps:
+        curr = start
+        while curr < end:
+            ret.add(curr.astimezone(zone).date())
+            curr = curr + timedelta(hours=1)
+
+    return ret
+
+
+def contiguous_ranges(days: Iterable[date]) -> Iterator[tuple[date, date]]:
+    """Group days into [start, end) ranges, split at month boundaries"""
+    start = end = None
+    for day in sorted(days):
+        if end is not None and day == end:
+            end = day + timedelta(days=1)
+            continue
+
+        if start is not None:
+            yield from month_windows(start, end)  # type: ignore[arg-type]
+
+        start, end = day, day + timedelta(days=1)
+
+    if start is not None:
+        yield from month_windows(start, end)  # type: ignore[arg-type]
+
+
+def _get_store(hass: HomeAssistant, entry_id: str) -> Store[dict[str, Any]]:
+    return Store(hass, STORAGE_VERSION, f"{DOMAIN}.gaps.{entry_id}")
+
+
+async def async_remove_gaps_store(hass: HomeAssistant, entry_id: str) -> None:
+    """Remove the days checked by the GapFiller of a removed config entry"""
+    await _get_store(hass, entry_id).async_remove()
+
+
+class GapFiller:
+    """Refetches days with missing hours in historical statistics
+
+    Hours with no consumption (or generation) aren't written into statistics, so a
+    gap doesn't always mean missing data. Days are remembered once refetched and
+    aren't requested again.
+    """
+
+    def __init__(self, hass: HomeAssistant, coordinator: IDeCoordinator, entry_id: str):
+        self.hass = hass
+        self.coordinator = coordinator
+        self._store = _get_store(hass, entry_id)
+        self._checked: dict[str, list[str]] | None = None
+        self._lock = asyncio.Lock()
+
+    async def _async_get_checked(self, statistic_id: str) -> set[date]:
+        if self._checked is None:
+            self._checked = await self._store.async_load() or {}
+
+        return {date.fromisoformat(x) for x in self._checked.get(statistic_id, [])}
+
+    async def _async_set_checked(
+        self, statistic_id: str, days: set[date], since: date
+    ) -> None:
+        assert self._checked is not None
+        self._checked[statistic_id] = sorted(x.isoformat() for x in days if x >= since)
+        await self._store.async_save(self._checked)
+
+    async def async_scan(self, statistic_id: str, now: datetime) -> set[date]:
+        since = now - timedelta(days=GAP_SCAN_LOOKBACK)
+        # Recent days are still covered by regular updates
+        until = now - HISTORICAL_PERIOD_LENGHT
+
+        def fn():
+            with recorderutil.hass_recorder_session(self.hass) as session:
+                return find_statistics_gaps(session, statistic_id, since, until)
+
+        gaps = await recorder.get_instance(self.hass).async_add_executor_job(fn)
+        days = days_in_gaps(
+            gaps, self.coordinator.zoneinfo
+        ) - await self._async_get_checked(statistic_id)
+
+        _LOGGER.debug(
+            f"{statistic_id}: {len(gaps)} gaps found since {since}, "
+            f"{len(days)} days to refetch"
+        )
+
+        return days
+
+    async def async_fill(self, now: datetime | None = None) -> None:
+        """Scan consumption and generation statistics and refetch missing days"""
+        if self._lock.locked():
+            _LOGGER.debug("gap filling already running")
+            return
+
+        now = now or dt_util.utcnow()
+
+        async with self._lock:
+            for dataset in GAP_DATASETS:
+                sensor = find_statistics_sensor(self.coordinator, dataset)
+                if sensor is None:
+                    continue
+
+                try:
+                    await self._async_fill_dataset(
+                        dataset, sensor.get_statistic_metadata(), now
+                    )
+                except BackfillStopped as e:
+                    _LOGGER.debug(f"{dataset.name}: gap filling stopped, {e}")
+                    return
+
+    async def _async_fill_dataset(
+        self, dataset: DataSetType, metadata, now: datetime
+    ) -> None:
+        statistic_id = metadata["statistic_id"]
+
+        days = await self.async_scan(statistic_id, now)
+        if not days:
+            return
+
+        checked = await self._async_get_checked(statistic_id)
+        barrier = make_pacing_barrier()
+
+        for start, end in contiguous_ranges(days):
+            hist_states = await async_fetch_window_states(
+                self.coordinator,
+                dataset,
+                barrier,
+                start,
+                end,
+                dataset_barrier=self.coordinator.barriers.get(dataset),
+            )
+
+            # Import the whole range, sums of following statistics are spliced
+            async with get_statistic_lock(self.hass, statistic_id):
+                importer = StatisticsImporter(self.hass, metadata)
+                await importer.async_start(
+                    datetime.combine(start, time(), tzinfo=self.coordinator.zoneinfo)
+                )
+                await importer.async_add(hist_states)
+                n = await importer.async_finish()
+
+            checked.update(start + timedelta(days=x) for x in range((end - start).days))
+            await self._async_set_checked(
+                statistic_id,
+                checked,
+                since=(now - timedelta(days=GAP_SCAN_LOOKBACK)).date(),
+            )
+
+            _LOGGER.debug(f"{statistic_id}: {start} → {end} refetched, {n} statistics")
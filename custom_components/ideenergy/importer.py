@@ -0,0 +1,336 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from homeassistant.components import recorder
+from homeassistant.components.recorder import db_schema
+from homeassistant.components.recorder.models import StatisticData, StatisticMetaData
+from homeassistant.components.recorder.statistics import (
+    async_add_external_statistics,
+    async_import_statistics,
+    valid_statistic_id,
+)
+from homeassistant.core import HomeAssistant, dt_util
+from homeassistant_historical_sensor import HistoricalState, recorderutil
+
+from .checkpoints import Checkpoint, get_sum_checkpoints, month_start
+from .const import DATA_STATISTIC_LOCKS, DOMAIN, STATISTICS_IMPORT_BATCH_SIZE
+from .offload import async_chunked
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def hour_block_for_hist_state(hist_state: HistoricalState) -> datetime:
+    # XX:00:00 states belongs to previous hour block
+    if hist_state.dt.minute == 0 and hist_state.dt.second == 0:
+        dt = hist_state.dt - timedelta(hours=1)
+        return dt.replace(minute=0, second=0, microsecond=0)
+
+    else:
+        return hist_state.dt.replace(minute=0, second=0, microsecond=0)
+
+
+def get_statistic_lock(hass: HomeAssistant, statistic_id: str) -> asyncio.Lock:
+    """Lock to hold while importing into (or splicing) statistic_id
+
+    Backfills, file imports and gap filling read the sum to continue from and shift
+    the following ones, two of them running on the same statistic would mix sums.
+    """
+    locks = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_STATISTIC_LOCKS, {})
+    if statistic_id not in locks:
+        locks[statistic_id] = asyncio.Lock()
+
+    return locks[statistic_id]
+
+
+class StatisticsImporter:
+    """Aggregates historical states into hourly statistics and imports them
+
+    States must be added in chronological order. Statistics are imported in batches
+    of `batch_size` carrying the running sum between batches, and a batch isn't
+    queued until the recorder has written the previous one, so memory usage doesn't
+    depend on the amount of data imported.
+
+    Statistics already present after the imported range are spliced: their sums are
+    shifted to continue from the imported ones (see async_finish).
+
+    After async_start the number of statistics of each month is tracked too, and a
+    sum checkpoint is saved for every month closed by the import. Checkpoints from
+    the start month on are dropped, imported statistics replace them.
+    """
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        metadata: StatisticMetaData,
+        batch_size: int = STATISTICS_IMPORT_BATCH_SIZE,
+    ):
+        self.hass = hass
+        self.metadata = metadata
+        self.batch_size = batch_size
+
+        self._sum: float = 0
+        self._buffer: list[StatisticData] = []
+        self._pending_start: datetime | None = None
+        self._pending_state: float = 0
+        self._last_start: datetime | None = None
+        self._n_imported = 0
+
+        # Month of the latest statistic and how many statistics it has, counted
+        # only after async_start
+        self._counting = False
+        self._month: datetime | None = None
+        self._month_count = 0
+        self._checkpoints: list[Checkpoint] = []
+
+    @property
+    def statistic_id(self) -> str:
+        return self.metadata["statistic_id"]
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    @property
+    def n_imported(self) -> int:
+        return self._n_imported
+
+    async def async_start(self, start: datetime) -> None:
+        """Continue the running sum (and month count) from the last statistic before
+        start"""
+
+        def fn():
+            with recorderutil.hass_recorder_session(self.hass) as session:
+                return get_month_before(session, self.statistic_id, start)
+
+        (
+            self._sum,
+            self._month,
+            self._month_count,
+        ) = await recorder.get_instance(
+            self.hass
+        ).async_add_executor_job(fn)
+        self._counting = True
+
+        await get_sum_checkpoints(self.hass).async_drop_from(self.statistic_id, start)
+        _LOGGER.debug(
+            f"{self.statistic_id}: importing statistics from {start} "
+            f"using {self._sum} as base sum"
+        )
+
+    def set_base_sum(self, value: float) -> None:
+        self._sum = value
+        self._counting = False
+
+    async def async_add(self, hist_states: Iterable[HistoricalState]) -> None:
+        # Aggregation is stateful, it can't move to the executor. Yield to the event
+        # loop every few states instead
+        async for chunk in async_chunked(hist_states):
+            for statistic in self._aggregate(chunk):
+                self._buffer.append(statistic)
+                if len(self._buffer) >= self.batch_size:
+                    await self.async_flush()
+
+    def _aggregate(
+        self, hist_states: Iterable[HistoricalState]
+    ) -> Iterator[StatisticData]:
+        for hist_state in hist_states:
+            block = hour_block_for_hist_state(hist_state)
+
+            if self._pending_start is not None and block != self._pending_start:
+                yield self._close_pending()
+
+            if self._pending_start is None:
+                self._pending_start = block
+                self._pending_state = 0
+
+            self._pending_state = self._pending_state + hist_state.state
+
+    def _close_pending(self) -> StatisticData:
+        # Only called while an hour block is being aggregated
+        assert self._pending_start is not None
+        start = self._pending_start
+
+        self._track_month(start)
+
+        self._sum = self._sum + self._pending_state
+        ret = StatisticData(start=start, state=self._pending_state, sum=self._sum)
+        self._last_start = start
+        self._pending_start = None
+        self._pending_state = 0
+
+        return ret
+
+    def _track_month(self, start: datetime) -> None:
+        # Called before start's statistic is added to the running sum
+        month = month_start(start)
+        if month != self._month:
+            if self._counting and self._month is not None:
+                self._checkpoints.append((self._month, self._sum, self._month_count))
+
+            self._month = month
+            self._month_count = 0
+
+        self._month_count = self._month_count + 1
+
+    async def async_flush(self, close: bool = False) -> None:
+        """Import buffered statistics
+
+        If close is True the hour block being aggregated is closed and imported too,
+        use it only at boundaries where no more states for that hour will come.
+        """
+        if close and self._pending_start is not None:
+            self._buffer.append(self._close_pending())
+
+        if not self._buffer:
+            return
+
+        # Wait for the previous batch to be written, otherwise batches pile up in the
+        # recorder queue when importing faster than it writes
+        if self._n_imported:
+            await recorder.get_instance(self.hass).async_block_till_done()
+
+        batch, self._buffer = self._buffer, []
+        if valid_statistic_id(self.statistic_id):
+            async_add_external_statistics(self.hass, self.metadata, batch)
+        else:
+            async_import_statistics(self.hass, self.metadata, batch)
+
+        self._n_imported = self._n_imported + len(batch)
+        _LOGGER.debug(
+            f"{self.statistic_id}: {len(batch)} statistics queued for import "
+            f"(up to {dt_util.as_local(batch[-1]['start'])})"
+        )
+
+        if self._checkpoints:
+            checkpoints, self._checkpoints = self._checkpoints, []
+            await get_sum_checkpoints(self.hass).async_update(
+                self.statistic_id, checkpoints
+            )
+
+    async def async_finish(self) -> int:
+        """Import everything left and splice statistics after the imported range
+
+        Returns the number of statistics imported
+        """
+        await self.async_flush(close=True)
+
+        if self._last_start is None:
+            return self._n_imported
+
+        # Wait for recorder to process the queued imports
+        await recorder.get_instance(self.hass).async_block_till_done()
+
+        last_start = self._last_start
+        last_sum = self._sum
+
+        def fn():
+            with recorderutil.hass_recorder_session(self.hass) as session:
+                return splice_sums_after(
+                    session, self.statistic_id, last_start, last_sum
+                )
+
+        n = await recorder.get_instance(self.hass).async_add_executor_job(fn)
+        if n:
+            _LOGGER.debug(f"{self.statistic_id}: {n} statistics after import adjusted")
+
+        return self._n_imported
+
+
+def get_statistic_metadata_id(session, statistic_id: str) -> int | None:
+    return session.execute(
+        sa.select(db_schema.StatisticsMeta.id).where(
+            db_schema.StatisticsMeta.statistic_id == statistic_id
+        )
+    ).scalar()
+
+
+def get_month_before(
+    session, statistic_id: str, dt: datetime
+) -> tuple[float, datetime | None, int]:
+    """Sum of the last statistic before dt, its month and how many statistics that
+    month has before dt"""
+    metadata_id = get_statistic_metadata_id(session, statistic_id)
+    if metadata_id is None:
+        return 0, None, 0
+
+    before_stmt = (
+        sa.select(db_schema.Statistics)
+        .where(db_schema.Statistics.metadata_id == metadata_id)
+        .where(db_schema.Statistics.start_ts < dt_util.as_timestamp(dt))
+    )
+
+    last = session.execute(
+        before_stmt.order_by(db_schema.Statistics.start_ts.desc()).limit(1)
+    ).scalar()
+    if last is None:
+        return 0, None, 0
+
+    month = month_start(dt_util.utc_from_timestamp(last.start_ts))
+    count = session.execute(
+        sa.select(sa.func.count()).select_from(
+            before_stmt.where(
+                db_schema.Statistics.start_ts >= month.timestamp()
+            ).subquery()
+        )
+    ).scalar()
+
+    return float(last.sum or 0), month, count
+
+
+def splice_sums_after(
+    session, statistic_id: str, dt: datetime, sum_at_dt: float
+) -> int:
+    """Shift sums of statistics after dt to continue from sum_at_dt
+
+    Returns the number of statistics updated
+    """
+    metadata_id = get_statistic_metadata_id(session, statistic_id)
+    if metadata_id is None:
+        return 0
+
+    after_stmt = (
+        sa.select(db_schema.Statistics)
+        .where(db_schema.Statistics.metadata_id == metadata_id)
+        .where(db_schema.Statistics.start_ts > dt_util.as_timestamp(dt))
+    )
+
+    first = session.execute(
+        after_stmt.order_by(db_schema.Statistics.start_ts.asc()).limit(1)
+    ).scalar()
+    if first is None or first.sum is None:
+        return 0
+
+    delta = sum_at_dt + (first.state or 0) - first.sum
+    if abs(delta) < 1e-6:
+        return 0
+
+    res = session.execute(
+        sa.update(db_schema.Statistics)
+        .where(db_schema.Statistics.metadata_id == metadata_id)
+        .where(db_schema.Statistics.start_ts > dt_util.as_timestamp(dt))
+        .values(sum=db_schema.Statistics.sum + delta)
+    )
+    session.commit()
+
+    return res.rowcount
@@ -0,0 +1,197 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import bisect
+import enum
+import math
+import time
+from collections import Counter, deque
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+ATTR_ATTEMPTS = "attempts"
+ATTR_SUCCESSES = "successes"
+ATTR_FAILURES = "failures"
+ATTR_DENIALS = "denials"
+ATTR_LATENCY_P50 = "latency_p50"
+ATTR_LATENCY_P90 = "latency_p90"
+ATTR_LATENCY_P99 = "latency_p99"
+ATTR_LATENCY_HISTOGRAM = "latency_histogram"
+ATTR_LAST_SUCCESS = "last_success"
+
+# Upper bounds (in seconds) of latency buckets, last one catches everything else
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, math.inf)
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram. Memory usage doesn't grow with the number of
+    observations, percentiles are approximated by the upper bound of the bucket
+    they fall in.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * len(buckets)
+
+    @property
+    def count(self) -> int:
+        return sum(self._counts)
+
+    def observe(self, seconds: float) -> None:
+        self._counts[bisect.bisect_left(self._buckets, seconds)] += 1
+
+    def percentile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-th percentile (0 < q ≤ 100)"""
+        total = self.count
+        if not total:
+            return None
+
+        threshold = total * q / 100
+        acc = 0
+        for bound, count in zip(self._buckets, self._counts):
+            acc = acc + count
+            if acc >= threshold:
+                return bound
+
+        return self._buckets[-1]
+
+    def dump(self) -> dict[str, int]:
+        return {
+            (f"le_{bound:g}" if math.isfinite(bound) else "inf"): count
+            for bound, count in zip(self._buckets, self._counts)
+        }
+
+
+class DataSetMetrics:
+    """Fetch counters of a dataset since startup"""
+
+    def __init__(self) -> None:
+        self.attempts = 0
+        self.successes = 0
+        self.failures: Counter[str] = Counter()  # By exception class
+        self.denials: Counter[str] = Counter()  # By barrier deny code
+        self.latency = LatencyHistogram()
+        self.last_success: datetime | None = None
+
+    @property
+    def success_rate(self) -> float | None:
+        if not self.attempts:
+            return None
+
+        return self.successes / self.attempts
+
+    def denied(self, code: Any) -> None:
+        self.denials[deny_code_name(code)] += 1
+
+    def attempted(self) -> None:
+        self.attempts += 1
+
+    def succeeded(self, latency: float, now: datetime | None = None) -> None:
+        self.successes += 1
+        self.last_success = now
+        self.latency.observe(latency)
+
+    def failed(self, exc: BaseException, latency: float) -> None:
+        self.failures[type(exc).__name__] += 1
+        self.latency.observe(latency)
+
+    def dump(self) -> dict[str, Any]:
+        def _finite(x: float | None) -> float | None:
+            # Infinity isn't valid JSON
+            return x if x is not None and math.isfinite(x) else None
+
+        return {
+            ATTR_ATTEMPTS: self.attempts,
+            ATTR_SUCCESSES: self.successes,
+            ATTR_FAILURES: dict(self.failures),
+            ATTR_DENIALS: dict(self.denials),
+            ATTR_LATENCY_P50: _finite(self.latency.percentile(50)),
+            ATTR_LATENCY_P90: _finite(self.latency.percentile(90)),
+            ATTR_LATENCY_P99: _finite(self.latency.percentile(99)),
+            ATTR_LATENCY_HISTOGRAM: self.latency.dump(),
+            ATTR_LAST_SUCCESS: self.last_success,
+        }
+
+
+class FetchMetrics:
+    """
+    Metrics of every dataset plus a bounded history of the latest refresh cycles,
+    with the outcome and duration of each dataset within the cycle.
+    """
+
+    def __init__(self, datasets: Iterable[enum.Flag], history_size: int):
+        self._datasets = {x: DataSetMetrics() for x in datasets}
+        self.history: deque[dict[str, Any]] = deque(maxlen=history_size)
+
+        self._cycle: dict[str, Any] | None = None
+        self._cycle_t0 = 0.0
+
+    def __getitem__(self, dataset: enum.Flag) -> DataSetMetrics:
+        return self._datasets[dataset]
+
+    def start_cycle(self, now: datetime) -> None:
+        self._cycle = {"started": now, "datasets": {}}
+        self._cycle_t0 = time.monotonic()
+
+    def end_cycle(self) -> None:
+        if self._cycle is None:
+            return
+
+        self._cycle["duration"] = round(time.monotonic() - self._cycle_t0, 3)
+        self.history.append(self._cycle)
+        self._cycle = None
+
+    def _outcome(
+        self, dataset: enum.Flag, outcome: str, latency: float | None = None
+    ) -> None:
+        if self._cycle is None:
+            return
+
+        self._cycle["datasets"][dataset.name] = {
+            "outcome": outcome,
+            "duration": round(latency, 3) if latency is not None else None,
+        }
+
+    def denied(self, dataset: enum.Flag, code: Any) -> None:
+        self[dataset].denied(code)
+        self._outcome(dataset, f"denied: {deny_code_name(code)}")
+
+    def attempted(self, dataset: enum.Flag) -> None:
+        self[dataset].attempted()
+
+    def succeeded(
+        self, dataset: enum.Flag, latency: float, now: datetime | None = None
+    ) -> None:
+        self[dataset].succeeded(latency, now=now)
+        self._outcome(dataset, "success", latency)
+
+    def failed(self, dataset: enum.Flag, exc: BaseException, latency: float) -> None:
+        self[dataset].failed(exc, latency)
+        self._outcome(dataset, f"failed: {type(exc).__name__}", latency)
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "datasets": {k.name: v.dump() for k, v in self._datasets.items()},
+            "history": list(self.history),
+        }
+
+
+def deny_code_name(code: Any) -> str:
+    return getattr(code, "name", str(code)).lower()
@@ -0,0 +1,63 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import itertools
+import logging
+from collections.abc import AsyncIterator, Callable, Iterable
+from typing import TypeVar
+
+from homeassistant.core import HomeAssistant
+
+from .const import EXECUTOR_CONVERSION_THRESHOLD, LOOP_YIELD_CHUNK
+
+_LOGGER = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+
+
+async def async_convert(
+    hass: HomeAssistant, size: int, fn: Callable[..., _T], *args
+) -> _T:
+    """Run a CPU bound conversion of `size` items without blocking the event loop
+
+    Small conversions (the regular hourly updates) run inline, dispatching them is
+    more expensive than running them. Large ones (imports, backfills, the first
+    update after a long outage) run in the executor.
+
+    fn must not touch hass state, pass everything it needs as arguments.
+    """
+    if size < EXECUTOR_CONVERSION_THRESHOLD:
+        return fn(*args)
+
+    _LOGGER.debug(f"converting {size} items in the executor ({fn.__name__})")
+    return await hass.async_add_executor_job(fn, *args)
+
+
+async def async_chunked(
+    iterable: Iterable[_T], size: int = LOOP_YIELD_CHUNK
+) -> AsyncIterator[list[_T]]:
+    """Split iterable into lists of `size` items, yielding to the loop in between
+
+    For stateful processing that can't move to the executor. Lazy iterables are
+    consumed chunk by chunk, so the work done producing them is split too.
+    """
+    it = iter(iterable)
+    while chunk := list(itertools.islice(it, size)):
+        yield chunk
+        await asyncio.sleep(0)
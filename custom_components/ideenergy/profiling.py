@@ -0,0 +1,273 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import cProfile
+import functools
+import inspect
+import io
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from collections.abc import Callable, Coroutine, Generator
+from pathlib import Path
+from typing import Any, TypeVar
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILE_CYCLE_PATH = "coordinator.update"
+TRACEMALLOC_FRAMES = 10
+REPORT_TOP = 40
+
+_T = TypeVar("_T")
+
+# Running session, profiled paths only check this when disabled
+_session: "ProfilingSession | None" = None
+
+
+class ProfilingSession:
+    """
+    Profiles code run by @profiled paths with cProfile, and every allocation with
+    tracemalloc, until stopped or `cycles` coordinator updates have run.
+
+    Only code executed on behalf of a profiled path is measured: coroutines are
+    stepped with the profiler enabled while they run and disabled while they are
+    suspended, so other tasks running meanwhile don't show up.
+    """
+
+    def __init__(self, cycles: int | None = None):
+        self.cycles = cycles
+        self.done = asyncio.Event()
+
+        self.calls: Counter[str] = Counter()
+        self.wall_time: defaultdict[str, float] = defaultdict(float)
+
+        self._profile = cProfile.Profile()
+        self._thread_id = threading.get_ident()
+        self._depth = 0
+        self._n_cycles = 0
+        self._started = 0.0
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._stop_tracemalloc = False
+
+    def start(self) -> None:
+        self._started = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._stop_tracemalloc = True
+
+        self._snapshot = tracemalloc.take_snapshot()
+
+    def stop(self) -> str:
+        """Stop profiling and build the text report"""
+        assert self._snapshot is not None
+
+        snapshot = tracemalloc.take_snapshot()
+        if self._stop_tracemalloc:
+            tracemalloc.stop()
+
+        buff = io.StringIO()
+        elapsed = time.monotonic() - self._started
+        buff.write(f"Profiled for {elapsed:.1f}s, {self._n_cycles} update cycles\n\n")
+
+        buff.write("Paths (calls, wall time including suspended time)\n")
+        for name, calls in sorted(self.calls.items()):
+            buff.write(f"  {name}: {calls} calls, {self.wall_time[name]:.3f}s\n")
+
+        buff.write(f"\nTop {REPORT_TOP} functions by cumulative time\n")
+        if self.calls:
+            stats = pstats.Stats(self._profile, stream=buff)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_TOP)
+        else:
+            # pstats refuses an empty profile
+            buff.write("  no profiled path has run\n")
+
+        buff.write(f"\nTop {REPORT_TOP} allocation changes\n")
+        for diff in snapshot.compare_to(self._snapshot, "lineno")[:REPORT_TOP]:
+            buff.write(f"  {diff}\n")
+
+        return buff.getvalue()
+
+    def dump_stats(self, path: Path) -> None:
+        self._profile.dump_stats(path)
+
+    def _enter(self) -> None:
+        if self._depth == 0:
+            self._profile.enable()
+        self._depth = self._depth + 1
+
+    def _exit(self) -> None:
+        self._depth = self._depth - 1
+        if self._depth == 0:
+            self._profile.disable()
+
+    def _record(self, name: str, t0: float) -> None:
+        self.calls[name] += 1
+        self.wall_time[name] += time.monotonic() - t0
+
+        if name == PROFILE_CYCLE_PATH:
+            self._n_cycles = self._n_cycles + 1
+            if self.cycles is not None and self._n_cycles >= self.cycles:
+                self.done.set()
+
+    def call(self, name: str, fn: Callable[..., _T], *args, **kwargs) -> _T:
+        t0 = time.monotonic()
+
+        # Conversions offloaded to the executor are timed but not profiled, the
+        # profiler belongs to the event loop thread
+        if threading.get_ident() != self._thread_id:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._record(name, t0)
+
+        self._enter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._exit()
+            self._record(name, t0)
+
+    async def call_async(self, name: str, coro: Coroutine[Any, Any, _T]) -> _T:
+        t0 = time.monotonic()
+        try:
+            return await _SteppedCoroutine(self, coro)
+        finally:
+            self._record(name, t0)
+
+
+class _SteppedCoroutine:
+    # Runs each step of a coroutine with the session profiler enabled
+    def __init__(self, session: ProfilingSession, coro: Coroutine):
+        self._session = session
+        self._coro = coro
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        value: Any = None
+        exc: BaseException | None = None
+        while True:
+            self._session._enter()
+            try:
+                if exc is not None:
+                    future = self._coro.throw(exc)
+                else:
+                    future = self._coro.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self._session._exit()
+
+            try:
+                value, exc = (yield future), None
+            except BaseException as e:
+                value, exc = None, e
+
+
+def profiled(name: str):
+    """Profile calls to the decorated function while a session is running
+
+    Works with functions and coroutine functions. With no session running the
+    overhead is a global lookup.
+    """
+
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _session is None:
+                    return await fn(*args, **kwargs)
+
+                return await _session.call_async(name, fn(*args, **kwargs))
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _session is None:
+                return fn(*args, **kwargs)
+
+            return _session.call(name, fn, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_profiling() -> bool:
+    return _session is not None
+
+
+def start_profiling(cycles: int | None = None) -> ProfilingSession:
+    """Start and register a profiling session, see async_profile
+
+    Synchronous, the caller holds the session as soon as this returns and a second
+    call fails even if the first session task hasn't run yet.
+    """
+    global _session
+
+    if _session is not None:
+        raise RuntimeError("a profiling session is already running")
+
+    session = ProfilingSession(cycles=cycles)
+    _session = session
+    session.start()
+
+    return session
+
+
+async def async_profile(
+    hass, session: ProfilingSession, duration: float
+) -> tuple[Path, Path]:
+    """Run a profiling session and write its results into the config directory
+
+    Stops after `duration` seconds or the session `cycles` coordinator updates,
+    whatever comes first. Returns the paths of the .prof file (for pstats,
+    snakeviz…) and the text report.
+    """
+    global _session
+
+    _LOGGER.info(f"profiling started ({duration}s, cycles: {session.cycles})")
+
+    try:
+        try:
+            async with asyncio.timeout(duration):
+                await session.done.wait()
+        except TimeoutError:
+            pass
+
+    finally:
+        if _session is session:
+            _session = None
+
+    ts = time.strftime("%Y%m%d-%H%M%S")
+    prof_path = Path(hass.config.path(f"ideenergy_profile_{ts}.prof"))
+    report_path = Path(hass.config.path(f"ideenergy_profile_{ts}.txt"))
+
+    def _write() -> None:
+        report = session.stop()
+        session.dump_stats(prof_path)
+        report_path.write_text(report, encoding="utf-8")
+
+    await hass.async_add_executor_job(_write)
+    _LOGGER.info(f"profiling finished, results written to {prof_path}, {report_path}")
+
+    return prof_path, report_path
@@ -0,0 +1,61 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from collections.abc import Callable
+
+_LOGGER = logging.getLogger(__name__)
+
+
+PhaseCallback = Callable[[float], None]
+
+
+class Scheduler:
+    """Spreads config entries over their allowed update windows
+
+    Each registered entry gets a phase: a number in [0, 1) evenly distributed between
+    all entries and deterministic (entries are sorted by ID). Coordinators use it as
+    the offset within each window so entries don't hit i-DE at the same time.
+    """
+
+    def __init__(self):
+        self._callbacks: dict[str, PhaseCallback] = {}
+
+    def register(self, entry_id: str, callback: PhaseCallback) -> Callable[[], None]:
+        """Register an entry, callback is called each time its phase changes
+
+        Returns a function to unregister the entry
+        """
+        self._callbacks[entry_id] = callback
+        self._notify()
+
+        def _unregister() -> None:
+            self._callbacks.pop(entry_id, None)
+            self._notify()
+
+        return _unregister
+
+    def phase(self, entry_id: str) -> float:
+        entry_ids = sorted(self._callbacks)
+        return entry_ids.index(entry_id) / len(entry_ids)
+
+    def _notify(self) -> None:
+        for entry_id, callback in self._callbacks.items():
+            phase = self.phase(entry_id)
+            _LOGGER.debug(f"{entry_id}: phase set to {phase:.3f}")
+            callback(phase)
@@ -27,9 +27,10 @@
 
 import itertools
 import logging
-from collections.abc import Callable
-from datetime import datetime, timedelta
+from collections.abc import Callable, Iterator
+from datetime import datetime, timedelta, timezone
 from typing import Any
+from zoneinfo import ZoneInfo
 
 from homeassistant.components import recorder
 from homeassistant.components.recorder import statistics
@@ -41,19 +42,24 @@ from homeassistant.components.sensor import (
 )
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
+    PERCENTAGE,
     STATE_UNAVAILABLE,
     STATE_UNKNOWN,
     UnitOfEnergy,
     UnitOfPower,
 )
 from homeassistant.core import HomeAssistant, callback, dt_util
+from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.restore_state import RestoreEntity
 from homeassistant.helpers.typing import DiscoveryInfoType
-from homeassistant.util import dt as dtutil
-from homeassistant_historical_sensor import HistoricalSensor, HistoricalState
+from homeassistant_historical_sensor import (
+    HistoricalSensor,
+    HistoricalState,
+    recorderutil,
+)
 
-from .const import DOMAIN
+from .const import CONF_STATISTICS_ONLY, DOMAIN
 from .datacoordinator import (
     DATA_ATTR_HISTORICAL_CONSUMPTION,
     DATA_ATTR_HISTORICAL_GENERATION,
@@ -64,10 +70,15 @@ from .datacoordinator import (
 )
 from .entity import IDeEntity
 from .fixes import async_fix_statistics
+from .importer import StatisticsImporter, get_statistic_lock, hour_block_for_hist_state
+from .metrics import ATTR_LATENCY_HISTOGRAM
+from .offload import async_convert
+from .profiling import profiled
+from .series import HistoricalSeries
+from .tzconv import MAINLAND_SPAIN_ZONEINFO, TransitionTable
 
 PLATFORM = "sensor"
 
-MAINLAND_SPAIN_ZONEINFO = dtutil.zoneinfo.ZoneInfo("Europe/Madrid")
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -86,6 +97,63 @@ _LOGGER = logging.getLogger(__name__)
 
 
 class HistoricalSensorMixin(HistoricalSensor):
+    """Writes only historical states newer than the ones already in the recorder
+
+    Sensors provide historical_data and historical_states_from_data, historical
+    states are built on each write and filtered using the latest state written,
+    restored from the recorder when the sensor is added. Large conversions run in
+    the executor (see offload.async_convert).
+
+    In statistics-only mode states aren't written at all, only statistics. The
+    latest written datetime is then restored from the last statistic.
+
+    The latest written datetime only moves once statistics are written too: if their
+    import fails states are passed again on next write (the ones already in the
+    recorder are skipped) and their statistics get another chance.
+    """
+
+    def __init__(self, *args, statistics_only: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._statistics_only = statistics_only
+        self._latest_written_dt: datetime | None = None
+
+    async def async_added_to_hass(self):
+        await super().async_added_to_hass()
+
+        if self._statistics_only:
+            self._latest_written_dt = await self._async_get_latest_statistic_dt()
+        else:
+            self._latest_written_dt = await self._async_get_latest_state_dt()
+
+        _LOGGER.debug(
+            f"{self.entity_id}: latest data written at {self._latest_written_dt} "
+            f"(statistics only: {self._statistics_only})"
+        )
+
+    async def _async_get_latest_state_dt(self) -> datetime | None:
+        def fn():
+            with recorderutil.hass_recorder_session(self.hass) as session:
+                latest = recorderutil.get_entity_latest_state(session, self)
+                if latest is None or latest.last_updated_ts is None:
+                    return None
+
+                return dt_util.utc_from_timestamp(latest.last_updated_ts)
+
+        return await recorder.get_instance(self.hass).async_add_executor_job(fn)
+
+    async def _async_get_latest_statistic_dt(self) -> datetime | None:
+        if self.statistic_id is None:
+            return None
+
+        latest = await recorderutil.get_last_statistics_wrapper(
+            self.hass, self.statistic_id, types={"state"}
+        )
+        if not latest:
+            return None
+
+        # Statistics are stored by the start of their hour block
+        return dt_util.utc_from_timestamp(latest["start"]) + timedelta(hours=1)
+
     @callback
     def _handle_coordinator_update(self) -> None:
         self.hass.add_job(self.async_write_ha_historical_states())
@@ -93,8 +161,68 @@ class HistoricalSensorMixin(HistoricalSensor):
     def async_update_historical(self) -> None:
         pass
 
+    @property
+    def historical_data(self) -> Any:
+        """Coordinator data historical states are built from, None if missing"""
+        raise NotImplementedError()
+
+    def historical_states_from_data(
+        self, data: Any, zone: ZoneInfo
+    ) -> list[HistoricalState]:
+        # May run in the executor, use only its arguments
+        raise NotImplementedError()
+
+    def _new_historical_states(
+        self, data: Any, zone: ZoneInfo, after: datetime | None
+    ) -> list[HistoricalState]:
+        hist_states = self.historical_states_from_data(data, zone)
+        if after is None:
+            return hist_states
+
+        return [x for x in hist_states if x.dt > after]
+
+    async def async_write_ha_historical_states(self):
+        # Built once per write, HistoricalSensor reads historical_states for both
+        # states and statistics
+        data = self.historical_data
+        self._attr_historical_states = await async_convert(
+            self.hass,
+            len(data) if data else 0,
+            self._new_historical_states,
+            data,
+            self.coordinator.zoneinfo,
+            self._latest_written_dt,
+        )
+
+        if not self._attr_historical_states:
+            _LOGGER.debug(
+                f"{self.entity_id}: no states newer than {self._latest_written_dt}"
+            )
+            return
+
+        await super().async_write_ha_historical_states()
+
+        # Recorder states are as new as these (written now or before), statistics
+        # too (StatisticsMixin imports only the ones after the last statistic)
+        self._latest_written_dt = max(x.dt for x in self._attr_historical_states)
+
+    async def _async_write_recorder_states(
+        self, hist_states: list[HistoricalState]
+    ) -> list[HistoricalState]:
+        if self._statistics_only:
+            return []
+
+        return await super()._async_write_recorder_states(hist_states)
+
 
 class StatisticsMixin(HistoricalSensor):
+    """Hourly sum statistics, imported in batches as they are aggregated
+
+    Statistics are never built as a whole: StatisticsImporter imports them every
+    STATISTICS_IMPORT_BATCH_SIZE hours carrying the running sum, each batch is a
+    recorder job of its own.
+    """
+
     @property
     def statistic_id(self):
         return self.entity_id
@@ -115,39 +243,26 @@ class StatisticsMixin(HistoricalSensor):
         #
         await async_fix_statistics(self.hass, self.get_statistic_metadata())
 
-    async def async_calculate_statistic_data(
-        self, hist_states: list[HistoricalState], *, latest: dict | None
-    ) -> list[StatisticData]:
+    @profiled("sensor.import_statistics")
+    async def _async_write_statistic_data(
+        self, hist_states: list[HistoricalState]
+    ) -> list[HistoricalState]:
         #
-        # Filter out invalid states
+        # Replaces HistoricalSensor's implementation, which calculates every
+        # statistic with async_calculate_statistic_data and imports them at once
         #
 
-        n_original_hist_states = len(hist_states)
-        hist_states = [x for x in hist_states if x.state not in (0, None)]
-        if len(hist_states) != n_original_hist_states:
-            _LOGGER.warning(
-                f"{self.statistic_id}: "
-                + "found some weird values in historical statistics"
-            )
-
-        #
-        # Group historical states by hour block
-        #
+        # Backfills, file imports and gap filling write this statistic too
+        lock = get_statistic_lock(self.hass, self.statistic_id)
+        if lock.locked():
+            _LOGGER.debug(f"{self.statistic_id}: waiting for another import to finish")
 
-        def hour_block_for_hist_state(hist_state: HistoricalState) -> datetime:
-            # XX:00:00 states belongs to previous hour block
-            if hist_state.dt.minute == 0 and hist_state.dt.second == 0:
-                dt = hist_state.dt - timedelta(hours=1)
-                return dt.replace(minute=0, second=0, microsecond=0)
-
-            else:
-                return hist_state.dt.replace(minute=0, second=0, microsecond=0)
-
-        #
-        # Ignore supplied 'lastest' and fetch again from recorder
-        # FIXME: integrate into homeassistant_historical_sensor and remove
-        #
+        async with lock:
+            return await self._async_import_statistic_data(hist_states)
 
+    async def _async_import_statistic_data(
+        self, hist_states: list[HistoricalState]
+    ) -> list[HistoricalState]:
         def get_last_statistics():
             ret = statistics.get_last_statistics(
                 self.hass,
@@ -206,30 +321,74 @@ class StatisticsMixin(HistoricalSensor):
         )
 
         #
-        # Calculate statistic data
+        # Stream states newer than the latest statistic, filtering out invalid ones
         #
 
-        ret = []
+        cutoff = (
+            dt_util.utc_from_timestamp(latest["start"]) + timedelta(hours=1)
+            if latest
+            else None
+        )
+        n_invalid = 0
 
-        for dt, collection_it in itertools.groupby(
-            hist_states, key=hour_block_for_hist_state
-        ):
-            collection = list(collection_it)
+        def valid_hist_states() -> Iterator[HistoricalState]:
+            nonlocal n_invalid
 
-            # hour_mean = statistics.mean([x.state for x in collection])
-            hour_accumulated = sum([x.state for x in collection])
-            total_accumulated = total_accumulated + hour_accumulated
+            for hist_state in hist_states:
+                if cutoff is not None and hist_state.dt <= cutoff:
+                    continue
 
-            ret.append(
-                StatisticData(
-                    start=dt,
-                    state=hour_accumulated,
-                    # mean=hour_mean,
-                    sum=total_accumulated,
-                )
+                if hist_state.state in (0, None):
+                    n_invalid = n_invalid + 1
+                    continue
+
+                yield hist_state
+
+        # Continues from the latest statistic too, counting statistics per month
+        # for sum checkpoints
+        importer = StatisticsImporter(self.hass, self.get_statistic_metadata())
+        await importer.async_start(cutoff or hist_states[0].dt)
+        await importer.async_add(valid_hist_states())
+
+        # States come in whole hours, the last block is complete
+        await importer.async_flush(close=True)
+
+        # Imports waiting for the lock continue from these statistics
+        await recorder.get_instance(self.hass).async_block_till_done()
+
+        if n_invalid:
+            _LOGGER.warning(
+                f"{self.statistic_id}: "
+                + "found some weird values in historical statistics"
             )
 
-        return ret
+        _LOGGER.debug(
+            f"{self.statistic_id}: {importer.n_imported} statistics queued for import"
+        )
+
+        return hist_states
+
+
+class MeanStatisticsMixin(HistoricalSensor):
+    """Hourly mean, min and max statistics, written only in statistics-only mode"""
+
+    @property
+    def statistic_id(self):
+        return self.entity_id if getattr(self, "_statistics_only", False) else None
+
+    def get_statistic_metadata(self) -> StatisticMetaData:
+        return super().get_statistic_metadata() | {"has_mean": True}
+
+    @profiled("sensor.calculate_statistic_data")
+    async def async_calculate_statistic_data(
+        self, hist_states: list[HistoricalState], *, latest: dict | None
+    ) -> list[StatisticData]:
+        return await async_convert(
+            self.hass,
+            len(hist_states),
+            mean_statistic_data_from_hist_states,
+            hist_states,
+        )
 
 
 class AccumulatedConsumption(RestoreEntity, IDeEntity, SensorEntity):
@@ -331,12 +490,13 @@ class HistoricalConsumption(
         # self._attr_state_class = SensorStateClass.TOTAL
 
     @property
-    def historical_states(self):
-        ret = historical_states_from_historical_api_data(
-            self.coordinator.data[DATA_ATTR_HISTORICAL_CONSUMPTION]["historical"]
-        )
+    def historical_data(self) -> HistoricalSeries | None:
+        return self.coordinator.data[DATA_ATTR_HISTORICAL_CONSUMPTION]["historical"]
 
-        return ret
+    def historical_states_from_data(
+        self, data: HistoricalSeries | None, zone: ZoneInfo
+    ) -> list[HistoricalState]:
+        return historical_states_from_historical_api_data(data, zone=zone)
 
 
 class HistoricalGeneration(
@@ -367,15 +527,18 @@ class HistoricalGeneration(
         # self._attr_state_class = SensorStateClass.TOTAL
 
     @property
-    def historical_states(self):
-        ret = historical_states_from_historical_api_data(
-            self.coordinator.data[DATA_ATTR_HISTORICAL_GENERATION]["historical"]
-        )
+    def historical_data(self) -> HistoricalSeries | None:
+        return self.coordinator.data[DATA_ATTR_HISTORICAL_GENERATION]["historical"]
 
-        return ret
+    def historical_states_from_data(
+        self, data: HistoricalSeries | None, zone: ZoneInfo
+    ) -> list[HistoricalState]:
+        return historical_states_from_historical_api_data(data, zone=zone)
 
 
-class HistoricalPowerDemand(HistoricalSensorMixin, IDeEntity, SensorEntity):
+class HistoricalPowerDemand(
+    MeanStatisticsMixin, HistoricalSensorMixin, IDeEntity, SensorEntity
+):
     I_DE_PLATFORM = PLATFORM
     I_DE_ENTITY_NAME = "Historical Power Demand"
     I_DE_DATA_SETS = [DataSetType.HISTORICAL_POWER_DEMAND]
@@ -388,24 +551,64 @@ class HistoricalPowerDemand(HistoricalSensorMixin, IDeEntity, SensorEntity):
         self._attr_state = None
 
     @property
-    def historical_states(self):
-        def _convert_item(item):
-            # [
-            #     {
-            #         "dt": datetime.datetime(2021, 4, 24, 13, 0),
-            #         "value": 3012.0
-            #     },
-            #     ...
-            # ]
-            return HistoricalState(
-                state=item["value"] / 1000,
-                dt=item["dt"].replace(tzinfo=MAINLAND_SPAIN_ZONEINFO),
-            )
+    def historical_data(self) -> list[dict] | None:
+        return self.coordinator.data[DATA_ATTR_HISTORICAL_POWER_DEMAND]
 
-        data = self.coordinator.data[DATA_ATTR_HISTORICAL_POWER_DEMAND]
-        ret = [_convert_item(item) for item in data]
+    def historical_states_from_data(
+        self, data: list[dict] | None, zone: ZoneInfo
+    ) -> list[HistoricalState]:
+        return historical_states_from_power_demand_data(data, zone=zone)
 
-        return ret
+
+class FetchMetricsSensor(IDeEntity, SensorEntity):
+    """Diagnostic sensor with fetch metrics of a dataset
+
+    State is the percentage of successful attempts since startup, counters and
+    latency percentiles are exposed as attributes.
+    """
+
+    I_DE_PLATFORM = PLATFORM
+    # Metrics are read from the coordinator, no data set is requested
+    I_DE_DATA_SETS = []  # type: ignore[var-annotated]
+    I_DE_METRICS_DATA_SET: DataSetType
+
+    _unrecorded_attributes = frozenset({ATTR_LATENCY_HISTOGRAM})
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self._attr_entity_registry_enabled_default = False
+        self._attr_native_unit_of_measurement = PERCENTAGE
+        self._attr_state_class = SensorStateClass.MEASUREMENT
+
+    @property
+    def native_value(self):
+        rate = self.coordinator.metrics[self.I_DE_METRICS_DATA_SET].success_rate
+        return round(rate * 100, 1) if rate is not None else None
+
+    @property
+    def extra_state_attributes(self):
+        return self.coordinator.metrics[self.I_DE_METRICS_DATA_SET].dump()
+
+
+class MeasureFetchMetrics(FetchMetricsSensor):
+    I_DE_ENTITY_NAME = "Measure Fetch Success Rate"
+    I_DE_METRICS_DATA_SET = DataSetType.MEASURE
+
+
+class HistoricalConsumptionFetchMetrics(FetchMetricsSensor):
+    I_DE_ENTITY_NAME = "Historical Consumption Fetch Success Rate"
+    I_DE_METRICS_DATA_SET = DataSetType.HISTORICAL_CONSUMPTION
+
+
+class HistoricalGenerationFetchMetrics(FetchMetricsSensor):
+    I_DE_ENTITY_NAME = "Historical Generation Fetch Success Rate"
+    I_DE_METRICS_DATA_SET = DataSetType.HISTORICAL_GENERATION
+
+
+class HistoricalPowerDemandFetchMetrics(FetchMetricsSensor):
+    I_DE_ENTITY_NAME = "Historical Power Demand Fetch Success Rate"
+    I_DE_METRICS_DATA_SET = DataSetType.HISTORICAL_POWER_DEMAND
 
 
 async def async_setup_entry(
@@ -415,6 +618,7 @@ async def async_setup_entry(
     discovery_info: DiscoveryInfoType | None = None,  # noqa DiscoveryInfoType | None
 ):
     coordinator, device_info = hass.data[DOMAIN][config_entry.entry_id]
+    statistics_only = config_entry.options.get(CONF_STATISTICS_ONLY, False)
 
     sensors = [
         AccumulatedConsumption(
@@ -424,33 +628,109 @@ async def async_setup_entry(
             config_entry=config_entry, device_info=device_info, coordinator=coordinator
         ),
         HistoricalConsumption(
-            config_entry=config_entry, device_info=device_info, coordinator=coordinator
+            config_entry=config_entry,
+            device_info=device_info,
+            coordinator=coordinator,
+            statistics_only=statistics_only,
         ),
         HistoricalGeneration(
-            config_entry=config_entry, device_info=device_info, coordinator=coordinator
+            config_entry=config_entry,
+            device_info=device_info,
+            coordinator=coordinator,
+            statistics_only=statistics_only,
         ),
         HistoricalPowerDemand(
-            config_entry=config_entry, device_info=device_info, coordinator=coordinator
+            config_entry=config_entry,
+            device_info=device_info,
+            coordinator=coordinator,
+            statistics_only=statistics_only,
         ),
     ]
+    sensors.extend(
+        cls(config_entry=config_entry, device_info=device_info, coordinator=coordinator)
+        for cls in (
+            MeasureFetchMetrics,
+            HistoricalConsumptionFetchMetrics,
+            HistoricalGenerationFetchMetrics,
+            HistoricalPowerDemandFetchMetrics,
+        )
+    )
     async_add_devices(sensors)
 
 
+@profiled("sensor.historical_states")
 def historical_states_from_historical_api_data(
-    data: list[dict] | None = None,
+    series: HistoricalSeries | None = None,
+    zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO,
 ) -> list[HistoricalState]:
-    def _convert_item(item):
-        # FIXME: What about canary islands?
-        dt = item["end"].replace(tzinfo=MAINLAND_SPAIN_ZONEINFO)
-        last_reset = item["start"].replace(tzinfo=MAINLAND_SPAIN_ZONEINFO)
+    if series is None:
+        return []
+
+    # Series can be hourly or quarter-hourly, states are aggregated into hourly
+    # statistics by hour_block_for_hist_state
+    return [
+        HistoricalState(
+            state=value / 1000,
+            dt=end,
+            attributes={"last_reset": start},
+        )
+        for start, end, value in series.utc_items(zone)
+    ]
+
 
+@profiled("sensor.historical_states")
+def historical_states_from_power_demand_data(
+    data: list[dict] | None = None,
+    zone: ZoneInfo = MAINLAND_SPAIN_ZONEINFO,
+) -> list[HistoricalState]:
+    def _convert_item(item, ts):
+        # [
+        #     {
+        #         "dt": datetime.datetime(2021, 4, 24, 13, 0),
+        #         "value": 3012.0
+        #     },
+        #     ...
+        # ]
         return HistoricalState(
             state=item["value"] / 1000,
-            dt=dt,
-            attributes={"last_reset": last_reset},
+            dt=datetime.fromtimestamp(ts, timezone.utc),
+        )
+
+    if not data:
+        return []
+
+    data = sorted(data, key=lambda x: x["dt"])
+    table = TransitionTable(zone, data[0]["dt"], data[-1]["dt"])
+
+    return [
+        _convert_item(item, ts)
+        for item, ts in zip(data, table.to_timestamps(x["dt"] for x in data))
+        if ts is not None
+    ]
+
+
+def mean_statistic_data_from_hist_states(
+    hist_states: list[HistoricalState],
+) -> list[StatisticData]:
+    """Hourly mean, min and max statistics"""
+    ret = []
+    for dt, collection_it in itertools.groupby(
+        hist_states, key=hour_block_for_hist_state
+    ):
+        values = [x.state for x in collection_it if x.state is not None]
+        if not values:
+            continue
+
+        ret.append(
+            StatisticData(
+                start=dt,
+                mean=sum(values) / len(values),
+                min=min(values),
+                max=max(values),
+            )
         )
 
-    return [_convert_item(item) for item in data or []]
+    return ret
 
 
 async def async_get_last_state_safe(
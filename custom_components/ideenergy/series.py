@@ -0,0 +1,140 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import math
+from array import array
+from collections.abc import Iterator
+from datetime import date, datetime, time, timedelta
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from .tzconv import TransitionTable
+
+HOURLY = timedelta(hours=1)
+QUARTER_HOURLY = timedelta(minutes=15)
+
+
+class HistoricalSeries:
+    """Evenly spaced historical readings
+
+    Values are stored in an array of doubles, NaN marks missing readings, so memory
+    usage is a few bytes per reading whatever the resolution is. Times are naive local
+    times, as i-DE returns them.
+    """
+
+    __slots__ = ("start", "step", "values")
+
+    def __init__(
+        self, start: datetime, step: timedelta, values: array | None = None
+    ) -> None:
+        self.start = start
+        self.step = step
+        self.values = values if values is not None else array("d")
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __repr__(self) -> str:
+        return (
+            f"<HistoricalSeries start={self.start}, step={self.step}, "
+            f"len={len(self)}>"
+        )
+
+    @property
+    def end(self) -> datetime:
+        return self.start + self.step * len(self.values)
+
+    def utc_start(self, zone: ZoneInfo) -> datetime:
+        return TransitionTable(zone, self.start, self.start).to_utc(self.start)
+
+    def utc_items(self, zone: ZoneInfo) -> Iterator[tuple[datetime, datetime, float]]:
+        """Yields (start, end, value) for each present reading, in UTC
+
+        i-DE numbers readings sequentially from the local start (DST days have 23 or
+        25 hours), they are evenly spaced in absolute time, not in wall time.
+        """
+        start = self.utc_start(zone)
+        for idx, value in enumerate(self.values):
+            if math.isnan(value):
+                continue
+
+            item_start = start + self.step * idx
+            yield item_start, item_start + self.step, value
+
+    def latest_day(self, zone: ZoneInfo) -> date | None:
+        """Local day of the latest present reading"""
+        for idx in range(len(self.values) - 1, -1, -1):
+            if not math.isnan(self.values[idx]):
+                dt = self.utc_start(zone) + self.step * idx
+                return dt.astimezone(zone).date()
+
+        return None
+
+    def between(self, start: date, end: date, zone: ZoneInfo) -> "HistoricalSeries":
+        """Readings starting in local days [start, end)"""
+        start_dt = datetime.combine(start, time())
+        end_dt = datetime.combine(end, time())
+
+        table = TransitionTable(zone, min(self.start, start_dt), max(self.end, end_dt))
+        origin = table.to_timestamp(self.start)
+        step = self.step.total_seconds()
+
+        first = max(0, math.ceil((table.to_timestamp(start_dt) - origin) / step))
+        last = max(first, math.ceil((table.to_timestamp(end_dt) - origin) / step))
+
+        return HistoricalSeries(
+            start_dt if first else self.start, self.step, self.values[first:last]
+        )
+
+
+def detect_step(n_readings: int, base: datetime, end: datetime) -> timedelta:
+    """Guess series resolution from the number of readings in [base, end)
+
+    Hourly series can't have more readings than hours in the range (plus one for
+    DST), anything above that is quarter-hourly.
+    """
+    hours = math.ceil((end - base) / HOURLY) + 1
+    return QUARTER_HOURLY if n_readings > hours else HOURLY
+
+
+def series_from_api_data(
+    historical: list[dict[str, Any]],
+    base: datetime,
+    end: datetime,
+    step: timedelta | None = None,
+) -> HistoricalSeries:
+    """Build a series from historical data parsed by ideenergy.Client
+
+    ideenergy.Client stamps the nth reading as base + n hours whatever the actual
+    resolution is. Reading positions are recovered from that and restamped using
+    step, or the detected one if not given.
+    """
+    base = datetime(base.year, base.month, base.day)
+
+    positions = [(round((x["start"] - base) / HOURLY), x["value"]) for x in historical]
+    n_readings = max((idx for idx, _ in positions), default=-1) + 1
+
+    if step is None:
+        step = detect_step(n_readings, base, end)
+
+    values = array("d", [math.nan]) * n_readings
+    for idx, value in positions:
+        if value is not None:
+            values[idx] = value
+
+    return HistoricalSeries(base, step, values)
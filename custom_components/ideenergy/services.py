@@ -0,0 +1,189 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from datetime import date
+
+import voluptuous as vol
+from homeassistant.core import HomeAssistant, ServiceCall, dt_util
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv
+
+from .backfill import BackfillCheckpoints, async_backfill, find_statistics_sensor
+from .const import DOMAIN, SERVICE_BACKFILL, SERVICE_IMPORT_FILE, SERVICE_PROFILE
+from .datacoordinator import DataSetType, IDeCoordinator
+from .fileimport import FileImportError, async_import_file, resolve_import_path
+from .profiling import async_profile, start_profiling
+
+_LOGGER = logging.getLogger(__name__)
+
+
+ATTR_CYCLES = "cycles"
+ATTR_DATASET = "dataset"
+ATTR_DURATION = "duration"
+ATTR_END = "end"
+ATTR_ENTRY_ID = "entry_id"
+ATTR_FILENAME = "filename"
+ATTR_START = "start"
+ATTR_VALUE_COLUMN = "value_column"
+
+STATISTICS_DATASETS = {
+    "consumption": DataSetType.HISTORICAL_CONSUMPTION,
+    "generation": DataSetType.HISTORICAL_GENERATION,
+}
+
+BACKFILL_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ENTRY_ID): cv.string,
+        vol.Required(ATTR_DATASET): vol.In(list(STATISTICS_DATASETS)),
+        vol.Required(ATTR_START): cv.date,
+        vol.Optional(ATTR_END): cv.date,
+    }
+)
+
+IMPORT_FILE_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_ENTRY_ID): cv.string,
+        vol.Required(ATTR_DATASET): vol.In(list(STATISTICS_DATASETS)),
+        vol.Required(ATTR_FILENAME): cv.string,
+        vol.Optional(ATTR_VALUE_COLUMN): cv.string,
+    }
+)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DURATION, default=300): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=3600)
+        ),
+        vol.Optional(ATTR_CYCLES): vol.All(vol.Coerce(int), vol.Range(min=1)),
+    }
+)
+
+
+def get_coordinator(hass: HomeAssistant, entry_id: str) -> IDeCoordinator:
+    try:
+        coordinator, _ = hass.data[DOMAIN][entry_id]
+    except (KeyError, TypeError, ValueError) as e:
+        raise HomeAssistantError(f"{entry_id} is not a loaded {DOMAIN} entry") from e
+
+    return coordinator
+
+
+def get_statistics_sensor(coordinator: IDeCoordinator, dataset_name: str):
+    sensor = find_statistics_sensor(coordinator, STATISTICS_DATASETS[dataset_name])
+    if sensor is None:
+        raise HomeAssistantError(f"{dataset_name} sensor is not enabled")
+
+    return sensor
+
+
+async def async_setup_services(hass: HomeAssistant) -> None:
+    checkpoints = BackfillCheckpoints(hass)
+    running: set[tuple[str, DataSetType]] = set()
+
+    async def async_handle_backfill(call: ServiceCall) -> None:
+        entry_id = call.data[ATTR_ENTRY_ID]
+        dataset = STATISTICS_DATASETS[call.data[ATTR_DATASET]]
+        start: date = call.data[ATTR_START]
+        coordinator = get_coordinator(hass, entry_id)
+        end: date = call.data.get(ATTR_END) or dt_util.now(coordinator.zoneinfo).date()
+
+        if start >= end:
+            raise HomeAssistantError(f"start ({start}) must be before end ({end})")
+
+        sensor = get_statistics_sensor(coordinator, call.data[ATTR_DATASET])
+
+        key = (entry_id, dataset)
+        if key in running:
+            raise HomeAssistantError(
+                f"a {call.data[ATTR_DATASET]} backfill is already running "
+                f"for {entry_id}"
+            )
+
+        async def _async_run() -> None:
+            try:
+                await async_backfill(
+                    hass,
+                    coordinator,
+                    checkpoints,
+                    entry_id,
+                    dataset,
+                    sensor.get_statistic_metadata(),
+                    start,
+                    end,
+                )
+            finally:
+                running.discard(key)
+
+        running.add(key)
+        hass.async_create_background_task(
+            _async_run(), name=f"{DOMAIN} backfill {entry_id} {dataset.name}"
+        )
+
+    async def async_handle_import_file(call: ServiceCall) -> None:
+        coordinator = get_coordinator(hass, call.data[ATTR_ENTRY_ID])
+        sensor = get_statistics_sensor(coordinator, call.data[ATTR_DATASET])
+
+        try:
+            path = resolve_import_path(hass, call.data[ATTR_FILENAME])
+        except FileImportError as e:
+            raise HomeAssistantError(str(e)) from e
+
+        if not await hass.async_add_executor_job(path.is_file):
+            raise HomeAssistantError(f"{path} doesn't exist")
+
+        async def _async_run() -> None:
+            try:
+                await async_import_file(
+                    hass,
+                    path,
+                    sensor.get_statistic_metadata(),
+                    value_column=call.data.get(ATTR_VALUE_COLUMN),
+                    zone=coordinator.zoneinfo,
+                )
+            except (FileImportError, OSError) as e:
+                _LOGGER.error(f"Unable to import {path}: {e}")
+
+        hass.async_create_background_task(
+            _async_run(), name=f"{DOMAIN} import {path.name}"
+        )
+
+    async def async_handle_profile(call: ServiceCall) -> None:
+        # Claimed here, before the task runs, so a second call is rejected
+        try:
+            session = start_profiling(cycles=call.data.get(ATTR_CYCLES))
+        except RuntimeError as e:
+            raise HomeAssistantError(str(e)) from e
+
+        hass.async_create_background_task(
+            async_profile(hass, session, call.data[ATTR_DURATION]),
+            name=f"{DOMAIN} profile",
+        )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_BACKFILL, async_handle_backfill, schema=BACKFILL_SCHEMA
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_IMPORT_FILE,
+        async_handle_import_file,
+        schema=IMPORT_FILE_SCHEMA,
+    )
+    hass.services.async_register(
+        DOMAIN, SERVICE_PROFILE, async_handle_profile, schema=PROFILE_SCHEMA
+    )
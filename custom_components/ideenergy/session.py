@@ -0,0 +1,94 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from homeassistant.core import dt_util
+
+from .barrier import check_tzinfo
+
+_LOGGER = logging.getLogger(__name__)
+
+
+ATTR_EXPIRES_AT = "expires_at"
+ATTR_RENEW_MARGIN = "renew_margin"
+ATTR_TIMEOUT = "timeout"
+
+
+class UserSessionManager:
+    """Keeps track of the i-DE user session of an ideenergy.Client
+
+    ideenergy.Client logs in lazily, on the first call made after its session has
+    expired. The MEASURE dataset is fetched about once an hour, way beyond the session
+    timeout, so every measure call would pay for a full login inside the update
+    window. This class allows to renew the session in advance.
+    """
+
+    def __init__(self, api, renew_margin: timedelta = timedelta(seconds=0)):
+        self._api = api
+        self._renew_margin = renew_margin
+
+    def utcnow(self) -> datetime:
+        return dt_util.utcnow()
+
+    @property
+    def timeout(self) -> timedelta:
+        return self._api.user_session_timeout
+
+    @property
+    def expires_at(self) -> datetime | None:
+        # ideenergy.Client stores login time as a naive datetime in local time
+        login_ts = getattr(self._api, "_login_ts", None)
+        if login_ts is None:
+            return None
+
+        return login_ts.astimezone(timezone.utc) + self.timeout
+
+    @check_tzinfo("now", optional=True)
+    def is_warm(self, now: datetime | None = None) -> bool:
+        now = now or self.utcnow()
+
+        expires_at = self.expires_at
+        if expires_at is None:
+            return False
+
+        return now + self._renew_margin < expires_at
+
+    @check_tzinfo("now", optional=True)
+    async def async_warmup(self, now: datetime | None = None) -> bool:
+        """Login if the session is expired or about to expire
+
+        Returns True if a new login was made
+        """
+        if self.is_warm(now=now):
+            _LOGGER.debug(f"session is still warm (expires at {self.expires_at})")
+            return False
+
+        await self._api.login()
+        _LOGGER.debug(f"session renewed (expires at {self.expires_at})")
+
+        return True
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            ATTR_TIMEOUT: self.timeout,
+            ATTR_RENEW_MARGIN: self._renew_margin,
+            ATTR_EXPIRES_AT: self.expires_at,
+        }
@@ -0,0 +1,93 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import logging
+from typing import Any
+
+import ideenergy
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StartupQueue:
+    """Queues the API calls config entries make while being set up
+
+    When Home Assistant starts every entry is set up at once, and each one would
+    login and fetch its contract details at the same time: a burst of logins for
+    the same account, the pattern most likely to get it banned by i-DE.
+
+    Calls of entries of the same account are serialized, and only the first one
+    logs in. The user session lives in the cookie jar of the aiohttp session, so
+    following clients sharing it only need to select their contract. Calls from
+    different accounts run in parallel, up to max_concurrent at a time.
+    """
+
+    def __init__(self, max_concurrent: int):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._locks: dict[str, asyncio.Lock] = {}
+
+        # Latest client logged in for each account
+        self._logged: dict[str, ideenergy.Client] = {}
+
+    async def async_get_contract_details(self, api: ideenergy.Client) -> dict[str, Any]:
+        lock = self._locks.setdefault(api.username, asyncio.Lock())
+
+        # Account lock first, waiting entries don't hold a slot
+        async with lock, self._semaphore:
+            if not api.is_logged:
+                await self._async_share_login(api)
+
+            details = await api.get_contract_details()
+            self._logged[api.username] = api
+
+            return details
+
+    async def _async_share_login(self, api: ideenergy.Client) -> None:
+        owner = self._logged.get(api.username)
+        if owner is None or not owner.is_logged or owner.password != api.password:
+            return
+
+        if await _async_reuse_login(api, owner):
+            _LOGGER.debug(f"{api}: reusing session from {owner}")
+
+
+# ideenergy.Client has no public API to share a user session between clients.
+# Every access to its private attributes is kept here, check them when upgrading
+# ideenergy.
+async def _async_reuse_login(api: ideenergy.Client, owner: ideenergy.Client) -> bool:
+    """Mark api as logged in with the session of owner and select its contract
+
+    Returns False (and api is left logged out) if they don't share the cookie jar
+    the session lives in, or i-DE doesn't accept the session anymore.
+    """
+    if owner._sess is not api._sess:
+        return False
+
+    # ideenergy.Client considers itself logged in from _login_ts on
+    api._login_ts = owner._login_ts
+    try:
+        await api.select_contract(api._contract)
+
+    except ideenergy.client.ClientError as e:
+        # Session gone server side, get_contract_details will login again
+        _LOGGER.debug(f"{api}: unable to reuse session from {owner}: {e}")
+        api._login_ts = None
+        return False
+
+    return True
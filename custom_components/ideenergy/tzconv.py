@@ -0,0 +1,179 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import bisect
+import logging
+import math
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from .const import TIMEZONE_AUTO
+
+_LOGGER = logging.getLogger(__name__)
+
+
+MAINLAND_SPAIN_ZONEINFO = ZoneInfo("Europe/Madrid")
+CANARY_ISLANDS_ZONEINFO = ZoneInfo("Atlantic/Canary")
+
+# Las Palmas and Santa Cruz de Tenerife
+CANARY_ISLANDS_PROVINCES = {"35", "38"}
+
+_EPOCH = datetime(1970, 1, 1)
+_DAY = 24 * 60 * 60
+
+
+class NonExistentTimeError(ValueError):
+    pass
+
+
+def zoneinfo_for_contract(
+    contract_details: dict[str, Any], override: str | None = None
+) -> ZoneInfo:
+    """Zone for timestamps of a contract
+
+    override (an IANA zone name) takes precedence, otherwise it's guessed from the
+    contract province.
+    """
+    if override and override != TIMEZONE_AUTO:
+        return ZoneInfo(override)
+
+    province = str(contract_details.get("codProvincia") or "").strip()
+    if province in CANARY_ISLANDS_PROVINCES:
+        return CANARY_ISLANDS_ZONEINFO
+
+    return MAINLAND_SPAIN_ZONEINFO
+
+
+def _wall_seconds(dt: datetime) -> float:
+    # Naive datetime as seconds since epoch, as if it were UTC
+    return (dt - _EPOCH).total_seconds()
+
+
+class TransitionTable:
+    """UTC offsets of a zone over a span, for fast naive local → UTC conversion
+
+    The table holds one segment per UTC offset in the span. A naive local time is
+    converted by looking up the segment containing its wall time:
+
+    - Wall times in two segments are repeated (DST end). fold selects the
+      occurrence like in datetime: 0 for the first one, 1 for the second one.
+    - Wall times in no segment don't exist (DST start), NonExistentTimeError is
+      raised.
+    """
+
+    def __init__(self, zone: ZoneInfo, start: datetime, end: datetime):
+        self.zone = zone
+
+        # Segments as parallel lists: UTC start, offset and wall time span
+        self._utc_starts: list[float] = []
+        self._offsets: list[float] = []
+
+        start_ts = math.floor(_wall_seconds(start)) - _DAY
+        end_ts = _wall_seconds(end) + _DAY
+
+        offset = self._offset_at(start_ts)
+        self._utc_starts.append(start_ts)
+        self._offsets.append(offset)
+
+        # Transitions are months apart, scan daily and bisect to the second (start
+        # can be at any time, transitions aren't a whole number of hours from it)
+        ts = start_ts
+        while ts < end_ts:
+            next_ts = ts + _DAY
+            next_offset = self._offset_at(next_ts)
+            if next_offset != offset:
+                lo, hi = ts, next_ts
+                while hi - lo > 1:
+                    mid = (lo + hi) // 2
+                    if self._offset_at(mid) == offset:
+                        lo = mid
+                    else:
+                        hi = mid
+
+                self._utc_starts.append(hi)
+                self._offsets.append(next_offset)
+                offset = next_offset
+
+            ts = next_ts
+
+        self._wall_starts = [u + o for u, o in zip(self._utc_starts, self._offsets)]
+        self._wall_ends = [
+            u + o for u, o in zip(self._utc_starts[1:], self._offsets)
+        ] + [float("inf")]
+
+    def _offset_at(self, utc_ts: float) -> float:
+        dt = datetime.fromtimestamp(utc_ts, timezone.utc).astimezone(self.zone)
+        return dt.utcoffset().total_seconds()  # type: ignore[union-attr]
+
+    @property
+    def transitions(self) -> list[tuple[datetime, timedelta]]:
+        """(UTC instant, new offset) for each transition in the table"""
+        return [
+            (datetime.fromtimestamp(u, timezone.utc), timedelta(seconds=o))
+            for u, o in zip(self._utc_starts[1:], self._offsets[1:])
+        ]
+
+    def candidates(self, naive: datetime) -> list[float]:
+        """All possible timestamps for a naive local time, in chronological order"""
+        wall = _wall_seconds(naive)
+
+        idx = bisect.bisect_right(self._wall_starts, wall) - 1
+        if idx < 0:
+            raise ValueError(f"{naive} is before the table span")
+
+        ret = []
+        if idx > 0 and wall < self._wall_ends[idx - 1]:
+            ret.append(wall - self._offsets[idx - 1])
+        if wall < self._wall_ends[idx]:
+            ret.append(wall - self._offsets[idx])
+
+        return ret
+
+    def to_timestamp(self, naive: datetime, fold: int = 0) -> float:
+        candidates = self.candidates(naive)
+        if not candidates:
+            raise NonExistentTimeError(f"{naive} doesn't exist in {self.zone}")
+
+        return candidates[min(fold, len(candidates) - 1)]
+
+    def to_utc(self, naive: datetime, fold: int = 0) -> datetime:
+        return datetime.fromtimestamp(self.to_timestamp(naive, fold), timezone.utc)
+
+    def to_timestamps(self, naives: Iterable[datetime]) -> Iterator[float | None]:
+        """Convert chronologically sorted naive local times
+
+        Repeated wall times are resolved using the order: the second time a wall time
+        is seen (or an earlier one) it's taken as the second occurrence. Non-existent
+        times yield None.
+        """
+        prev: float | None = None
+        for naive in naives:
+            candidates = self.candidates(naive)
+            if not candidates:
+                _LOGGER.debug(f"{naive} doesn't exist in {self.zone}, skipping")
+                yield None
+                continue
+
+            ts = candidates[0]
+            if len(candidates) > 1 and prev is not None and ts <= prev:
+                ts = candidates[1]
+
+            prev = ts
+            yield ts
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""Benchmark IDeCoordinator against the fake i-DE server
+
+For 1, 10 and 100 contracts (one account each) measures:
+
+- refresh latency: wall time of a full refresh of every dataset, all contracts
+  refreshing at once
+- API calls per hour: requests received by the server while simulating some hours
+  of regular updates, time is driven through the `now` argument of the coordinator
+- statistics throughput: historical readings converted and aggregated into hourly
+  statistics per second (recorder writes excluded)
+
+Run from the repository root with Home Assistant installed:
+
+    python scripts/benchmark_coordinator.py --contracts 1 10 100 --latency 0.05
+"""
+
+
+import argparse
+import asyncio
+import contextlib
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import aiohttp
+import ideenergy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fakeide import FakeIDeServer, FakeIDeSession  # noqa: E402
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from custom_components.ideenergy import (  # noqa: E402
+    _build_barriers,
+    _calculate_datacoordinator_update_interval,
+)
+from custom_components.ideenergy.const import (  # noqa: E402
+    DATA_ATTR_HISTORICAL_CONSUMPTION,
+)
+from custom_components.ideenergy.datacoordinator import (  # noqa: E402
+    DataSetType,
+    IDeCoordinator,
+)
+from custom_components.ideenergy.importer import StatisticsImporter  # noqa: E402
+from custom_components.ideenergy.sensor import (  # noqa: E402
+    historical_states_from_historical_api_data,
+)
+from custom_components.ideenergy.tzconv import MAINLAND_SPAIN_ZONEINFO  # noqa: E402
+
+
+class SimulatedClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def utc(self) -> datetime:
+        return self.now
+
+    def local(self) -> datetime:
+        return self.now.astimezone(MAINLAND_SPAIN_ZONEINFO).replace(tzinfo=None)
+
+
+async def make_coordinators(
+    hass: HomeAssistant, stack: contextlib.AsyncExitStack, base_url: str, n: int
+) -> list[IDeCoordinator]:
+    coordinators = []
+    for idx in range(n):
+        # One session (cookie jar) per account
+        session = await stack.enter_async_context(
+            aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+        )
+        api = ideenergy.Client(
+            FakeIDeSession(session, base_url), f"user{idx}", "password"
+        )
+        contracts = await api.get_contracts()
+        api._contract = contracts[0]["codContrato"]
+
+        coordinators.append(
+            IDeCoordinator(
+                hass=hass,
+                api=api,
+                barriers=_build_barriers(),
+                update_interval=_calculate_datacoordinator_update_interval(),
+            )
+        )
+
+    return coordinators
+
+
+async def bench_refresh(
+    coordinators: list[IDeCoordinator], clock: SimulatedClock
+) -> tuple[list[float], float]:
+    async def _refresh(coordinator: IDeCoordinator) -> float:
+        t0 = time.perf_counter()
+        coordinator.data = await coordinator._async_update_data_raw(
+            DataSetType.ALL, now=clock.utc()
+        )
+        return time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    latencies = await asyncio.gather(*[_refresh(x) for x in coordinators])
+    return list(latencies), time.perf_counter() - t0
+
+
+async def bench_calls_per_hour(
+    coordinators: list[IDeCoordinator],
+    server: FakeIDeServer,
+    clock: SimulatedClock,
+    hours: int,
+) -> float:
+    server.reset_stats()
+
+    interval = coordinators[0].update_interval
+    assert interval is not None
+
+    end = clock.now + timedelta(hours=hours)
+    while clock.now < end:
+        await asyncio.gather(
+            *[
+                x._async_update_data_raw(DataSetType.ALL, now=clock.utc())
+                for x in coordinators
+            ]
+        )
+        clock.now = clock.now + interval
+
+    return sum(server.calls.values()) / hours
+
+
+def bench_statistics(coordinators: list[IDeCoordinator]) -> tuple[int, float]:
+    series = [
+        x.data[DATA_ATTR_HISTORICAL_CONSUMPTION]["historical"]
+        for x in coordinators
+        if DATA_ATTR_HISTORICAL_CONSUMPTION in x.data
+    ]
+
+    t0 = time.perf_counter()
+    n = 0
+    for idx, x in enumerate(series):
+        hist_states = historical_states_from_historical_api_data(x)
+        importer = StatisticsImporter(
+            None, {"statistic_id": f"sensor.benchmark_{idx}"}  # type: ignore[arg-type, typeddict-item]
+        )
+        n = n + len(hist_states)
+        for _ in importer._aggregate(hist_states):
+            pass
+
+    return n, time.perf_counter() - t0
+
+
+async def run(args: argparse.Namespace) -> None:
+    clock = SimulatedClock(
+        # Just before the update window, after historical data is published
+        datetime.now(timezone.utc).replace(hour=7, minute=45, second=0, microsecond=0)
+    )
+    server = FakeIDeServer(
+        latency=args.latency,
+        measure_latency=args.measure_latency,
+        error_rate=args.error_rate,
+        ban_threshold=args.ban_threshold,
+        quarter_hour=args.quarter_hour,
+        clock=clock.local,
+        seed=0,
+    )
+
+    print(
+        f"{'contracts':>9} {'refresh p50':>12} {'refresh p95':>12} "
+        f"{'refresh all':>12} {'calls/hour':>11} {'readings/s':>11}"
+    )
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+
+        async with server.run() as base_url:
+            for n in args.contracts:
+                clock.now = clock.now.replace(hour=7, minute=45)
+                server.reset_stats()
+
+                async with contextlib.AsyncExitStack() as stack:
+                    coordinators = await make_coordinators(hass, stack, base_url, n)
+
+                    latencies, total = await bench_refresh(coordinators, clock)
+
+                    calls = await bench_calls_per_hour(
+                        coordinators, server, clock, args.hours
+                    )
+                    readings, elapsed = bench_statistics(coordinators)
+
+                    p95 = (
+                        statistics.quantiles(latencies, n=20)[-1]
+                        if len(latencies) > 1
+                        else latencies[0]
+                    )
+                    print(
+                        f"{n:>9} {statistics.median(latencies):>11.3f}s {p95:>11.3f}s "
+                        f"{total:>11.3f}s {calls:>11.1f} "
+                        f"{readings / elapsed if elapsed else 0:>11.0f}"
+                    )
+
+        await hass.async_stop(force=True)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--contracts", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--hours", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--measure-latency", type=float)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ban-threshold", type=int)
+    parser.add_argument("--quarter-hour", action="store_true")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
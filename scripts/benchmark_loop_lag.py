@@ -0,0 +1,173 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""Measure event loop lag while importing a year of quarter-hourly readings
+
+A ticker task sleeps for a short interval in a loop and records how late it wakes
+up while the import runs on the same loop. The import goes through the sensor
+conversions and StatisticsImporter aggregation (recorder writes excluded), once
+running everything inline like before conversions were offloaded and once through
+offload.async_convert / async_chunked.
+
+Run from the repository root with Home Assistant installed:
+
+    python scripts/benchmark_loop_lag.py --years 1 --max-lag 0.1
+"""
+
+
+import argparse
+import asyncio
+import math
+import random
+import statistics
+import sys
+import tempfile
+import time
+from array import array
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from homeassistant.core import HomeAssistant  # noqa: E402
+
+from custom_components.ideenergy.importer import StatisticsImporter  # noqa: E402
+from custom_components.ideenergy.offload import async_convert  # noqa: E402
+from custom_components.ideenergy.sensor import (  # noqa: E402
+    historical_states_from_historical_api_data,
+)
+from custom_components.ideenergy.series import HistoricalSeries  # noqa: E402
+from custom_components.ideenergy.tzconv import MAINLAND_SPAIN_ZONEINFO  # noqa: E402
+
+TICK = 0.005
+
+
+class DiscardingImporter(StatisticsImporter):
+    # Statistics are counted, not written: there is no recorder here
+    async def async_flush(self, close: bool = False) -> None:
+        if close and self._pending_start is not None:
+            self._buffer.append(self._close_pending())
+
+        self._n_imported = self._n_imported + len(self._buffer)
+        self._buffer = []
+
+
+def make_series(years: int) -> HistoricalSeries:
+    n = 365 * years * 24 * 4
+    return HistoricalSeries(
+        datetime(2022, 1, 1),
+        timedelta(minutes=15),
+        array("d", (random.uniform(0, 750) for _ in range(n))),
+    )
+
+
+async def import_inline(hass: HomeAssistant, series: HistoricalSeries) -> int:
+    hist_states = historical_states_from_historical_api_data(
+        series, zone=MAINLAND_SPAIN_ZONEINFO
+    )
+    importer = DiscardingImporter(hass, {"statistic_id": "sensor.benchmark"})  # type: ignore[typeddict-item]
+    for statistic in importer._aggregate(hist_states):
+        importer._buffer.append(statistic)
+    await importer.async_flush(close=True)
+
+    return importer.n_imported
+
+
+async def import_offloaded(hass: HomeAssistant, series: HistoricalSeries) -> int:
+    hist_states = await async_convert(
+        hass,
+        len(series),
+        historical_states_from_historical_api_data,
+        series,
+        MAINLAND_SPAIN_ZONEINFO,
+    )
+    importer = DiscardingImporter(hass, {"statistic_id": "sensor.benchmark"})  # type: ignore[typeddict-item]
+    await importer.async_add(hist_states)
+    await importer.async_flush(close=True)
+
+    return importer.n_imported
+
+
+async def measure(hass: HomeAssistant, fn, series: HistoricalSeries):
+    lags: list[float] = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - t0 - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+
+    t0 = time.perf_counter()
+    n = await fn(hass, series)
+    elapsed = time.perf_counter() - t0
+
+    stop.set()
+    await task
+
+    return n, elapsed, lags
+
+
+async def run(args) -> bool:
+    series = make_series(args.years)
+    ok = True
+
+    print(
+        f"{len(series)} readings, tick {TICK * 1000:.0f}ms\n"
+        f"{'mode':>10} {'elapsed':>9} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}"
+    )
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+
+        for name, fn in (("inline", import_inline), ("offloaded", import_offloaded)):
+            n, elapsed, lags = await measure(hass, fn, series)
+            p99 = (
+                statistics.quantiles(lags, n=100, method="inclusive")[-1]
+                if len(lags) > 1
+                else lags[0]
+            )
+            print(
+                f"{name:>10} {elapsed:>8.2f}s {statistics.median(lags) * 1000:>7.1f}ms "
+                f"{p99 * 1000:>7.1f}ms {max(lags) * 1000:>7.1f}ms ({n} statistics)"
+            )
+
+            if name == "offloaded" and max(lags) > args.max_lag:
+                ok = False
+
+        await hass.async_stop(force=True)
+
+    if not ok:
+        print(f"max lag over budget ({args.max_lag}s)", file=sys.stderr)
+
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--max-lag", type=float, default=math.inf)
+    args = parser.parse_args()
+
+    return 0 if asyncio.run(run(args)) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""Simulate Home Assistant starting with many config entries
+
+Every entry fetches its contract details at once, as async_setup_entry does on
+startup, against the fake i-DE server. Entries are spread over some accounts with
+several contracts each. Compares:
+
+- concurrent: each entry logs in by itself, all at the same time (previous
+  behaviour)
+- queued: through StartupQueue, one login per account and limited concurrency
+
+and reports startup wall time, entries that got the details of their own contract
+(ok), logins, requests and bans. Concurrent entries of the same account race on the
+contract selected in their shared session, so some of them get the details of
+another contract. Run from the repository root with Home Assistant installed:
+
+    python scripts/benchmark_startup.py --entries 20 --accounts 5 --latency 0.1
+"""
+
+
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+import ideenergy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fakeide import FakeIDeServer, FakeIDeSession  # noqa: E402
+
+from custom_components.ideenergy.const import STARTUP_MAX_CONCURRENT  # noqa: E402
+from custom_components.ideenergy.startup import StartupQueue  # noqa: E402
+
+
+async def make_clients(
+    stack: contextlib.AsyncExitStack,
+    server: FakeIDeServer,
+    base_url: str,
+    entries: int,
+    accounts: int,
+) -> list[ideenergy.Client]:
+    # Like Home Assistant, clients of the same account share a cookie jar
+    sessions = [
+        FakeIDeSession(
+            await stack.enter_async_context(
+                aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+            ),
+            base_url,
+        )
+        for _ in range(accounts)
+    ]
+
+    clients = []
+    for idx in range(entries):
+        username = f"user{idx % accounts}"
+        contracts = server._contracts(username)
+        clients.append(
+            ideenergy.Client(
+                sessions[idx % accounts],
+                username,
+                "password",
+                contract=contracts[idx // accounts]["codContrato"],
+            )
+        )
+
+    return clients
+
+
+async def run_scenario(
+    server: FakeIDeServer,
+    base_url: str,
+    entries: int,
+    accounts: int,
+    queued: bool,
+) -> tuple[float, int]:
+    server.reset_stats()
+    queue = StartupQueue(STARTUP_MAX_CONCURRENT)
+
+    async def _setup(client: ideenergy.Client) -> bool:
+        try:
+            if queued:
+                details = await queue.async_get_contract_details(client)
+            else:
+                details = await client.get_contract_details()
+
+        except ideenergy.client.ClientError:
+            return False
+
+        # Details must belong to the contract of the entry
+        return f"{details.get('codContrato', 0):09.0f}" == client._contract
+
+    async with contextlib.AsyncExitStack() as stack:
+        clients = await make_clients(stack, server, base_url, entries, accounts)
+
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*[_setup(x) for x in clients])
+        elapsed = time.perf_counter() - t0
+
+    return elapsed, sum(results)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--entries", type=int, default=20)
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument(
+        "--ban-threshold",
+        type=int,
+        default=None,
+        help="requests per user and hour before being banned",
+    )
+    args = parser.parse_args()
+
+    contracts_per_user = -(-args.entries // args.accounts)
+
+    print(
+        f"{args.entries} entries, {args.accounts} accounts, "
+        f"{args.latency}s latency, max {STARTUP_MAX_CONCURRENT} accounts at once"
+    )
+    print(f"{'':>12} {'wall (s)':>9} {'ok':>4} {'logins':>7} {'calls':>6} {'bans':>5}")
+
+    for queued in (False, True):
+        # Fresh server for each scenario, bans would carry over
+        server = FakeIDeServer(
+            latency=args.latency,
+            ban_threshold=args.ban_threshold,
+            contracts_per_user=contracts_per_user,
+            seed=0,
+        )
+        async with server.run() as base_url:
+            elapsed, n_ok = await run_scenario(
+                server, base_url, args.entries, args.accounts, queued
+            )
+
+        print(
+            f"{'queued' if queued else 'concurrent':>12} {elapsed:9.2f} "
+            f"{n_ok:4d} {server.logins:7d} {sum(server.calls.values()):6d} "
+            f"{server.bans:5d}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
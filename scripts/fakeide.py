@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""Offline stand-in for the i-DE endpoints used by ideenergy.Client
+
+Serves every endpoint with synthetic but well-formed data, with configurable
+latency, error rate and ban behaviour. Run standalone:
+
+    python scripts/fakeide.py --port 8080 --latency 0.2 --error-rate 0.05
+
+or embed it (see benchmark_coordinator.py):
+
+    server = FakeIDeServer(latency=0.1)
+    async with server.run() as base_url:
+        client = ideenergy.Client(FakeIDeSession(session, base_url), "user", "pass")
+"""
+
+
+import argparse
+import asyncio
+import contextlib
+import random
+import time
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Callable
+from datetime import datetime, timedelta
+from typing import Any
+
+import aiohttp
+from aiohttp import web
+
+IDE_BASE_URL = "https://www.i-de.es"
+REST_PATH = "/consumidores/rest"
+
+URL_DATE_FORMAT = "%d-%m-%Y%H:%M:%S"
+
+
+class FakeIDeSession:
+    """Wraps an aiohttp.ClientSession to send ideenergy.Client requests elsewhere
+
+    ideenergy.Client only uses session.request() and its URLs are absolute. The
+    wrapped session needs a CookieJar(unsafe=True) to keep cookies from IP hosts.
+    """
+
+    def __init__(self, session: aiohttp.ClientSession, base_url: str):
+        self._session = session
+        self._base_url = base_url.rstrip("/")
+
+    def request(self, method: str, url: str, **kwargs):
+        if url.startswith(IDE_BASE_URL):
+            url = self._base_url + url[len(IDE_BASE_URL) :]
+
+        return self._session.request(method, url, **kwargs)
+
+
+class FakeIDeServer:
+    """Fake i-DE REST API
+
+    - latency: seconds added to every request (measure requests take measure_latency)
+    - error_rate: probability of answering any request with a 500
+    - ban_threshold: requests per user within ban_window before being banned, then
+      every request from that user gets a 403 for ban_period seconds
+    - publish_hour: local hour at which yesterday's historical data is published
+    - quarter_hour: serve 15 minute historical series instead of hourly
+    - clock: returns current (naive, local) time, replace to simulate time
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: float = 0.0,
+        measure_latency: float | None = None,
+        error_rate: float = 0.0,
+        ban_threshold: int | None = None,
+        ban_window: float = 3600,
+        ban_period: float = 3600,
+        publish_hour: int = 4,
+        quarter_hour: bool = False,
+        contracts_per_user: int = 1,
+        clock: Callable[[], datetime] = datetime.now,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.measure_latency = latency if measure_latency is None else measure_latency
+        self.error_rate = error_rate
+        self.ban_threshold = ban_threshold
+        self.ban_window = ban_window
+        self.ban_period = ban_period
+        self.publish_hour = publish_hour
+        self.quarter_hour = quarter_hour
+        self.contracts_per_user = contracts_per_user
+        self.clock = clock
+
+        self.random = random.Random(seed)
+
+        # Statistics
+        self.calls: Counter[str] = Counter()
+        self.calls_by_user: Counter[str] = Counter()
+        self.errors = 0
+        self.bans = 0
+        self.logins = 0
+
+        self._sessions: dict[str, str] = {}  # session token → username
+        self._selected: dict[str, str] = {}  # session token → contract
+        self._recent: dict[str, deque[float]] = {}
+        self._banned_until: dict[str, float] = {}
+
+    def reset_stats(self) -> None:
+        self.calls.clear()
+        self.calls_by_user.clear()
+        self.errors = self.bans = self.logins = 0
+
+    def is_banned(self, username: str) -> bool:
+        return self._banned_until.get(username, 0) > self.clock().timestamp()
+
+    #
+    # Server
+    #
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        r = app.router
+        r.add_post(f"{REST_PATH}/loginNew/login", self.handle_login)
+        r.add_get(f"{REST_PATH}/cto/listaCtos/", self.handle_contracts)
+        r.add_get(f"{REST_PATH}/cto/seleccion/{{contract}}", self.handle_select)
+        r.add_get(f"{REST_PATH}/detalleCto/detalle/", self.handle_details)
+        r.add_get(
+            f"{REST_PATH}/escenarioNew/obtenerMedicionOnline/24", self.handle_measure
+        )
+        r.add_post(f"{REST_PATH}/rearmeICP/consultarEstado", self.handle_icp)
+        for kind in ("Consumo", "Generacion"):
+            r.add_get(
+                f"{REST_PATH}/consumoNew/obtenerDatos{kind}Periodo/"
+                "fechaInicio/{start}/fechaFinal/{end}/",
+                self.handle_historical,
+            )
+        r.add_get(
+            f"{REST_PATH}/consumoNew/obtenerLimitesFechasPotencia/",
+            self.handle_power_demand_limits,
+        )
+        r.add_get(
+            f"{REST_PATH}/consumoNew/obtenerPotenciasMaximasRangoV2/{{min}}/{{max}}",
+            self.handle_power_demand,
+        )
+
+        return app
+
+    @contextlib.asynccontextmanager
+    async def run(self, host: str = "127.0.0.1", port: int = 0) -> AsyncIterator[str]:
+        """Run the server, yields its base URL"""
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+
+        sockets = site._server.sockets  # type: ignore[union-attr]
+        port = sockets[0].getsockname()[1]
+        try:
+            yield f"http://{host}:{port}"
+        finally:
+            await runner.cleanup()
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        name = request.match_info.route.resource.canonical  # type: ignore[union-attr]
+        name = name[len(REST_PATH) + 1 :].split("/{")[0]
+        self.calls[name] += 1
+
+        token = request.cookies.get("JSESSIONID")
+        username = self._sessions.get(token, "") if token else ""
+        if request.path.endswith("/loginNew/login"):
+            body = await request.json()
+            username = body[0]
+
+        if username:
+            self.calls_by_user[username] += 1
+            if self._check_ban(username):
+                return web.Response(status=403, text="banned")
+
+        is_measure = "obtenerMedicionOnline" in request.path
+        delay = self.measure_latency if is_measure else self.latency
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="fake error")
+
+        return await handler(request)
+
+    def _check_ban(self, username: str) -> bool:
+        if self.is_banned(username):
+            return True
+
+        if self.ban_threshold is None:
+            return False
+
+        now = self.clock().timestamp()
+        recent = self._recent.setdefault(username, deque())
+        recent.append(now)
+        while recent and recent[0] < now - self.ban_window:
+            recent.popleft()
+
+        if len(recent) > self.ban_threshold:
+            self.bans += 1
+            self._banned_until[username] = now + self.ban_period
+            recent.clear()
+            return True
+
+        return False
+
+    def _session(self, request: web.Request) -> str | None:
+        token = request.cookies.get("JSESSIONID")
+        return token if token in self._sessions else None
+
+    #
+    # Handlers
+    #
+
+    async def handle_login(self, request: web.Request) -> web.Response:
+        username, password = (await request.json())[0:2]
+        if not username or not password:
+            return web.json_response({"success": "false"})
+
+        self.logins += 1
+        token = f"{username}-{time.monotonic_ns()}"
+        self._sessions[token] = username
+
+        resp = web.json_response(
+            {
+                "redirect": "informacion-del-contrato",
+                "zona": "B",
+                "success": "true",
+                "idioma": "ES",
+                "uCcr": "",
+            }
+        )
+        resp.set_cookie("JSESSIONID", token)
+        return resp
+
+    def _contracts(self, username: str) -> list[dict[str, Any]]:
+        return [
+            {
+                "direccion": f"C/ Fake {idx}, {username}",
+                "cups": f"ES{abs(hash((username, idx))) % 10**16:016d}XX",
+                "tipo": "A",
+                "estContrato": "Alta",
+                "codContrato": f"{abs(hash((username, idx))) % 10**9:09d}",
+                "esTelegestionado": True,
+                "presion": "1.00",
+                "fecUltActua": "01.01.1970",
+                "esTelemedido": False,
+                "tipSisLectura": "TG",
+                "estadoAlta": True,
+            }
+            for idx in range(self.contracts_per_user)
+        ]
+
+    async def handle_contracts(self, request: web.Request) -> web.Response:
+        if (token := self._session(request)) is None:
+            return web.Response(status=401)
+
+        contracts = self._contracts(self._sessions[token])
+        return web.json_response({"success": True, "contratos": contracts})
+
+    async def handle_select(self, request: web.Request) -> web.Response:
+        if (token := self._session(request)) is None:
+            return web.Response(status=401)
+
+        contract = request.match_info["contract"]
+        self._selected[token] = contract
+        return web.json_response({"success": True})
+
+    async def handle_details(self, request: web.Request) -> web.Response:
+        if (token := self._session(request)) is None:
+            return web.Response(status=401)
+
+        contract = self._selected.get(token)
+        info = next(
+            (
+                x
+                for x in self._contracts(self._sessions[token])
+                if x["codContrato"] == contract
+            ),
+            None,
+        )
+        if info is None:
+            return web.json_response({})
+
+        return web.json_response(
+            {
+                "codContrato": float(info["codContrato"]),
+                "codProvincia": "28",
+                "cups": info["cups"],
+                "direccion": info["direccion"],
+                "potMaxima": 5750,
+                "listContador": [{"tipMarca": "ZIV", "numSerieEquipo": 1.0}],
+            }
+        )
+
+    async def handle_measure(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            return web.Response(status=401)
+
+        now = self.clock()
+        accumulate = int(now.timestamp() / 3600)  # One kWh an hour
+        return web.json_response(
+            {
+                "valMagnitud": f"{self.random.uniform(100, 3000):.2f}",
+                "valInterruptor": "1",
+                "valEstado": "09",
+                "valLecturaContador": str(accumulate),
+                "codSolicitudTGT": "012345678901",
+            }
+        )
+
+    async def handle_icp(self, request: web.Request) -> web.Response:
+        return web.json_response({"icp": "trueConectado"})
+
+    def published_until(self) -> datetime:
+        """Data is published up to this (excluded) local midnight"""
+        now = self.clock()
+        today = datetime(now.year, now.month, now.day)
+        return today if now.hour >= self.publish_hour else today - timedelta(days=1)
+
+    async def handle_historical(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            return web.Response(status=401)
+
+        start = datetime.strptime(request.match_info["start"], URL_DATE_FORMAT)
+        end = datetime.strptime(request.match_info["end"], URL_DATE_FORMAT)
+        published = self.published_until()
+
+        step = timedelta(minutes=15) if self.quarter_hour else timedelta(hours=1)
+        values: list[dict[str, str] | None] = []
+        dt = start
+        while dt < end + timedelta(days=1):
+            if dt < published:
+                values.append({"valor": f"{self.random.uniform(50, 900):.0f}"})
+            else:
+                values.append(None)
+            dt = dt + step
+
+        total = sum(float(x["valor"]) for x in values if x)
+        return web.json_response(
+            {
+                "acumulado": total,
+                "acumuladoCO2": total * 0.2,
+                "y": {"data": [values]},
+            }
+        )
+
+    async def handle_power_demand_limits(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            return web.Response(status=401)
+
+        now = self.clock()
+        return web.json_response(
+            {
+                "resultado": "correcto",
+                "fecMin": (now - timedelta(days=365)).strftime("%d-%m-%Y%H:%M:%S"),
+                "fecMax": now.strftime("%d-%m-%Y%H:%M:%S"),
+            }
+        )
+
+    async def handle_power_demand(self, request: web.Request) -> web.Response:
+        if self._session(request) is None:
+            return web.Response(status=401)
+
+        now = self.clock()
+        peaks = [
+            [
+                {
+                    "name": (now - timedelta(days=30 * month + 3)).strftime(
+                        "%d/%m/%Y %H:%M"
+                    ),
+                    "y": round(self.random.uniform(2000, 5000)),
+                }
+            ]
+            for month in range(12)
+        ]
+        return web.json_response({"resultado": "correcto", "potMaxMens": peaks})
+
+
+async def _main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--measure-latency", type=float)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ban-threshold", type=int)
+    parser.add_argument("--ban-period", type=float, default=3600)
+    parser.add_argument("--quarter-hour", action="store_true")
+    args = parser.parse_args()
+
+    server = FakeIDeServer(
+        latency=args.latency,
+        measure_latency=args.measure_latency,
+        error_rate=args.error_rate,
+        ban_threshold=args.ban_threshold,
+        ban_period=args.ban_period,
+        quarter_hour=args.quarter_hour,
+    )
+    async with server.run(args.host, args.port) as base_url:
+        print(f"Fake i-DE server listening on {base_url}")
+        await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
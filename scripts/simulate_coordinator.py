@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""Replay months of IDeCoordinator behaviour on a virtual clock
+
+Discrete-event simulation: regular refreshes (every update interval) and MEASURE
+attempts (each minute of the update window, like async_prepare_measure_attempt
+schedules them) are replayed in order, passing the virtual time as `now` to
+IDeCoordinator._async_update_data_raw. The API is an in-process script:
+
+- MEASURE requests succeed with some probability, lower in "bad" hours
+- yesterday's historical data is published every day around a random time
+- random outages fail every request for a while
+- too many requests in an hour get the account banned for a while
+
+Reports, for each dataset, API calls, successes, data staleness and time spent in
+cooldown (backing off or held by the circuit breaker). Run from the repository
+root with Home Assistant installed:
+
+    python scripts/simulate_coordinator.py --days 365 --policy adaptive
+    python scripts/simulate_coordinator.py --days 365 --policy basic
+"""
+
+
+import argparse
+import asyncio
+import heapq
+import logging
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from collections.abc import Callable, Iterator
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import ideenergy
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from homeassistant.core import HomeAssistant, dt_util  # noqa: E402
+
+from custom_components.ideenergy import (  # noqa: E402
+    _build_barriers,
+    _calculate_datacoordinator_update_interval,
+)
+from custom_components.ideenergy.barrier import (  # noqa: E402
+    BackoffBarrierDenyError,
+    Barrier,
+    BarrierDeniedError,
+    CircuitBreaker,
+    CircuitBreakerState,
+    TimeDeltaBarrier,
+    TimeWindowBarrier,
+    TimeWindowBarrierDenyError,
+)
+from custom_components.ideenergy.const import (  # noqa: E402
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_OPEN_PERIOD,
+    DATA_ATTR_HISTORICAL_CONSUMPTION,
+    DATA_ATTR_HISTORICAL_GENERATION,
+    DATA_ATTR_HISTORICAL_POWER_DEMAND,
+    DATA_ATTR_MEASURE_INSTANT,
+    MAX_RETRIES,
+    UPDATE_WINDOW_END_MINUTE,
+    UPDATE_WINDOW_START_MINUTE,
+)
+from custom_components.ideenergy.datacoordinator import (  # noqa: E402
+    DataSetType,
+    IDeCoordinator,
+)
+from custom_components.ideenergy.tzconv import MAINLAND_SPAIN_ZONEINFO  # noqa: E402
+
+DATASETS = [
+    DataSetType.MEASURE,
+    DataSetType.HISTORICAL_CONSUMPTION,
+    DataSetType.HISTORICAL_GENERATION,
+    DataSetType.HISTORICAL_POWER_DEMAND,
+]
+
+DATASET_DATA_ATTRS = {
+    DataSetType.MEASURE: DATA_ATTR_MEASURE_INSTANT,
+    DataSetType.HISTORICAL_CONSUMPTION: DATA_ATTR_HISTORICAL_CONSUMPTION,
+    DataSetType.HISTORICAL_GENERATION: DATA_ATTR_HISTORICAL_GENERATION,
+    DataSetType.HISTORICAL_POWER_DEMAND: DATA_ATTR_HISTORICAL_POWER_DEMAND,
+}
+
+COOLDOWN_DENY_CODES = {
+    BackoffBarrierDenyError.BACKOFF,
+    TimeWindowBarrierDenyError.COOLDOWN,
+}
+
+
+class VirtualClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def local(self) -> datetime:
+        return self.now.astimezone(MAINLAND_SPAIN_ZONEINFO)
+
+
+class ScriptedAPI:
+    """In-process stand-in for ideenergy.Client driven by a virtual clock"""
+
+    username = "simulated"
+    _contract = "000000000"
+    zone = MAINLAND_SPAIN_ZONEINFO
+
+    def __init__(
+        self,
+        clock: VirtualClock,
+        rng: random.Random,
+        *,
+        measure_success: float = 0.8,
+        bad_hours: set[int] | None = None,
+        bad_hour_success: float = 0.1,
+        publish_hour: float = 6.0,
+        publish_sd: float = 1.5,
+        outages_per_day: float = 0.05,
+        outage_hours: float = 6.0,
+        ban_threshold: int | None = 30,
+        ban_hours: float = 24.0,
+    ):
+        self.clock = clock
+        self.rng = rng
+        self.measure_success = measure_success
+        self.bad_hours = bad_hours or set()
+        self.bad_hour_success = bad_hour_success
+        self.publish_hour = publish_hour
+        self.publish_sd = publish_sd
+        self.outages_per_day = outages_per_day
+        self.outage_hours = outage_hours
+        self.ban_threshold = ban_threshold
+        self.ban_hours = ban_hours
+
+        self.calls: Counter[DataSetType] = Counter()
+        self.failures: Counter[DataSetType] = Counter()
+        self.probes = 0
+        self.bans = 0
+        self.banned_for = timedelta(0)
+
+        self._publish_times: dict[date, datetime] = {}
+        self._outages: dict[date, tuple[datetime, datetime] | None] = {}
+        self._recent: deque[datetime] = deque()
+        self._banned_until: datetime | None = None
+
+    def publish_time(self, day: date) -> datetime:
+        """When data for the day before `day` gets published"""
+        if day not in self._publish_times:
+            hours = max(0.0, self.rng.gauss(self.publish_hour, self.publish_sd))
+            midnight = datetime(day.year, day.month, day.day, tzinfo=self.zone)
+            self._publish_times[day] = midnight + timedelta(hours=min(hours, 23.9))
+
+        return self._publish_times[day]
+
+    def _in_outage(self, now: datetime) -> bool:
+        for day in (now.date() - timedelta(days=1), now.date()):
+            if day not in self._outages:
+                self._outages[day] = None
+                if self.rng.random() < self.outages_per_day:
+                    start = datetime(
+                        day.year, day.month, day.day, tzinfo=self.zone
+                    ) + timedelta(hours=self.rng.uniform(0, 24))
+                    self._outages[day] = (
+                        start,
+                        start + timedelta(hours=self.outage_hours),
+                    )
+
+            outage = self._outages[day]
+            if outage and outage[0] <= now < outage[1]:
+                return True
+
+        return False
+
+    def _request(self, dataset: DataSetType | None) -> None:
+        now = self.clock.local()
+
+        if dataset is None:
+            self.probes += 1
+        else:
+            self.calls[dataset] += 1
+
+        if self._banned_until is not None and now < self._banned_until:
+            self._fail(dataset, 403, "banned")
+
+        if self.ban_threshold is not None:
+            self._recent.append(now)
+            while self._recent[0] < now - timedelta(hours=1):
+                self._recent.popleft()
+
+            if len(self._recent) > self.ban_threshold:
+                self.bans += 1
+                self.banned_for += timedelta(hours=self.ban_hours)
+                self._banned_until = now + timedelta(hours=self.ban_hours)
+                self._recent.clear()
+                self._fail(dataset, 403, "banned")
+
+        if self._in_outage(now):
+            self._fail(dataset, 500, "outage")
+
+    def _fail(self, dataset: DataSetType | None, status: int, reason: str) -> None:
+        if dataset is not None:
+            self.failures[dataset] += 1
+
+        raise ideenergy.RequestFailedError(
+            SimpleNamespace(status=status, reason=reason)
+        )
+
+    async def login(self) -> None:
+        self._request(None)
+
+    async def select_contract(self, id: str) -> None:
+        self._request(None)
+
+    async def get_measure(self) -> ideenergy.client.Measure:
+        self._request(DataSetType.MEASURE)
+
+        now = self.clock.local()
+        success = (
+            self.bad_hour_success
+            if now.hour in self.bad_hours
+            else self.measure_success
+        )
+        if self.rng.random() >= success:
+            self._fail(DataSetType.MEASURE, 500, "ICP didn't answer")
+
+        return ideenergy.client.Measure(
+            accumulate=int(now.timestamp() / 3600), instant=self.rng.uniform(100, 3000)
+        )
+
+    async def get_historical_consumption(
+        self, start: datetime, end: datetime
+    ) -> dict[str, Any]:
+        self._request(DataSetType.HISTORICAL_CONSUMPTION)
+        return self._historical(start, end)
+
+    async def get_historical_generation(
+        self, start: datetime, end: datetime
+    ) -> dict[str, Any]:
+        self._request(DataSetType.HISTORICAL_GENERATION)
+        return self._historical(start, end)
+
+    def _historical(self, start: datetime, end: datetime) -> dict[str, Any]:
+        # Same output as ideenergy.parsers.parser_generic_historical_data
+        now = self.clock.local()
+        today = now.date()
+        # Data is available up to this (excluded) day
+        published = (
+            today if now >= self.publish_time(today) else today - timedelta(days=1)
+        )
+
+        base = datetime(start.year, start.month, start.day)
+        base_utc = base.replace(tzinfo=self.zone).astimezone(timezone.utc)
+        until_utc = (
+            datetime(published.year, published.month, published.day, tzinfo=self.zone)
+        ).astimezone(timezone.utc)
+        last_utc = (
+            datetime(end.year, end.month, end.day, tzinfo=self.zone) + timedelta(days=1)
+        ).astimezone(timezone.utc)
+
+        n = int(min(until_utc, last_utc).timestamp() - base_utc.timestamp()) // 3600
+        historical = [
+            {
+                "start": base + timedelta(hours=idx),
+                "end": base + timedelta(hours=idx + 1),
+                "value": self.rng.uniform(50, 900),
+            }
+            for idx in range(max(0, n))
+        ]
+
+        total = sum(x["value"] for x in historical)
+        return {
+            "accumulated": total,
+            "accumulated-co2": total * 0.2,
+            "historical": historical,
+        }
+
+    async def get_historical_power_demand(self) -> list[dict[str, Any]]:
+        # Limits and data, two requests
+        self._request(DataSetType.HISTORICAL_POWER_DEMAND)
+        self._request(DataSetType.HISTORICAL_POWER_DEMAND)
+
+        now = self.clock.local().replace(tzinfo=None)
+        return [
+            {"dt": now - timedelta(days=30 * x + 3), "value": 3000} for x in range(12)
+        ]
+
+
+class RecordingBarrier(Barrier):
+    """Proxy recording the outcome of the last check() of a barrier"""
+
+    def __init__(self, barrier: Barrier):
+        self.barrier = barrier
+        self.last_deny: Any = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.barrier, name)
+
+    def check(self, **kwargs: Any) -> None:
+        try:
+            self.barrier.check(**kwargs)
+        except BarrierDeniedError as e:
+            self.last_deny = e.code
+            raise
+
+        self.last_deny = None
+
+    def success(self, **kwargs: Any) -> None:
+        self.barrier.success(**kwargs)
+
+    def fail(self, **kwargs: Any) -> None:
+        self.barrier.fail(**kwargs)
+
+    def dump(self) -> dict[str, Any]:
+        return self.barrier.dump()
+
+    def deadline(self, now: datetime | None = None) -> datetime | None:
+        return self.barrier.deadline(now=now)
+
+    def set_phase(self, phase: float) -> None:
+        self.barrier.set_phase(phase)
+
+    def data_received(self, latest: date | None, now: datetime | None = None) -> None:
+        self.barrier.data_received(latest, now=now)
+
+
+def _build_basic_barriers() -> dict[DataSetType, Barrier]:
+    # Fixed update window and fixed retry deltas, no learning nor backoff
+    return {
+        DataSetType.MEASURE: TimeWindowBarrier(
+            allowed_window_minutes=(
+                UPDATE_WINDOW_START_MINUTE,
+                UPDATE_WINDOW_END_MINUTE,
+            ),
+            max_retries=MAX_RETRIES,
+            max_age=timedelta(hours=1),
+        ),
+        DataSetType.HISTORICAL_CONSUMPTION: TimeDeltaBarrier(delta=timedelta(hours=6)),
+        DataSetType.HISTORICAL_GENERATION: TimeDeltaBarrier(delta=timedelta(hours=6)),
+        DataSetType.HISTORICAL_POWER_DEMAND: TimeDeltaBarrier(
+            delta=timedelta(hours=36)
+        ),
+    }
+
+
+POLICIES: dict[str, Callable[[], dict[DataSetType, Barrier]]] = {
+    "adaptive": _build_barriers,
+    "basic": _build_basic_barriers,
+}
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.successes: Counter[DataSetType] = Counter()
+        self.cooldown: Counter[DataSetType] = Counter()  # seconds
+        self.staleness: Counter[DataSetType] = Counter()  # seconds × seconds
+        self.max_staleness: Counter[DataSetType] = Counter()  # seconds
+        self.breaker_open = 0.0  # seconds
+        self.last_success: dict[DataSetType, datetime] = {}
+        self.latest_data: dict[DataSetType, datetime] = {}
+
+    def freshness_point(self, dataset: DataSetType) -> datetime | None:
+        """Time data of the dataset is current up to"""
+        if dataset in self.latest_data:
+            return self.latest_data[dataset]
+
+        return self.last_success.get(dataset)
+
+
+def events(
+    start: datetime, end: datetime, interval: timedelta, measure_attempts: bool
+) -> Iterator[tuple[datetime, DataSetType]]:
+    def _regular():
+        t = start
+        while t < end:
+            yield t, DataSetType.ALL
+            t = t + interval
+
+    def _attempts():
+        t = start.replace(minute=0, second=0, microsecond=0)
+        while t < end:
+            for minute in range(
+                UPDATE_WINDOW_START_MINUTE, UPDATE_WINDOW_END_MINUTE + 1
+            ):
+                yield t + timedelta(minutes=minute), DataSetType.MEASURE
+            t = t + timedelta(hours=1)
+
+    streams = [_regular()]
+    if measure_attempts:
+        streams.append(_attempts())
+
+    yield from heapq.merge(*streams, key=lambda x: x[0])
+
+
+async def simulate(args: argparse.Namespace) -> tuple[Stats, ScriptedAPI, float]:
+    rng = random.Random(args.seed)
+    # Barrier jitter uses the random module
+    random.seed(args.seed)
+
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    end = start + timedelta(days=args.days)
+    clock = VirtualClock(start)
+
+    api = ScriptedAPI(
+        clock,
+        rng,
+        measure_success=args.measure_success,
+        bad_hours=set(args.bad_hours),
+        publish_hour=args.publish_hour,
+        outages_per_day=args.outages_per_day,
+        ban_threshold=args.ban_threshold,
+    )
+    barriers = {k: RecordingBarrier(v) for k, v in POLICIES[args.policy]().items()}
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        coordinator = IDeCoordinator(
+            hass=hass,
+            api=api,
+            barriers=barriers,  # type: ignore[arg-type]
+            update_interval=_calculate_datacoordinator_update_interval(),
+            breaker=CircuitBreaker(
+                failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                open_period=timedelta(seconds=CIRCUIT_BREAKER_OPEN_PERIOD),
+            ),
+        )
+        coordinator.set_schedule_phase(args.phase)
+
+        stats = Stats()
+        prev = start
+
+        t0 = time.perf_counter()
+        for now, datasets in events(
+            start,
+            end,
+            coordinator.update_interval,  # type: ignore[arg-type]
+            measure_attempts=not args.no_measure_attempts,
+        ):
+            if datasets is DataSetType.MEASURE:
+                now = now + getattr(
+                    barriers[DataSetType.MEASURE].barrier,
+                    "stagger_offset",
+                    timedelta(0),
+                )
+
+            # Account state between previous event and this one
+            elapsed = (now - prev).total_seconds()
+            breaker_open = coordinator.breaker.state is not CircuitBreakerState.CLOSED
+            if breaker_open:
+                stats.breaker_open += elapsed
+
+            for dataset in DATASETS:
+                if breaker_open or barriers[dataset].last_deny in COOLDOWN_DENY_CODES:
+                    stats.cooldown[dataset] += elapsed
+
+                point = stats.freshness_point(dataset)
+                if point is not None:
+                    age = (now - point).total_seconds()
+                    stats.staleness[dataset] += age * elapsed
+                    stats.max_staleness[dataset] = max(
+                        stats.max_staleness[dataset], age
+                    )
+
+            clock.now = prev = now
+            data = await coordinator._async_update_data_raw(datasets, now=now)
+
+            for dataset in DATASETS:
+                attr = DATASET_DATA_ATTRS[dataset]
+                if attr not in data:
+                    continue
+
+                stats.successes[dataset] += 1
+                stats.last_success[dataset] = now
+
+                if (
+                    isinstance(data[attr], dict)
+                    and (series := data[attr]["historical"]) is not None
+                    and (latest := series.latest_day(coordinator.zoneinfo))
+                ):
+                    stats.latest_data[dataset] = datetime(
+                        latest.year,
+                        latest.month,
+                        latest.day,
+                        tzinfo=coordinator.zoneinfo,
+                    ) + timedelta(days=1)
+
+        elapsed = time.perf_counter() - t0
+        await hass.async_stop(force=True)
+
+    return stats, api, elapsed
+
+
+def report(args: argparse.Namespace, stats: Stats, api: ScriptedAPI, elapsed: float):
+    total = args.days * 24 * 3600
+
+    print(
+        f"policy: {args.policy}, {args.days} days simulated in {elapsed:.1f}s, "
+        f"{api.bans} bans, {api.probes} probes, "
+        f"circuit breaker open {stats.breaker_open / 3600:.1f}h"
+    )
+    print(
+        f"{'dataset':<24} {'calls':>7} {'ok':>7} {'failed':>7} {'calls/day':>9} "
+        f"{'stale avg':>10} {'stale max':>10} {'cooldown':>9}"
+    )
+    for dataset in DATASETS:
+        print(
+            f"{dataset.name:<24} {api.calls[dataset]:>7} "
+            f"{stats.successes[dataset]:>7} {api.failures[dataset]:>7} "
+            f"{api.calls[dataset] / args.days:>9.1f} "
+            f"{stats.staleness[dataset] / total / 3600:>9.1f}h "
+            f"{stats.max_staleness[dataset] / 3600:>9.1f}h "
+            f"{stats.cooldown[dataset] / 3600:>8.1f}h"
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="adaptive")
+    parser.add_argument("--phase", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--measure-success", type=float, default=0.8)
+    parser.add_argument("--bad-hours", type=int, nargs="*", default=[])
+    parser.add_argument("--publish-hour", type=float, default=6.0)
+    parser.add_argument("--outages-per-day", type=float, default=0.05)
+    parser.add_argument("--ban-threshold", type=int, default=30)
+    parser.add_argument(
+        "--no-measure-attempts",
+        action="store_true",
+        help="don't attempt MEASURE at each minute of the update window",
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+    # Barriers use HA's local time zone
+    dt_util.set_default_time_zone(MAINLAND_SPAIN_ZONEINFO)
+
+    stats, api, elapsed = asyncio.run(simulate(args))
+    report(args, stats, api, elapsed)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
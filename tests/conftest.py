@@ -0,0 +1,54 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import pytest
+from homeassistant import config_entries, loader
+from homeassistant.components import recorder
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import recorder as recorder_helper
+from homeassistant.helpers.entity import DATA_ENTITY_SOURCE
+from homeassistant.setup import async_setup_component
+from homeassistant.util import dt as dt_util
+
+
+@pytest.fixture
+async def hass(tmp_path):
+    """Home Assistant instance in Europe/Madrid with a SQLite recorder"""
+    default_time_zone = dt_util.DEFAULT_TIME_ZONE
+
+    hass = HomeAssistant(str(tmp_path))
+    hass.config.skip_pip = True
+    hass.config.set_time_zone("Europe/Madrid")
+    hass.config_entries = config_entries.ConfigEntries(hass, {})
+    hass.data[DATA_ENTITY_SOURCE] = {}
+    loader.async_setup(hass)
+    recorder_helper.async_initialize_recorder(hass)
+
+    assert await async_setup_component(
+        hass, "recorder", {"recorder": {"db_url": f"sqlite:///{tmp_path}/db.sqlite"}}
+    )
+    await hass.async_start()
+    await recorder.get_instance(hass).async_db_ready
+
+    yield hass
+
+    # A stop requested while the recorder is still processing its startup tasks is
+    # lost and shutdown hangs until it times out, wait for its event loop first
+    await recorder.get_instance(hass).async_block_till_done()
+    await hass.async_stop(force=True)
+    dt_util.set_default_time_zone(default_time_zone)
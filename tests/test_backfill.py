@@ -0,0 +1,161 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from array import array
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+import ideenergy
+import pytest
+
+from custom_components.ideenergy import backfill
+from custom_components.ideenergy.backfill import (
+    BackfillCheckpoints,
+    BackfillStopped,
+    async_backfill,
+    async_fetch_window_states,
+    month_windows,
+)
+from custom_components.ideenergy.barrier import Barrier
+from custom_components.ideenergy.const import BACKFILL_MAX_FAILURES
+from custom_components.ideenergy.datacoordinator import DataSetType
+from custom_components.ideenergy.series import HOURLY, HistoricalSeries
+
+ENTRY_ID = "entry-1"
+DATASET = DataSetType.HISTORICAL_CONSUMPTION
+METADATA = {
+    "has_mean": False,
+    "has_sum": True,
+    "name": "Historical consumption",
+    "source": "recorder",
+    "statistic_id": "sensor.ideenergy_historical_consumption",
+    "unit_of_measurement": "kWh",
+}
+
+
+class CountingBarrier(Barrier):
+    def __init__(self):
+        self.successes = 0
+        self.failures = 0
+
+    def check(self, now: datetime | None = None) -> None:
+        pass
+
+    def success(self, now: datetime | None = None) -> None:
+        self.successes = self.successes + 1
+
+    def fail(self, now: datetime | None = None) -> None:
+        self.failures = self.failures + 1
+
+    def dump(self):
+        return {}
+
+
+class FakeCoordinator:
+    """Returns 1 kWh per hour for any range, or fails if told so"""
+
+    def __init__(self, hass, fail: bool = False):
+        self.hass = hass
+        self.zoneinfo = ZoneInfo("Europe/Madrid")
+        self.fail = fail
+        self.calls: list[tuple[datetime, datetime]] = []
+
+    async def async_fetch_historical_range(self, dataset, start, end):
+        self.calls.append((start, end))
+        if self.fail:
+            raise ideenergy.ClientError("boom")
+
+        hours = round((end - start) / HOURLY) + 1
+        return {"historical": HistoricalSeries(start, HOURLY, array("d", [1]) * hours)}
+
+
+def test_month_windows_dont_cross_month_boundaries():
+    assert list(month_windows(date(2022, 11, 15), date(2023, 2, 10))) == [
+        (date(2022, 11, 15), date(2022, 12, 1)),
+        (date(2022, 12, 1), date(2023, 1, 1)),
+        (date(2023, 1, 1), date(2023, 2, 1)),
+        (date(2023, 2, 1), date(2023, 2, 10)),
+    ]
+    assert list(month_windows(date(2023, 1, 1), date(2023, 2, 1))) == [
+        (date(2023, 1, 1), date(2023, 2, 1))
+    ]
+    assert list(month_windows(date(2023, 1, 1), date(2023, 1, 1))) == []
+
+
+async def test_checkpoints_are_bound_to_their_range(hass):
+    checkpoints = BackfillCheckpoints(hass)
+    start, end = date(2023, 1, 1), date(2023, 4, 1)
+    await checkpoints.async_set(ENTRY_ID, DATASET, start, end, date(2023, 3, 1))
+
+    # Persisted, a new instance finds it
+    checkpoints = BackfillCheckpoints(hass)
+    get = checkpoints.async_get
+    assert await get(ENTRY_ID, DATASET, start, end) == date(2023, 3, 1)
+
+    # Other ranges and datasets don't
+    assert await get(ENTRY_ID, DATASET, start, date(2023, 5, 1)) is None
+    assert await get(ENTRY_ID, DataSetType.HISTORICAL_GENERATION, start, end) is None
+
+    await checkpoints.async_remove(ENTRY_ID, DATASET)
+    assert await checkpoints.async_get(ENTRY_ID, DATASET, start, end) is None
+
+
+async def test_backfill_resumes_from_checkpoint(hass, monkeypatch):
+    monkeypatch.setattr(backfill, "make_pacing_barrier", CountingBarrier)
+    coordinator = FakeCoordinator(hass)
+    checkpoints = BackfillCheckpoints(hass)
+    start, end = date(2023, 1, 1), date(2023, 5, 1)
+    await checkpoints.async_set(ENTRY_ID, DATASET, start, end, date(2023, 3, 1))
+
+    n = await async_backfill(
+        hass,
+        coordinator,  # type: ignore[arg-type]
+        checkpoints,
+        ENTRY_ID,
+        DATASET,
+        METADATA,  # type: ignore[arg-type]
+        start,
+        end,
+    )
+
+    assert coordinator.calls == [
+        (datetime(2023, 3, 1), datetime(2023, 4, 1)),
+        (datetime(2023, 4, 1), datetime(2023, 5, 1)),
+    ]
+    # March has a 23 hours day
+    assert n == (31 + 30) * 24 - 1
+    # Completed, a new backfill of the same range starts over
+    assert await checkpoints.async_get(ENTRY_ID, DATASET, start, end) is None
+
+
+async def test_fetch_stops_after_max_failures(hass):
+    coordinator = FakeCoordinator(hass, fail=True)
+    barrier = CountingBarrier()
+
+    with pytest.raises(BackfillStopped):
+        await async_fetch_window_states(
+            coordinator,  # type: ignore[arg-type]
+            DATASET,
+            barrier,  # type: ignore[arg-type]
+            date(2023, 1, 1),
+            date(2023, 2, 1),
+        )
+
+    assert len(coordinator.calls) == BACKFILL_MAX_FAILURES
+    assert barrier.failures == BACKFILL_MAX_FAILURES
+    assert barrier.successes == 0
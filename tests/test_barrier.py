@@ -0,0 +1,366 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import random
+from collections import Counter
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+
+from custom_components.ideenergy import _build_barriers
+from custom_components.ideenergy.barrier import (
+    ATTR_NEXT_ATTEMPT,
+    ATTR_RETRY,
+    AdaptiveTimeWindowBarrier,
+    AdaptiveTimeWindowBarrierDenyError,
+    BackoffBarrier,
+    BackoffBarrierDenyError,
+    Barrier,
+    BarrierDeniedError,
+    CircuitBreaker,
+    CircuitBreakerDenyError,
+    CircuitBreakerState,
+    DecayingHistogram,
+    PublishTimeBarrier,
+    TimeWindowBarrier,
+)
+from custom_components.ideenergy.const import (
+    HISTORICAL_INITIAL_BACKOFF,
+    HISTORICAL_MAX_BACKOFF,
+    HISTORICAL_PUBLISH_LATE_RETRY,
+    HISTORICAL_PUBLISH_MAX_EMPTY,
+    HISTORICAL_PUBLISH_RETRY,
+    MAX_RETRIES,
+    MEASURE_MAX_AGE,
+    UPDATE_WINDOW_END_MINUTE,
+    UPDATE_WINDOW_START_MINUTE,
+)
+from custom_components.ideenergy.datacoordinator import DataSetType
+
+START = datetime(2023, 1, 2, tzinfo=timezone.utc)
+
+# Success probability of a measure call at a given time
+SuccessRate = Callable[[datetime], float]
+
+
+def make_barrier(adaptive: bool) -> TimeWindowBarrier:
+    kwargs = dict(
+        allowed_window_minutes=(UPDATE_WINDOW_START_MINUTE, UPDATE_WINDOW_END_MINUTE),
+        max_retries=MAX_RETRIES,
+        max_age=timedelta(seconds=MEASURE_MAX_AGE),
+    )
+    if adaptive:
+        return AdaptiveTimeWindowBarrier(**kwargs)
+
+    return TimeWindowBarrier(**kwargs)
+
+
+def replay(
+    barrier: Barrier, success_rate: SuccessRate, days: int = 30, seed: int = 0
+) -> tuple[int, int, Counter]:
+    """Poll the barrier every minute, like the coordinator does within the window
+
+    Returns measure calls made, readings got and denials by code
+    """
+    rng = random.Random(seed)
+    calls = readings = 0
+    denials: Counter = Counter()
+
+    now = START
+    while now < START + timedelta(days=days):
+        try:
+            barrier.check(now=now)
+        except BarrierDeniedError as deny:
+            denials[deny.code] += 1
+        else:
+            calls = calls + 1
+            if rng.random() < success_rate(now):
+                readings = readings + 1
+                barrier.success(now=now)
+            else:
+                barrier.fail(now=now)
+
+        now = now + timedelta(minutes=1)
+
+    return calls, readings, denials
+
+
+def late_minutes_succeed(now: datetime) -> float:
+    return 0.2 if now.minute < 54 else 0.9
+
+
+def test_adaptive_window_wastes_fewer_calls():
+    basic_calls, basic_readings, _ = replay(
+        make_barrier(adaptive=False), late_minutes_succeed
+    )
+    adaptive_calls, adaptive_readings, _ = replay(
+        make_barrier(adaptive=True), late_minutes_succeed
+    )
+
+    assert adaptive_readings > basic_readings
+    assert adaptive_calls - adaptive_readings < (basic_calls - basic_readings) / 2
+    assert adaptive_calls / adaptive_readings < basic_calls / basic_readings / 2
+
+
+def test_retries_denied_in_low_success_hours():
+    def night_fails(now: datetime) -> float:
+        return 0.0 if now.hour == 3 else 0.9
+
+    _, _, denials = replay(make_barrier(adaptive=True), night_fails)
+
+    assert denials[AdaptiveTimeWindowBarrierDenyError.LOW_SUCCESS_HOUR] > 0
+
+
+def test_histogram_sparse_bins_reach_min_samples():
+    histogram = DecayingHistogram(24, decay=0.99)
+    for n in range(24 * 30):
+        histogram.record(n % 24, success=False)
+
+    assert all(histogram.samples(x) >= 5 for x in range(24))
+    assert all(histogram.score(x) < 0.2 for x in range(24))
+
+
+def test_would_allow_does_not_change_state():
+    barrier = make_barrier(adaptive=False)
+    now = START.replace(minute=UPDATE_WINDOW_START_MINUTE)
+    for _ in range(MAX_RETRIES):
+        barrier.fail(now=now)
+
+    after_cooldown = now + timedelta(seconds=MEASURE_MAX_AGE)
+    assert barrier.would_allow(now=after_cooldown.replace(minute=55))
+    assert barrier.dump()[ATTR_RETRY] == MAX_RETRIES
+
+    barrier.check(now=after_cooldown.replace(minute=55))
+    assert barrier.dump()[ATTR_RETRY] == 0
+
+
+def test_stagger_only_delays_the_slot_minute():
+    barrier = AdaptiveTimeWindowBarrier(
+        allowed_window_minutes=(UPDATE_WINDOW_START_MINUTE, UPDATE_WINDOW_END_MINUTE),
+        max_retries=MAX_RETRIES,
+        max_age=timedelta(seconds=MEASURE_MAX_AGE),
+        stagger=timedelta(seconds=40),
+    )
+    barrier.set_phase(0.5)
+    slot = START.replace(minute=UPDATE_WINDOW_START_MINUTE)
+
+    try:
+        barrier.check(now=slot)
+    except BarrierDeniedError as deny:
+        assert deny.code == AdaptiveTimeWindowBarrierDenyError.STAGGERED
+    else:
+        raise AssertionError("attempt not staggered")
+
+    barrier.check(now=slot + timedelta(seconds=20))
+    barrier.check(now=slot + timedelta(minutes=1))
+
+
+def test_backoff_barrier_honours_delta():
+    delta = timedelta(hours=1)
+    barrier = BackoffBarrier(
+        delta=delta,
+        initial_backoff=timedelta(minutes=1),
+        max_backoff=timedelta(minutes=10),
+    )
+    barrier.set_phase(0.5)
+
+    # Success right after the 00:30 slot, next one is less than delta away
+    last_success = START + timedelta(minutes=31)
+    barrier.success(now=last_success)
+
+    assert barrier.next_slot() >= last_success + delta
+    try:
+        barrier.check(now=START + timedelta(hours=1, minutes=30))
+    except BarrierDeniedError as deny:
+        assert deny.code == BackoffBarrierDenyError.NO_MAX_AGE
+    else:
+        raise AssertionError("attempt allowed before delta")
+
+    barrier.check(now=last_success + delta)
+
+
+def test_publish_time_barrier_slows_down_when_publication_is_late():
+    barrier = PublishTimeBarrier(
+        delta=timedelta(seconds=HISTORICAL_PUBLISH_RETRY),
+        initial_backoff=timedelta(seconds=HISTORICAL_INITIAL_BACKOFF),
+        max_backoff=timedelta(seconds=HISTORICAL_MAX_BACKOFF),
+        late_delta=timedelta(seconds=HISTORICAL_PUBLISH_LATE_RETRY),
+        max_empty_attempts=HISTORICAL_PUBLISH_MAX_EMPTY,
+    )
+
+    # i-DE stops publishing for three days
+    latest = START.date() - timedelta(days=2)
+    calls_per_day: Counter = Counter()
+    now = START
+    while now < START + timedelta(days=3):
+        try:
+            barrier.check(now=now)
+        except BarrierDeniedError:
+            pass
+        else:
+            calls_per_day[now.date()] += 1
+            barrier.success(now=now)
+            barrier.data_received(latest, now=now)
+
+        now = now + timedelta(minutes=5)
+
+    late_calls = 24 * 60 * 60 // HISTORICAL_PUBLISH_LATE_RETRY
+    assert calls_per_day[START.date()] <= HISTORICAL_PUBLISH_MAX_EMPTY + late_calls
+    assert max(calls_per_day.values()) < 24
+    assert calls_per_day[START.date() + timedelta(days=2)] <= late_calls
+
+    # Back to the hourly retry once a new day shows up
+    barrier.data_received(latest + timedelta(days=1), now=now)
+    assert barrier.retry_delta == timedelta(seconds=HISTORICAL_PUBLISH_RETRY)
+
+
+def test_deadline_splits_window_between_attempts_left():
+    barrier = make_barrier(adaptive=False)
+    window_start = START.replace(minute=UPDATE_WINDOW_START_MINUTE)
+
+    # Ten minutes left, three attempts
+    assert barrier.deadline(now=window_start) == window_start + timedelta(seconds=200)
+
+    barrier.fail(now=window_start)
+    late = START.replace(minute=UPDATE_WINDOW_END_MINUTE - 1)
+    assert barrier.deadline(now=late) == late + timedelta(seconds=60)
+
+    assert barrier.deadline(now=START.replace(minute=10)) is None
+
+
+def test_backoff_jitter_stays_within_capped_exponential_bounds():
+    initial, cap = timedelta(minutes=1), timedelta(minutes=10)
+    random.seed(0)
+
+    delays: dict[int, list[timedelta]] = {}
+    for _ in range(200):
+        barrier = BackoffBarrier(
+            delta=timedelta(hours=1), initial_backoff=initial, max_backoff=cap
+        )
+        for n in range(1, 8):
+            barrier.fail(now=START)
+            delay = barrier.dump()[ATTR_NEXT_ATTEMPT] - START
+            delays.setdefault(n, []).append(delay)
+
+    for n, values in delays.items():
+        bound = min(cap, initial * 2 ** (n - 1))
+        assert all(timedelta(0) <= x <= bound for x in values)
+        # Full jitter: spread over the whole range
+        assert min(values) < bound / 4 and max(values) > bound * 3 / 4
+
+
+def test_backoff_denies_until_next_attempt_and_success_resets():
+    barrier = BackoffBarrier(
+        delta=timedelta(hours=1),
+        initial_backoff=timedelta(minutes=1),
+        max_backoff=timedelta(minutes=10),
+    )
+    barrier.fail(now=START)
+    next_attempt = barrier.dump()[ATTR_NEXT_ATTEMPT]
+
+    if next_attempt > START:
+        try:
+            barrier.check(now=START)
+        except BarrierDeniedError as deny:
+            assert deny.code == BackoffBarrierDenyError.BACKOFF
+        else:
+            raise AssertionError("attempt allowed while backing off")
+
+    # Retries aren't held back by delta
+    barrier.check(now=next_attempt)
+
+    barrier.success(now=next_attempt)
+    assert barrier.failures == 0
+    assert barrier.dump()[ATTR_NEXT_ATTEMPT] < next_attempt
+
+
+def assert_denied(barrier: Barrier, now: datetime, code) -> None:
+    try:
+        barrier.check(now=now)
+    except BarrierDeniedError as deny:
+        assert deny.code == code
+    else:
+        raise AssertionError(f"attempt allowed, expected {code}")
+
+
+def make_breaker() -> CircuitBreaker:
+    return CircuitBreaker(
+        failure_threshold=3,
+        open_period=timedelta(minutes=30),
+        probe_timeout=timedelta(minutes=5),
+    )
+
+
+def test_circuit_breaker_opens_after_threshold_and_closes_on_probe():
+    breaker = make_breaker()
+
+    for _ in range(2):
+        breaker.fail(now=START)
+    breaker.check(now=START)
+    assert breaker.state is CircuitBreakerState.CLOSED
+
+    breaker.fail(now=START)
+    assert breaker.state is CircuitBreakerState.OPEN
+    assert_denied(breaker, START + timedelta(minutes=29), CircuitBreakerDenyError.OPEN)
+    assert not breaker.acquire_probe(now=START + timedelta(minutes=29))
+
+    half_open = START + timedelta(minutes=30)
+    assert_denied(breaker, half_open, CircuitBreakerDenyError.HALF_OPEN)
+    assert breaker.state is CircuitBreakerState.HALF_OPEN
+
+    # A single probe at a time
+    assert breaker.acquire_probe(now=half_open)
+    assert not breaker.acquire_probe(now=half_open + timedelta(minutes=1))
+
+    breaker.success(now=half_open + timedelta(minutes=1))
+    assert breaker.state is CircuitBreakerState.CLOSED
+    breaker.check(now=half_open + timedelta(minutes=1))
+
+
+def test_circuit_breaker_reopens_when_probe_fails():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.fail(now=START)
+
+    half_open = START + timedelta(minutes=30)
+    assert_denied(breaker, half_open, CircuitBreakerDenyError.HALF_OPEN)
+    assert breaker.acquire_probe(now=half_open)
+
+    # A single failure is enough while half-open
+    breaker.fail(now=half_open)
+    assert breaker.state is CircuitBreakerState.OPEN
+    assert_denied(
+        breaker, half_open + timedelta(minutes=29), CircuitBreakerDenyError.OPEN
+    )
+
+
+def test_circuit_breaker_lost_probe_times_out():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.fail(now=START)
+
+    half_open = START + timedelta(minutes=30)
+    assert_denied(breaker, half_open, CircuitBreakerDenyError.HALF_OPEN)
+    assert breaker.acquire_probe(now=half_open)
+
+    # Probe never reported back
+    assert not breaker.acquire_probe(now=half_open + timedelta(minutes=4))
+    assert breaker.acquire_probe(now=half_open + timedelta(minutes=5))
+
+
+def test_default_measure_barrier_is_adaptive():
+    assert isinstance(_build_barriers()[DataSetType.MEASURE], AdaptiveTimeWindowBarrier)
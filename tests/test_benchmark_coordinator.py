@@ -0,0 +1,112 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+"""Coordinator benchmarks against the fake i-DE server (see
+scripts/benchmark_coordinator.py), failing if a budget is exceeded"""
+
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+
+import pytest
+from benchmark_coordinator import (
+    SimulatedClock,
+    bench_calls_per_hour,
+    bench_refresh,
+    make_coordinators,
+)
+from fakeide import FakeIDeServer
+from homeassistant.core import HomeAssistant
+
+from custom_components.ideenergy import _build_barriers
+
+# Just before the update window, after historical data is published
+START = datetime(2023, 6, 15, 7, 45, tzinfo=timezone.utc)
+
+# Wall time of a refresh of every dataset, all contracts at once
+REFRESH_BASE_BUDGET = 0.05
+REFRESH_PER_CONTRACT_BUDGET = 0.02
+
+# Regular updates make less than a call per contract and hour
+CALLS_PER_CONTRACT_AND_HOUR_BUDGET = 1
+
+
+@pytest.fixture
+def bench_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def fake_ide(bench_loop, tmp_path, request):
+    """Coordinators for request.param contracts (one account each)"""
+    loop = bench_loop
+    clock = SimulatedClock(START)
+    server = FakeIDeServer(clock=clock.local, seed=0)
+    stack = contextlib.AsyncExitStack()
+
+    async def _setup():
+        hass = HomeAssistant(str(tmp_path))
+        base_url = await stack.enter_async_context(server.run())
+        coordinators = await make_coordinators(hass, stack, base_url, request.param)
+        return hass, coordinators
+
+    hass, coordinators = loop.run_until_complete(_setup())
+
+    yield loop, server, clock, coordinators
+
+    loop.run_until_complete(stack.aclose())
+    loop.run_until_complete(hass.async_stop(force=True))
+
+
+@pytest.mark.parametrize("fake_ide", [1, 10, 100], indirect=True)
+def test_refresh_latency(benchmark, fake_ide):
+    loop, _, clock, coordinators = fake_ide
+
+    def reset_barriers():
+        # Otherwise rounds after the first one are denied and do nothing
+        for coordinator in coordinators:
+            coordinator.barriers = _build_barriers()
+
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(bench_refresh(coordinators, clock)),
+        setup=reset_barriers,
+        rounds=3,
+    )
+
+    budget = REFRESH_BASE_BUDGET + REFRESH_PER_CONTRACT_BUDGET * len(coordinators)
+    assert benchmark.stats.stats.median < budget
+
+
+@pytest.mark.parametrize("fake_ide", [1, 10, 100], indirect=True)
+def test_calls_per_hour(benchmark, fake_ide):
+    loop, server, clock, coordinators = fake_ide
+
+    # Initial fetch of every dataset, not part of regular updates
+    loop.run_until_complete(bench_refresh(coordinators, clock))
+
+    calls = benchmark.pedantic(
+        lambda: loop.run_until_complete(
+            bench_calls_per_hour(coordinators, server, clock, hours=3)
+        ),
+        rounds=1,
+    )
+
+    assert server.bans == 0
+    assert calls <= CALLS_PER_CONTRACT_AND_HOUR_BUDGET * len(coordinators)
@@ -0,0 +1,97 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from datetime import datetime, timedelta
+
+from homeassistant.components import recorder
+from homeassistant.util import dt as dt_util
+from homeassistant_historical_sensor import HistoricalState, recorderutil
+
+from custom_components.ideenergy import fixes
+from custom_components.ideenergy.checkpoints import (
+    find_verified_checkpoint,
+    get_sum_checkpoints,
+)
+from custom_components.ideenergy.fixes import async_fix_statistics
+from custom_components.ideenergy.importer import (
+    StatisticsImporter,
+    get_statistic_metadata_id,
+)
+
+STATISTIC_ID = "sensor.ideenergy_historical_consumption"
+METADATA = {
+    "has_mean": False,
+    "has_sum": True,
+    "name": "Historical consumption",
+    "source": "recorder",
+    "statistic_id": STATISTIC_ID,
+    "unit_of_measurement": "kWh",
+}
+
+
+def local(*args) -> datetime:
+    return dt_util.as_utc(datetime(*args, tzinfo=dt_util.DEFAULT_TIME_ZONE))
+
+
+async def import_hours(hass, start: datetime, end: datetime) -> None:
+    """1 kWh each hour in [start, end)"""
+    hours = round((end - start) / timedelta(hours=1))
+    importer = StatisticsImporter(hass, METADATA)  # type: ignore[arg-type]
+    await importer.async_start(start)
+    await importer.async_add(
+        HistoricalState(state=1, dt=start + timedelta(hours=x + 1))
+        for x in range(hours)
+    )
+    await importer.async_finish()
+
+
+async def test_corrupted_checkpoint_falls_back_to_an_earlier_one(hass, monkeypatch):
+    # January to March, January and February are closed months
+    await import_hours(hass, local(2023, 1, 1), local(2023, 4, 1))
+
+    sum_checkpoints = get_sum_checkpoints(hass)
+    january, february = await sum_checkpoints.async_get(STATISTIC_ID)
+    assert january == (local(2023, 1, 1), 31 * 24, 31 * 24)
+    # 23 hours DST day is in March
+    assert february == (local(2023, 2, 1), 59 * 24, 28 * 24)
+
+    # Cache went out of sync with the database
+    corrupted = (february[0], february[1] + 1, february[2])
+    await sum_checkpoints.async_update(STATISTIC_ID, [corrupted])
+
+    def fn():
+        with recorderutil.hass_recorder_session(hass) as session:
+            metadata_id = get_statistic_metadata_id(session, STATISTIC_ID)
+            return find_verified_checkpoint(
+                session, metadata_id, [january, corrupted]  # type: ignore[arg-type]
+            )
+
+    assert await recorder.get_instance(hass).async_add_executor_job(fn) == january
+
+    # The scan starts after January and verifies February again
+    used = []
+
+    def _find_verified_checkpoint(*args, **kwargs):
+        used.append(find_verified_checkpoint(*args, **kwargs))
+        return used[-1]
+
+    monkeypatch.setattr(fixes, "find_verified_checkpoint", _find_verified_checkpoint)
+    await async_fix_statistics(hass, METADATA)  # type: ignore[arg-type]
+
+    assert used == [january]
+    assert await sum_checkpoints.async_get(STATISTIC_ID) == [january, february]
@@ -0,0 +1,67 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import ideenergy
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+from homeassistant.data_entry_flow import FlowResultType
+
+from custom_components.ideenergy.config_flow import ConfigFlow
+from custom_components.ideenergy.const import CONF_CONTRACT, DATA_API_HANDOFF, DOMAIN
+
+CONTRACT = {"codContrato": "1", "cups": "ES0000000000000000XX0F", "direccion": "-"}
+
+
+class FakeClient:
+    def __init__(self, fail: bool):
+        self.fail = fail
+
+    async def get_contracts(self):
+        return [CONTRACT]
+
+    async def select_contract(self, contract: str) -> None:
+        if self.fail:
+            raise ideenergy.ClientError("select failed")
+
+
+async def finish_flow(hass, api: FakeClient):
+    flow = ConfigFlow()
+    flow.hass = hass
+    flow.handler = DOMAIN
+    flow.api = api
+    flow.info = {CONF_USERNAME: "user", CONF_PASSWORD: "password"}
+
+    form = await flow.async_step_contract()
+    (contract_key,) = form["data_schema"].schema[CONF_CONTRACT].container
+
+    return await flow.async_step_contract({CONF_CONTRACT: contract_key})
+
+
+async def test_client_is_handed_off_to_setup(hass):
+    api = FakeClient(fail=False)
+    result = await finish_flow(hass, api)
+
+    assert result["type"] == FlowResultType.CREATE_ENTRY
+    assert hass.data[DOMAIN][DATA_API_HANDOFF][("user", "1")] is api
+
+
+async def test_contract_selection_errors_dont_break_the_flow(hass):
+    result = await finish_flow(hass, FakeClient(fail=True))
+
+    assert result["type"] == FlowResultType.CREATE_ENTRY
+    assert result["data"][CONF_CONTRACT] == "1"
+    assert ("user", "1") not in hass.data.get(DOMAIN, {}).get(DATA_API_HANDOFF, {})
@@ -0,0 +1,228 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import ideenergy
+
+from custom_components.ideenergy import datacoordinator
+from custom_components.ideenergy.barrier import (
+    ATTR_EMPTY_ATTEMPTS,
+    Barrier,
+    BarrierDeniedError,
+    CircuitBreaker,
+    PublishTimeBarrier,
+)
+from custom_components.ideenergy.datacoordinator import DataSetType, IDeCoordinator
+
+NOW = datetime(2023, 6, 15, 10, 55, tzinfo=timezone.utc)
+
+
+class RecordingBarrier(Barrier):
+    def __init__(self, allow: bool = True, deadline: timedelta | None = None):
+        self.allow = allow
+        self.budget = deadline
+        self.successes = 0
+        self.failures = 0
+        self.received: list = []
+
+    def check(self, now: datetime | None = None) -> None:
+        if not self.allow:
+            raise BarrierDeniedError(code=None, reason="denied")
+
+    def success(self, now: datetime | None = None) -> None:
+        self.successes = self.successes + 1
+
+    def fail(self, now: datetime | None = None) -> None:
+        self.failures = self.failures + 1
+
+    def dump(self):
+        return {}
+
+    def deadline(self, now: datetime | None = None) -> datetime | None:
+        if self.budget is None or now is None:
+            return None
+
+        return now + self.budget
+
+    def data_received(self, latest, now: datetime | None = None) -> None:
+        self.received.append(latest)
+
+
+class HangingClient:
+    username = "user"
+    _contract = "1"
+
+    async def get_measure(self):
+        await asyncio.sleep(60)
+
+
+class FailingClient:
+    username = "user"
+    _contract = "1"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def get_measure(self):
+        self.calls = self.calls + 1
+        raise ideenergy.CommandError({"success": False})
+
+    async def get_historical_consumption(self, start, end):
+        self.calls = self.calls + 1
+        raise ideenergy.CommandError({"success": False})
+
+
+class EmptyHistoricalClient:
+    username = "user"
+    _contract = "1"
+
+    async def get_historical_consumption(self, start, end):
+        return {"historical": []}
+
+
+def make_coordinator(hass, api, barriers: dict) -> IDeCoordinator:
+    coordinator = IDeCoordinator(hass, api, barriers=barriers)
+    coordinator.register_sensor(
+        SimpleNamespace(I_DE_DATA_SETS=DataSetType.ALL)  # type: ignore[arg-type]
+    )
+    return coordinator
+
+
+async def test_hanging_fetch_is_cancelled_at_barrier_deadline(hass, monkeypatch):
+    monkeypatch.setattr(datacoordinator, "MIN_FETCH_TIMEOUT", 0)
+    barrier = RecordingBarrier(deadline=timedelta(seconds=0.05))
+    coordinator = make_coordinator(
+        hass, HangingClient(), {DataSetType.MEASURE: barrier}
+    )
+
+    assert coordinator.get_fetch_timeout(DataSetType.MEASURE, now=NOW) == 0.05
+
+    data = await asyncio.wait_for(
+        coordinator._async_update_data_raw(DataSetType.MEASURE, now=NOW), timeout=5
+    )
+
+    assert data == {}
+    assert coordinator.fetch_timeouts[DataSetType.MEASURE] == 1
+    assert coordinator.metrics[DataSetType.MEASURE].failures["TimeoutError"] == 1
+    assert barrier.failures == 1
+
+
+async def test_fetch_timeout_is_bounded(hass):
+    barriers = {
+        DataSetType.MEASURE: RecordingBarrier(deadline=timedelta(seconds=1)),
+        DataSetType.HISTORICAL_CONSUMPTION: RecordingBarrier(),
+        DataSetType.HISTORICAL_GENERATION: RecordingBarrier(
+            deadline=timedelta(hours=1)
+        ),
+    }
+    coordinator = make_coordinator(hass, HangingClient(), barriers)
+
+    assert (
+        coordinator.get_fetch_timeout(DataSetType.MEASURE, now=NOW)
+        == datacoordinator.MIN_FETCH_TIMEOUT
+    )
+    for dataset in (
+        DataSetType.HISTORICAL_CONSUMPTION,
+        DataSetType.HISTORICAL_GENERATION,
+    ):
+        assert (
+            coordinator.get_fetch_timeout(dataset, now=NOW)
+            == datacoordinator.FETCH_TIMEOUT
+        )
+
+
+async def test_empty_historical_fetches_count_as_empty_attempts(hass):
+    delta = timedelta(hours=1)
+    late_delta = timedelta(hours=6)
+    barrier = PublishTimeBarrier(
+        delta=delta,
+        initial_backoff=timedelta(minutes=1),
+        max_backoff=timedelta(minutes=10),
+        late_delta=late_delta,
+        max_empty_attempts=2,
+    )
+    coordinator = make_coordinator(
+        hass,
+        EmptyHistoricalClient(),
+        {DataSetType.HISTORICAL_CONSUMPTION: barrier},
+    )
+
+    now = NOW
+    for empty_attempts in range(1, 3):
+        await coordinator._async_update_data_raw(
+            DataSetType.HISTORICAL_CONSUMPTION, now=now
+        )
+        assert barrier.dump()[ATTR_EMPTY_ATTEMPTS] == empty_attempts
+        now = now + delta
+
+    assert barrier.retry_delta == late_delta
+    assert not barrier.would_allow(now=now)
+    assert barrier.would_allow(now=now - delta + late_delta)
+
+
+async def test_datasets_left_are_denied_when_breaker_opens_mid_cycle(hass):
+    api = FailingClient()
+    barriers = {
+        DataSetType.MEASURE: RecordingBarrier(),
+        DataSetType.HISTORICAL_CONSUMPTION: RecordingBarrier(),
+        DataSetType.HISTORICAL_GENERATION: RecordingBarrier(),
+    }
+    coordinator = IDeCoordinator(
+        hass,
+        api,
+        barriers=barriers,
+        breaker=CircuitBreaker(failure_threshold=1, open_period=timedelta(hours=1)),
+    )
+
+    await coordinator._async_update_data_raw(DataSetType.ALL, now=NOW)
+
+    assert api.calls == 1
+    assert barriers[DataSetType.MEASURE].failures == 1
+    for dataset in (
+        DataSetType.HISTORICAL_CONSUMPTION,
+        DataSetType.HISTORICAL_GENERATION,
+    ):
+        assert coordinator.metrics[dataset].denials == {"open": 1}
+
+    cycle = coordinator.metrics.history[-1]["datasets"]
+    assert cycle["HISTORICAL_GENERATION"]["outcome"] == "denied: open"
+
+
+async def test_adopt_takes_over_previous_state(hass):
+    previous = make_coordinator(
+        hass, EmptyHistoricalClient(), {DataSetType.MEASURE: RecordingBarrier()}
+    )
+    previous.data = {"key": "value"}
+    previous.last_update_success = False
+    previous.fetch_errors[DataSetType.MEASURE] += 1
+    previous.historical_steps[DataSetType.HISTORICAL_CONSUMPTION] = timedelta(hours=1)
+
+    coordinator = IDeCoordinator(hass, EmptyHistoricalClient(), barriers={})
+    coordinator.adopt(previous)
+
+    assert coordinator.barriers is previous.barriers
+    assert coordinator.data == {"key": "value"}
+    assert not coordinator.last_update_success
+    assert coordinator.metrics is previous.metrics
+    assert coordinator.fetch_errors[DataSetType.MEASURE] == 1
+    assert coordinator.historical_steps == previous.historical_steps
+    # Sessions belong to each client
+    assert coordinator.session is not previous.session
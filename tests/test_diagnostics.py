@@ -0,0 +1,104 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import json
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+from homeassistant.helpers.json import ExtendedJSONEncoder
+
+from custom_components.ideenergy import _build_barriers
+from custom_components.ideenergy.barrier import CircuitBreaker, estimate_next_allowed
+from custom_components.ideenergy.const import (
+    CONF_CONTRACT,
+    DATA_ATTR_HISTORICAL_CONSUMPTION,
+    DOMAIN,
+)
+from custom_components.ideenergy.datacoordinator import DataSetType, IDeCoordinator
+from custom_components.ideenergy.diagnostics import async_get_config_entry_diagnostics
+from custom_components.ideenergy.series import HOURLY, HistoricalSeries
+
+
+def make_entry() -> ConfigEntry:
+    return ConfigEntry(
+        version=1,
+        domain=DOMAIN,
+        title="CUPS ES0000000000000000XX0F",
+        data={
+            CONF_USERNAME: "someone@example.com",
+            CONF_PASSWORD: "s3cr3t",
+            CONF_CONTRACT: "123456789",
+        },
+        source="user",
+    )
+
+
+async def test_diagnostics_are_redacted_and_serializable(hass):
+    entry = make_entry()
+    coordinator = IDeCoordinator(
+        hass,
+        None,
+        barriers=_build_barriers(),
+        breaker=CircuitBreaker(failure_threshold=1, open_period=timedelta(hours=1)),
+    )
+    coordinator.data = {
+        DATA_ATTR_HISTORICAL_CONSUMPTION: {
+            "historical": HistoricalSeries(
+                datetime(2023, 6, 1), HOURLY, array("d", [1000]) * 48
+            )
+        }
+    }
+    coordinator.breaker.fail()
+    hass.data[DOMAIN] = {entry.entry_id: (coordinator, None)}
+
+    diagnostics = await async_get_config_entry_diagnostics(hass, entry)
+
+    # Serialized as the diagnostics download does, nothing identifying the account
+    dump = json.dumps(diagnostics, cls=ExtendedJSONEncoder)
+    for secret in (
+        "someone@example.com",
+        "s3cr3t",
+        "123456789",
+        "ES0000000000000000XX0F",
+    ):
+        assert secret not in dump
+
+    assert set(diagnostics["barriers"]) == {x.name for x in _build_barriers()}
+    assert diagnostics["circuit_breaker"]["dump"]["state"] == "OPEN"
+    assert diagnostics["data"]["HISTORICAL_CONSUMPTION"]["size"] == 48
+    assert diagnostics["data"]["HISTORICAL_CONSUMPTION"]["step"] == 3600
+
+
+def test_next_allowed_is_estimated_without_changing_the_barrier():
+    barrier = _build_barriers()[DataSetType.HISTORICAL_POWER_DEMAND]
+    last_success = datetime(2023, 6, 15, 10, tzinfo=timezone.utc)
+    barrier.success(now=last_success)
+    before = barrier.dump()
+
+    next_allowed = estimate_next_allowed(
+        barrier, now=last_success, horizon=timedelta(days=3)
+    )
+
+    assert next_allowed == barrier.next_slot()
+    assert barrier.dump() == before
+    assert (
+        estimate_next_allowed(barrier, now=last_success, horizon=timedelta(hours=1))
+        is None
+    )
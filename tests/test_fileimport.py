@@ -0,0 +1,157 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import csv
+import random
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from homeassistant.components import recorder
+from homeassistant.components.recorder import db_schema
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+from homeassistant_historical_sensor import recorderutil
+
+from custom_components.ideenergy.fileimport import (
+    CSV_DELIMITER,
+    async_import_file,
+    hourly_item_end,
+)
+from custom_components.ideenergy.importer import get_statistic_metadata_id
+
+STATISTIC_ID = "sensor.ideenergy_historical_consumption"
+METADATA = {
+    "has_mean": False,
+    "has_sum": True,
+    "name": "Historical consumption",
+    "source": "recorder",
+    "statistic_id": STATISTIC_ID,
+    "unit_of_measurement": "kWh",
+}
+
+MAX_PEAK_MEMORY_MB = 4
+MAX_ELAPSED_SECONDS = 60
+
+
+def generate_csv(path: Path, start: date, days: int) -> tuple[int, float]:
+    """Write an i-DE like export, returns number of rows and total consumption"""
+    rng = random.Random(0)
+    n = 0
+    total = 0.0
+
+    with path.open("w", encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh, delimiter=CSV_DELIMITER)
+        writer.writerow(["CUPS", "Fecha", "Hora", "Consumo_kWh", "Metodo_obtencion"])
+        for day in (start + timedelta(days=x) for x in range(days)):
+            midnight = datetime.combine(day, datetime.min.time())
+            hours = round(
+                (
+                    hourly_item_end(midnight + timedelta(days=1), 0)
+                    - hourly_item_end(midnight, 0)
+                ).total_seconds()
+                / 3600
+            )
+            for hour in range(1, hours + 1):
+                # Zero is a valid reading, files have them
+                value = round(rng.uniform(0, 3), 3) if hour % 5 else 0
+                writer.writerow(
+                    [
+                        "ES0000000000000000XX0F",
+                        day.strftime("%d/%m/%Y"),
+                        hour,
+                        f"{value:.3f}".replace(".", ","),
+                        "R",
+                    ]
+                )
+                n = n + 1
+                total = total + value
+
+    return n, total
+
+
+def statistics_per_local_day(hass: HomeAssistant) -> tuple[Counter, float]:
+    with recorderutil.hass_recorder_session(hass) as session:
+        metadata_id = get_statistic_metadata_id(session, STATISTIC_ID)
+        rows = session.execute(
+            sa.select(db_schema.Statistics.start_ts, db_schema.Statistics.sum)
+            .where(db_schema.Statistics.metadata_id == metadata_id)
+            .order_by(db_schema.Statistics.start_ts)
+        ).all()
+
+    per_day = Counter(
+        dt_util.as_local(dt_util.utc_from_timestamp(start_ts)).date()
+        for start_ts, _ in rows
+    )
+    return per_day, rows[-1][1]
+
+
+@pytest.fixture(scope="module")
+def export(tmp_path_factory) -> tuple[Path, int, float]:
+    """Two years of data, crossing two DST cycles and two year boundaries"""
+    path = tmp_path_factory.mktemp("export") / "consumo.csv"
+    return (path, *generate_csv(path, date(2021, 7, 1), 730))
+
+
+async def test_import_file(hass, export):
+    path, rows, total = export
+
+    t0 = time.monotonic()
+    n = await async_import_file(hass, path, METADATA)
+    await recorder.get_instance(hass).async_block_till_done()
+    elapsed = time.monotonic() - t0
+
+    per_day, last_sum = await recorder.get_instance(hass).async_add_executor_job(
+        statistics_per_local_day, hass
+    )
+
+    assert n == rows
+    assert sum(per_day.values()) == rows
+    assert abs(last_sum - total) < 1e-6
+
+    # DST days
+    for day in (date(2022, 3, 27), date(2023, 3, 26)):
+        assert per_day[day] == 23
+    for day in (date(2021, 10, 31), date(2022, 10, 30)):
+        assert per_day[day] == 25
+
+    # Year boundaries
+    for day in (date(2021, 12, 31), date(2022, 1, 1), date(2023, 1, 1)):
+        assert per_day[day] == 24
+
+    assert elapsed < MAX_ELAPSED_SECONDS
+
+
+async def test_import_file_streams_export(hass, export):
+    path, rows, _ = export
+
+    tracemalloc.start()
+    try:
+        n = await async_import_file(hass, path, METADATA)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert n == rows
+
+    # The file is read and imported in chunks, memory doesn't grow with its length
+    assert peak / 1024 / 1024 < MAX_PEAK_MEMORY_MB
@@ -0,0 +1,110 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from datetime import date, datetime
+from pathlib import Path
+
+import ideenergy
+import pytest
+
+from custom_components.ideenergy.backfill import (
+    BackfillStopped,
+    async_fetch_window_states,
+)
+from custom_components.ideenergy.barrier import (
+    BackoffBarrierDenyError,
+    Barrier,
+    BarrierDeniedError,
+    PublishTimeBarrierDenyError,
+)
+from custom_components.ideenergy.datacoordinator import DataSetType
+from custom_components.ideenergy.gaps import _get_store, async_remove_gaps_store
+
+
+class ScriptedBarrier(Barrier):
+    def __init__(self, deny_code=None):
+        self.deny_code = deny_code
+        self.failures = 0
+
+    def check(self, now: datetime | None = None) -> None:
+        if self.failures:
+            raise BarrierDeniedError(code=BackoffBarrierDenyError.BACKOFF, reason="")
+        if self.deny_code:
+            raise BarrierDeniedError(code=self.deny_code, reason="")
+
+    def success(self, now: datetime | None = None) -> None:
+        pass
+
+    def fail(self, now: datetime | None = None) -> None:
+        self.failures = self.failures + 1
+
+    def dump(self):
+        return {}
+
+
+class FailingCoordinator:
+    def __init__(self):
+        self.calls = 0
+
+    async def async_fetch_historical_range(self, dataset, start, end):
+        self.calls = self.calls + 1
+        raise ideenergy.ClientError("boom")
+
+
+async def test_gap_filling_stops_while_dataset_is_backing_off():
+    coordinator = FailingCoordinator()
+    dataset_barrier = ScriptedBarrier()
+
+    with pytest.raises(BackfillStopped):
+        await async_fetch_window_states(
+            coordinator,  # type: ignore[arg-type]
+            DataSetType.HISTORICAL_CONSUMPTION,
+            ScriptedBarrier(),  # type: ignore[arg-type]
+            date(2023, 1, 1),
+            date(2023, 2, 1),
+            dataset_barrier=dataset_barrier,
+        )
+
+    assert coordinator.calls == 1
+    assert dataset_barrier.failures == 1
+
+
+async def test_gap_filling_ignores_up_to_date_denials():
+    coordinator = FailingCoordinator()
+
+    with pytest.raises(BackfillStopped):
+        await async_fetch_window_states(
+            coordinator,  # type: ignore[arg-type]
+            DataSetType.HISTORICAL_CONSUMPTION,
+            ScriptedBarrier(),  # type: ignore[arg-type]
+            date(2023, 1, 1),
+            date(2023, 2, 1),
+            dataset_barrier=ScriptedBarrier(PublishTimeBarrierDenyError.UP_TO_DATE),
+        )
+
+    assert coordinator.calls == 1
+
+
+async def test_remove_gaps_store(hass):
+    store = _get_store(hass, "entry-1")
+    await store.async_save({"sensor.x": ["2023-01-01"]})
+    assert Path(store.path).exists()
+
+    await async_remove_gaps_store(hass, "entry-1")
+
+    assert not Path(store.path).exists()
@@ -0,0 +1,70 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+from types import SimpleNamespace
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+
+import custom_components.ideenergy as ideenergy_component
+from custom_components.ideenergy import (
+    _pop_reload_handoff,
+    _reload_handoff_key,
+    async_unload_entry,
+)
+from custom_components.ideenergy.const import CONF_CONTRACT, DATA_RELOAD_HANDOFF, DOMAIN
+
+
+def make_entry() -> ConfigEntry:
+    return ConfigEntry(
+        version=1,
+        domain=DOMAIN,
+        title="CUPS ES0000000000000000XX0F",
+        data={CONF_USERNAME: "user", CONF_PASSWORD: "password", CONF_CONTRACT: "1"},
+        source="user",
+    )
+
+
+async def unloaded_entry(hass) -> tuple[ConfigEntry, object]:
+    entry = make_entry()
+    coordinator = SimpleNamespace(platforms=[])
+    hass.data[DOMAIN] = {
+        entry.entry_id: (coordinator, None),
+        DATA_RELOAD_HANDOFF: {
+            entry.entry_id: (_reload_handoff_key(entry), coordinator, {}, None)
+        },
+    }
+
+    assert await async_unload_entry(hass, entry)
+    return entry, coordinator
+
+
+async def test_reload_handoff_is_reused(hass):
+    entry, coordinator = await unloaded_entry(hass)
+
+    assert _pop_reload_handoff(hass, entry) == (coordinator, {})
+
+
+async def test_reload_handoff_is_dropped_if_not_set_up_again(hass, monkeypatch):
+    monkeypatch.setattr(ideenergy_component, "RELOAD_HANDOFF_MAX_AGE", 0.05)
+    entry, _ = await unloaded_entry(hass)
+
+    await asyncio.sleep(0.1)
+
+    assert entry.entry_id not in hass.data[DOMAIN][DATA_RELOAD_HANDOFF]
@@ -0,0 +1,82 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+import threading
+
+from custom_components.ideenergy.const import (
+    EXECUTOR_CONVERSION_THRESHOLD,
+    LOOP_YIELD_CHUNK,
+)
+from custom_components.ideenergy.offload import async_chunked, async_convert
+
+
+def _thread_and_sum(values):
+    return threading.get_ident(), sum(values)
+
+
+async def test_small_conversions_run_inline(hass):
+    values = list(range(EXECUTOR_CONVERSION_THRESHOLD - 1))
+    thread, total = await async_convert(hass, len(values), _thread_and_sum, values)
+
+    assert thread == threading.get_ident()
+    assert total == sum(values)
+
+
+async def test_large_conversions_run_in_the_executor(hass):
+    values = list(range(EXECUTOR_CONVERSION_THRESHOLD))
+    thread, total = await async_convert(hass, len(values), _thread_and_sum, values)
+
+    assert thread != threading.get_ident()
+    assert total == sum(values)
+
+
+async def test_chunks_yield_to_the_loop():
+    produced = 0
+
+    def _lazy():
+        nonlocal produced
+        for x in range(LOOP_YIELD_CHUNK * 2 + 1):
+            produced = produced + 1
+            yield x
+
+    ticks = 0
+
+    async def _ticker():
+        nonlocal ticks
+        while True:
+            ticks = ticks + 1
+            await asyncio.sleep(0)
+
+    ticker = asyncio.create_task(_ticker())
+    await asyncio.sleep(0)
+
+    chunks = []
+    ticks_seen = []
+    async for chunk in async_chunked(_lazy()):
+        chunks.append(chunk)
+        ticks_seen.append(ticks)
+        # Consumed chunk by chunk
+        assert produced <= len(chunks) * LOOP_YIELD_CHUNK + 1
+
+    ticker.cancel()
+
+    assert [len(x) for x in chunks] == [LOOP_YIELD_CHUNK, LOOP_YIELD_CHUNK, 1]
+    assert sum(chunks, []) == list(range(LOOP_YIELD_CHUNK * 2 + 1))
+    # Other tasks ran between chunks
+    assert ticks_seen[0] < ticks_seen[1] < ticks_seen[2]
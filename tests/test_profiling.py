@@ -0,0 +1,57 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+from pathlib import Path
+
+from homeassistant.exceptions import HomeAssistantError
+
+from custom_components.ideenergy import profiling
+from custom_components.ideenergy.const import DOMAIN
+from custom_components.ideenergy.services import SERVICE_PROFILE, async_setup_services
+
+
+async def test_concurrent_profile_calls_start_one_session(hass):
+    await async_setup_services(hass)
+
+    results = await asyncio.gather(
+        *[
+            hass.services.async_call(
+                DOMAIN, SERVICE_PROFILE, {"duration": 60}, blocking=True
+            )
+            for _ in range(2)
+        ],
+        return_exceptions=True,
+    )
+
+    assert sum(isinstance(x, HomeAssistantError) for x in results) == 1
+
+    session = profiling._session
+    assert session is not None
+    session.done.set()
+    while profiling.is_profiling():
+        await asyncio.sleep(0.01)
+
+    # Results are written in the executor once the session is over
+    config_dir = Path(hass.config.config_dir)
+    for _ in range(100):
+        if len(list(config_dir.glob("ideenergy_profile_*"))) == 2:
+            break
+        await asyncio.sleep(0.05)
+    else:
+        raise AssertionError("profiling results not written")
@@ -0,0 +1,90 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from datetime import datetime, timedelta, timezone
+
+from custom_components.ideenergy import _build_barriers
+from custom_components.ideenergy.barrier import ATTR_PHASE, BackoffBarrier
+from custom_components.ideenergy.datacoordinator import IDeCoordinator
+from custom_components.ideenergy.scheduler import Scheduler
+
+
+def test_phases_are_spread_evenly_and_sorted_by_entry():
+    scheduler = Scheduler()
+    phases: dict[str, float] = {}
+
+    for entry_id in ["c", "a", "d", "b"]:
+        scheduler.register(
+            entry_id, lambda x, entry_id=entry_id: phases.update({entry_id: x})
+        )
+
+    assert phases == {"a": 0.0, "b": 0.25, "c": 0.5, "d": 0.75}
+
+
+def test_phases_are_updated_when_entries_leave():
+    scheduler = Scheduler()
+    phases: dict[str, float] = {}
+
+    unregister = {
+        entry_id: scheduler.register(
+            entry_id, lambda x, entry_id=entry_id: phases.update({entry_id: x})
+        )
+        for entry_id in ["a", "b", "c"]
+    }
+    unregister["a"]()
+    unregister["a"]()  # Unloading twice is harmless
+
+    assert phases["b"] == 0.0
+    assert phases["c"] == 0.5
+
+
+def test_phases_spread_barrier_slots():
+    scheduler = Scheduler()
+    barriers = {
+        entry_id: BackoffBarrier(
+            delta=timedelta(hours=1),
+            initial_backoff=timedelta(minutes=1),
+            max_backoff=timedelta(minutes=10),
+        )
+        for entry_id in ["a", "b", "c", "d"]
+    }
+    for entry_id, barrier in barriers.items():
+        scheduler.register(entry_id, barrier.set_phase)
+
+    # Every barrier succeeds at its own slot, slots stay spread over the period
+    slot = datetime(2023, 1, 2, tzinfo=timezone.utc)
+    for barrier in barriers.values():
+        barrier.success(now=slot)
+        barrier.success(now=barrier.next_slot())
+
+    assert sorted(x.next_slot() for x in barriers.values()) == [
+        slot + timedelta(hours=2, minutes=x) for x in (0, 15, 30, 45)
+    ]
+
+
+async def test_phase_reaches_every_coordinator_barrier(hass):
+    scheduler = Scheduler()
+    coordinators = {
+        entry_id: IDeCoordinator(hass, None, barriers=_build_barriers())
+        for entry_id in ["a", "b"]
+    }
+    for entry_id, coordinator in coordinators.items():
+        scheduler.register(entry_id, coordinator.set_schedule_phase)
+
+    assert coordinators["b"].schedule_phase == 0.5
+    assert all(x.dump()[ATTR_PHASE] == 0.5 for x in coordinators["b"].barriers.values())
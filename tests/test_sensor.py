@@ -0,0 +1,152 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import asyncio
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import sqlalchemy as sa
+from homeassistant.components import recorder
+from homeassistant.components.recorder import db_schema
+from homeassistant_historical_sensor import recorderutil
+
+from custom_components.ideenergy.datacoordinator import (
+    DATA_ATTR_HISTORICAL_CONSUMPTION,
+    IDeCoordinator,
+)
+from custom_components.ideenergy.importer import (
+    StatisticsImporter,
+    get_statistic_lock,
+    get_statistic_metadata_id,
+)
+from custom_components.ideenergy.sensor import HistoricalConsumption
+from custom_components.ideenergy.series import HOURLY, HistoricalSeries
+
+ENTITY_ID = "sensor.ideenergy_historical_consumption"
+DEVICE_INFO = {"identifiers": {("cups", "ES0000000000000000XX0F")}}
+
+# 1 kWh per hour, i-DE returns Wh
+HOURS = 48
+SERIES = HistoricalSeries(datetime(2023, 6, 1), HOURLY, array("d", [1000]) * HOURS)
+# 2023-06-01 00:00 in Madrid
+LATEST_DT = datetime(2023, 5, 31, 22, tzinfo=timezone.utc) + timedelta(hours=HOURS)
+
+
+def make_sensor(hass, statistics_only: bool = False) -> HistoricalConsumption:
+    coordinator = IDeCoordinator(hass, None, barriers={})
+    coordinator.data = {DATA_ATTR_HISTORICAL_CONSUMPTION: {"historical": SERIES}}
+
+    sensor = HistoricalConsumption(
+        config_entry=None,
+        device_info=DEVICE_INFO,
+        coordinator=coordinator,
+        statistics_only=statistics_only,
+    )
+    sensor.hass = hass
+    sensor.entity_id = ENTITY_ID
+
+    return sensor
+
+
+async def count_written(hass) -> tuple[int, int, float | None]:
+    """Number of states, number of statistics and last sum in the recorder"""
+
+    def fn():
+        with recorderutil.hass_recorder_session(hass) as session:
+            n_states = session.execute(
+                sa.select(sa.func.count())
+                .select_from(db_schema.States)
+                .join(db_schema.StatesMeta)
+                .where(db_schema.StatesMeta.entity_id == ENTITY_ID)
+            ).scalar()
+
+            metadata_id = get_statistic_metadata_id(session, ENTITY_ID)
+            sums = (
+                session.execute(
+                    sa.select(db_schema.Statistics.sum)
+                    .where(db_schema.Statistics.metadata_id == metadata_id)
+                    .order_by(db_schema.Statistics.start_ts)
+                )
+                .scalars()
+                .all()
+            )
+
+        return n_states, len(sums), sums[-1] if sums else None
+
+    await recorder.get_instance(hass).async_block_till_done()
+    return await recorder.get_instance(hass).async_add_executor_job(fn)
+
+
+async def test_states_and_statistics_are_written(hass):
+    sensor = make_sensor(hass)
+    await sensor.async_write_ha_historical_states()
+
+    assert await count_written(hass) == (HOURS, HOURS, HOURS)
+    assert sensor._latest_written_dt == LATEST_DT
+
+
+async def test_statistics_are_retried_if_their_import_fails(hass, monkeypatch):
+    async def _fail(*args, **kwargs):
+        raise RuntimeError("import failed")
+
+    sensor = make_sensor(hass)
+    monkeypatch.setattr(StatisticsImporter, "async_add", _fail)
+    with pytest.raises(RuntimeError):
+        await sensor.async_write_ha_historical_states()
+    monkeypatch.undo()
+
+    # States are in, statistics aren't
+    assert await count_written(hass) == (HOURS, 0, None)
+    assert sensor._latest_written_dt is None
+
+    await sensor.async_write_ha_historical_states()
+
+    assert await count_written(hass) == (HOURS, HOURS, HOURS)
+    assert sensor._latest_written_dt == LATEST_DT
+
+
+async def test_statistics_only_mode_skips_states(hass):
+    sensor = make_sensor(hass, statistics_only=True)
+    await sensor.async_write_ha_historical_states()
+
+    assert await count_written(hass) == (0, HOURS, HOURS)
+    assert sensor._latest_written_dt == LATEST_DT
+
+    # Nothing new, nothing written
+    await sensor.async_write_ha_historical_states()
+    assert await count_written(hass) == (0, HOURS, HOURS)
+
+    # Restored from the last statistic
+    assert await make_sensor(hass, True)._async_get_latest_statistic_dt() == LATEST_DT
+
+
+async def test_statistics_import_waits_for_other_imports(hass):
+    sensor = make_sensor(hass)
+    lock = get_statistic_lock(hass, ENTITY_ID)
+
+    async with lock:
+        task = asyncio.create_task(sensor.async_write_ha_historical_states())
+        await asyncio.sleep(0.1)
+
+        # States are written, statistics wait for the lock
+        assert not task.done()
+        assert await count_written(hass) == (HOURS, 0, None)
+
+    await task
+    assert await count_written(hass) == (HOURS, HOURS, HOURS)
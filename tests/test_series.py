@@ -0,0 +1,107 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+import math
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from custom_components.ideenergy.series import (
+    HOURLY,
+    QUARTER_HOURLY,
+    detect_step,
+    series_from_api_data,
+)
+
+ZONE = ZoneInfo("Europe/Madrid")
+BASE = datetime(2023, 6, 1)
+
+
+def api_data(values: list[float | None], base: datetime = BASE) -> list[dict]:
+    # ideenergy.Client stamps the nth reading as base + n hours, whatever the
+    # actual resolution is
+    return [
+        {"start": base + timedelta(hours=idx), "value": value}
+        for idx, value in enumerate(values)
+    ]
+
+
+def test_detect_step():
+    week = BASE + timedelta(days=7)
+
+    assert detect_step(0, BASE, week) == HOURLY
+    assert detect_step(24 * 7, BASE, week) == HOURLY
+    # DST days have 25 hours
+    assert detect_step(25, BASE, BASE + timedelta(days=1)) == HOURLY
+    assert detect_step(24 * 7 + 2, BASE, week) == QUARTER_HOURLY
+    assert detect_step(96 * 7, BASE, week) == QUARTER_HOURLY
+
+
+def test_series_positions_are_recovered_from_api_stamps():
+    values: list[float | None] = [float(x) for x in range(96)]
+    values[10] = None
+    historical = api_data(values)
+    # Missing reading
+    del historical[20]
+
+    series = series_from_api_data(historical, base=BASE, end=BASE + timedelta(days=1))
+
+    assert series.start == BASE
+    assert series.step == QUARTER_HOURLY
+    assert series.end == BASE + timedelta(days=1)
+    assert math.isnan(series.values[10])
+    assert math.isnan(series.values[20])
+    assert [x for x in series.values if not math.isnan(x)] == [
+        float(x) for x in range(96) if x not in (10, 20)
+    ]
+
+
+def test_series_base_is_local_midnight():
+    base = BASE + timedelta(hours=13, minutes=45)
+    series = series_from_api_data(
+        api_data([1.0] * 24), base=base, end=BASE + timedelta(days=1)
+    )
+
+    assert series.start == BASE
+    assert series.step == HOURLY
+
+
+def test_series_step_can_be_forced():
+    series = series_from_api_data(
+        api_data([1.0] * 4),
+        base=BASE,
+        end=BASE + timedelta(days=1),
+        step=QUARTER_HOURLY,
+    )
+
+    assert series.step == QUARTER_HOURLY
+    assert series.end == BASE + timedelta(hours=1)
+
+
+def test_series_readings_are_evenly_spaced_across_dst():
+    # Spring forward day has 23 hours
+    base = datetime(2023, 3, 26)
+    series = series_from_api_data(
+        api_data([1.0] * 23, base=base), base=base, end=base + timedelta(days=1)
+    )
+    items = list(series.utc_items(ZONE))
+
+    assert len(items) == 23
+    assert items[0][0] == datetime(2023, 3, 25, 23, tzinfo=timezone.utc)
+    assert items[-1][1] == datetime(2023, 3, 26, 22, tzinfo=timezone.utc)
+    assert all(end - start == HOURLY for start, end, _ in items)
+    assert series.latest_day(ZONE) == date(2023, 3, 26)
@@ -0,0 +1,140 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import ideenergy
+
+from custom_components.ideenergy.barrier import Barrier, BarrierDeniedError
+from custom_components.ideenergy.const import SESSION_WARMUP_LEAD
+from custom_components.ideenergy.datacoordinator import DataSetType, IDeCoordinator
+from custom_components.ideenergy.session import UserSessionManager
+
+TIMEOUT = timedelta(seconds=60)
+
+
+class FakeClient:
+    username = "user"
+    _contract = "1"
+
+    def __init__(self, fail: bool = False):
+        self.user_session_timeout = TIMEOUT
+        self.fail = fail
+        self.logins = 0
+        # Naive local time, like ideenergy.Client
+        self._login_ts: datetime | None = None
+
+    async def login(self) -> None:
+        self.logins = self.logins + 1
+        if self.fail:
+            raise ideenergy.ClientError("login failed")
+
+        self._login_ts = datetime.now()
+
+
+class FixedBarrier(Barrier):
+    def __init__(self, allow: bool):
+        self.allow = allow
+
+    def check(self, now: datetime | None = None) -> None:
+        if not self.allow:
+            raise BarrierDeniedError(code=None, reason="denied")
+
+    def success(self, now: datetime | None = None) -> None:
+        pass
+
+    def fail(self, now: datetime | None = None) -> None:
+        pass
+
+    def dump(self):
+        return {}
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+async def test_warmup_logs_in_only_when_needed():
+    api = FakeClient()
+    session = UserSessionManager(api, renew_margin=timedelta(seconds=15))
+
+    assert not session.is_warm()
+    assert await session.async_warmup()
+    assert api.logins == 1
+
+    now = utcnow()
+    assert session.is_warm(now=now)
+    assert not await session.async_warmup(now=now)
+    assert api.logins == 1
+
+
+async def test_session_expires_renew_margin_before_timeout():
+    api = FakeClient()
+    session = UserSessionManager(api, renew_margin=timedelta(seconds=15))
+    await session.async_warmup()
+
+    expires_at = session.expires_at
+    assert expires_at is not None
+    assert session.is_warm(now=expires_at - timedelta(seconds=16))
+    assert not session.is_warm(now=expires_at - timedelta(seconds=14))
+    assert not session.is_warm(now=expires_at + timedelta(seconds=1))
+
+    assert await session.async_warmup(now=expires_at - timedelta(seconds=14))
+    assert api.logins == 2
+
+
+def make_coordinator(hass, api: FakeClient, allow: bool) -> IDeCoordinator:
+    coordinator = IDeCoordinator(
+        hass, api, barriers={DataSetType.MEASURE: FixedBarrier(allow)}
+    )
+    coordinator.register_sensor(
+        SimpleNamespace(I_DE_DATA_SETS=DataSetType.MEASURE)  # type: ignore[arg-type]
+    )
+    return coordinator
+
+
+async def test_prepare_measure_attempt_warms_up_session(hass):
+    api = FakeClient()
+    coordinator = make_coordinator(hass, api, allow=True)
+
+    await coordinator.async_prepare_measure_attempt(utcnow())
+
+    assert api.logins == 1
+    assert coordinator.session.is_warm(
+        now=utcnow() + timedelta(seconds=SESSION_WARMUP_LEAD)
+    )
+
+
+async def test_prepare_measure_attempt_skips_denied_attempts(hass):
+    api = FakeClient()
+    coordinator = make_coordinator(hass, api, allow=False)
+
+    await coordinator.async_prepare_measure_attempt(utcnow())
+
+    assert api.logins == 0
+
+
+async def test_prepare_measure_attempt_survives_login_errors(hass):
+    api = FakeClient(fail=True)
+    coordinator = make_coordinator(hass, api, allow=True)
+
+    await coordinator.async_prepare_measure_attempt(utcnow())
+
+    assert api.logins == 1
+    assert not coordinator.session.is_warm()
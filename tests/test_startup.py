@@ -0,0 +1,44 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from benchmark_startup import run_scenario
+from fakeide import FakeIDeServer
+
+ENTRIES = 20
+ACCOUNTS = 5
+LATENCY = 0.02
+
+
+async def test_startup_queue_logs_in_once_per_account():
+    server = FakeIDeServer(
+        latency=LATENCY, contracts_per_user=ENTRIES // ACCOUNTS, seed=0
+    )
+    async with server.run() as base_url:
+        elapsed, n_ok = await run_scenario(
+            server, base_url, ENTRIES, ACCOUNTS, queued=True
+        )
+
+    calls = sum(server.calls.values())
+
+    assert n_ok == ENTRIES
+    assert server.logins == ACCOUNTS
+    assert server.bans == 0
+    # One login per account, a contract selection and the details per entry
+    assert calls <= ACCOUNTS + 2 * ENTRIES
+    # Accounts run in parallel, faster than making every call one after another
+    assert elapsed < calls * LATENCY
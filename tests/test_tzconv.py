@@ -0,0 +1,94 @@
+# Copyright (C) 2021-2022 Luis López <luis@cuarentaydos.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from custom_components.ideenergy.tzconv import NonExistentTimeError, TransitionTable
+
+MADRID = ZoneInfo("Europe/Madrid")
+
+
+@pytest.mark.parametrize(
+    "start",
+    [
+        datetime(2024, 3, 30),
+        # Power demand peaks, for example, start at any minute
+        datetime(2024, 3, 30, 10, 37),
+        datetime(2024, 3, 30, 10, 37, 12, 500000),
+    ],
+)
+def test_transitions_are_exact_whatever_the_start(start):
+    table = TransitionTable(MADRID, start, datetime(2024, 11, 1))
+
+    assert table.transitions == [
+        (datetime(2024, 3, 31, 1, tzinfo=timezone.utc), timedelta(hours=2)),
+        (datetime(2024, 10, 27, 1, tzinfo=timezone.utc), timedelta(hours=1)),
+    ]
+
+    # Spring forward, 02:00 → 03:00
+    assert table.to_utc(datetime(2024, 3, 31, 1, 59)) == datetime(
+        2024, 3, 31, 0, 59, tzinfo=timezone.utc
+    )
+    with pytest.raises(NonExistentTimeError):
+        table.to_timestamp(datetime(2024, 3, 31, 2, 10))
+    assert table.to_utc(datetime(2024, 3, 31, 3, 10)) == datetime(
+        2024, 3, 31, 1, 10, tzinfo=timezone.utc
+    )
+
+    # Fall back, 03:00 → 02:00
+    assert table.to_utc(datetime(2024, 10, 27, 2, 10)) == datetime(
+        2024, 10, 27, 0, 10, tzinfo=timezone.utc
+    )
+    assert table.to_utc(datetime(2024, 10, 27, 2, 10), fold=1) == datetime(
+        2024, 10, 27, 1, 10, tzinfo=timezone.utc
+    )
+
+
+def test_conversions_match_zoneinfo():
+    start = datetime(2023, 1, 1, 0, 17)
+    table = TransitionTable(MADRID, start, datetime(2025, 1, 1))
+
+    naive = start
+    while naive < datetime(2025, 1, 1):
+        for fold in (0, 1):
+            expected = naive.replace(tzinfo=MADRID, fold=fold)
+            # Round trip fails for non-existent times
+            if (
+                expected.astimezone(timezone.utc)
+                .astimezone(MADRID)
+                .replace(tzinfo=None)
+                != naive
+            ):
+                continue
+
+            assert table.to_utc(naive, fold=fold) == expected.astimezone(timezone.utc)
+
+        naive = naive + timedelta(minutes=37)
+
+
+def test_sorted_conversion_resolves_repeated_times():
+    naives = [datetime(2024, 10, 27, x, 30) for x in (1, 2, 2, 3)]
+    table = TransitionTable(MADRID, naives[0], naives[-1])
+
+    assert [
+        datetime.fromtimestamp(x, timezone.utc).hour  # type: ignore[arg-type]
+        for x in table.to_timestamps(naives)
+    ] == [23, 0, 1, 2]